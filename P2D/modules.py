@@ -1,8 +1,78 @@
+import os
 import numpy as np
+import scipy.linalg
 import torch
 from torch import nn
 # from pytorch_wavelets import DWTForward, DWTInverse
 
+fit_cache = {} # fitted predictors by key, shared across model instances
+
+def grid_idx(sz, n_span):
+	""" 
+	fixed-grid indices in [0, n_span] for downsampling to sz points
+	"""
+	if sz % 2 == 0: # even size
+		sz_half = int(sz/2)
+		scale = sz_half - 0.5
+		grid_temp = (torch.arange(sz) + 0.5 - sz_half) / scale
+	else: # odd size
+		sz_half = int(sz/2)
+		scale = sz_half 
+		grid_temp = (torch.arange(sz) - sz_half) / scale
+	return torch.round(n_span * (grid_temp.view(-1) + 1) / 2).long().numpy()
+
+def index_matrix(idx, N):
+	""" 
+	dense one-hot selection matrix for index array idx (..., sz) -> (..., sz, N)
+	"""
+	idx = torch.from_numpy(idx)
+	X = torch.zeros(tuple(idx.shape) + (N,)) # template
+	X.scatter_(-1, idx.unsqueeze(-1), 1.0)
+	return X
+
+def dft_rows(idx, N, n_cols, inverse=False):
+	""" 
+	rows idx of the N-point DFT matrix np.fft.fft(np.eye(N)) (or np.fft.ifft(np.eye(N))), first n_cols columns,
+	without forming the N x N matrix; phases are reduced mod N in integers for accuracy
+	"""
+	sign = 1 if inverse else -1
+	F = np.exp(sign * 2j * np.pi * (np.outer(idx, np.arange(n_cols)) % N) / N)
+	return F / N if inverse else F
+
+def odir_pinv(Q, delta):
+	""" 
+	ODIR-regularized pseudoinverse (Q^H Q)^{-1} Q^H, off-diagonals of Q^H Q scaled by 1/(1+delta);
+	solved by Cholesky (general solve if Q^H Q is not positive definite)
+	"""
+	QH = np.conj(Q).T
+	QT_Q = np.dot(QH, Q)
+	if delta != 0:
+		Q_diag = np.diag(np.diag(QT_Q))
+		QT_Q = (QT_Q - Q_diag) / (1 + delta) + Q_diag
+	try:
+		return scipy.linalg.cho_solve(scipy.linalg.cho_factor(QT_Q), QH)
+	except np.linalg.LinAlgError:
+		return np.linalg.solve(QT_Q, QH)
+
+def cached_fit(key, compute, cache_dir=None):
+	""" 
+	memoize compute() under key in fit_cache and, if cache_dir is given, on disk as {cache_dir}/{key}.npy
+	"""
+	if key in fit_cache:
+		return fit_cache[key]
+	fname = None if type(cache_dir) == type(None) else f"{cache_dir}/{key}.npy"
+	if type(fname) != type(None) and os.path.exists(fname):
+		arr = np.load(fname)
+	else:
+		arr = compute()
+		if type(fname) != type(None):
+			os.makedirs(cache_dir, exist_ok=True)
+			with open(f"{fname}.{os.getpid()}.tmp", "wb") as f: # write then rename; safe with concurrent fits
+				np.save(f, arr)
+			os.replace(f"{fname}.{os.getpid()}.tmp", fname)
+	fit_cache[key] = arr
+	return arr
+
 class P2D:
 	def __init__(self, M, N, N_t):
 		self.M = M
@@ -12,46 +82,35 @@ class P2D:
 
 	def make_downsample_matrix(self, sz, N):
 		""" 
-		returns fixed-grid downsampling matrix taking N -> sz
-		"""
-		if sz % 2 == 0: # even size
-			sz_half = int(sz/2)
-			scale = sz_half - 0.5
-			grid_temp = (torch.arange(sz) + 0.5 - sz_half) / scale
-		else: # odd size
-			sz_half = int(sz/2)
-			scale = sz_half 
-			grid_temp = (torch.arange(sz) - sz_half) / scale
-		X = torch.zeros((sz, N)) # template
-		i = 0
-		for val_y in grid_temp.view(-1):
-			j = int(torch.round((N-1) * (val_y + 1) / 2))
-			X[i,j] = 1.0
-			i += 1
-		self.P = X
-
-	def fit(self, delta=0.5):
+		fixed-grid downsampling N -> sz, stored as selected indices P_idx (sz,)
+		"""
+		self.P_idx = grid_idx(sz, N-1)
+		self.P_dense = None
+
+	@property
+	def P(self):
+		# dense one-hot downsampling matrix (sz, N), built on first use
+		if type(self.P_dense) == type(None):
+			self.P_dense = index_matrix(self.P_idx, self.N)
+		return self.P_dense
+
+	def downsample(self, x):
+		"""
+		x (..., N) -> (..., M)
+		"""
+		return x[..., self.P_idx]
+
+	def fit(self, delta=0.5, cache_dir=None):
 		"""
 		return coefficients to predict truncated delay domain based on downsampled pilots:
 		\bar{h}_d = Q_pre \bar{h}_f
 			  = (Q_t^TQ_t)^{-1}Q_t \bar{h}_f
+		Q_pre is memoized by (M, N, N_t, D, delta) in memory and, with cache_dir, on disk
 		"""
-		P = self.P
 		M, N, N_t = self.M, self.N, self.N_t
-	
-		I = np.eye(N)
-		F = np.fft.fft(I) # get fft matrix
-
-		Q = np.dot(P, F) 
-		Q = Q[:,:N_t] # truncate
-		QT_Q = np.dot(np.conj(Q).T, Q)
-		Q_diag = np.diag(np.diag(QT_Q))
-		if delta != 0:
-			QT_Q = (QT_Q - Q_diag) / (1 + delta) + Q_diag
-		Q_inv = np.linalg.inv(QT_Q)
-		Q_pre = np.dot(Q_inv, np.conj(Q).T)
-
-		self.Q_pre = Q_pre
+		# Q = P F truncated to N_t taps = selected rows of the DFT matrix
+		key = f"p2d_M{M}_N{N}_Nt{N_t}_D1_delta{delta}"
+		self.Q_pre = cached_fit(key, lambda: odir_pinv(dft_rows(self.P_idx, N, N_t), delta), cache_dir=cache_dir)
 
 	def predict(self, x):
 		return np.dot(x, self.Q_pre.T)
@@ -67,74 +126,76 @@ class P2D_Diag:
 
 	def make_downsample_matrix(self, sz, N, D):
 		""" 
-		returns D fixed-grid downsampling matrces that take N -> sz
-		"""
-		N = N - D
-		if sz % 2 == 0: # even size
-			sz_half = int(sz/2)
-			scale = sz_half - 0.5
-			grid_temp = (torch.arange(sz) + 0.5 - sz_half) / scale
-		else: # odd size
-			sz_half = int(sz/2)
-			scale = sz_half 
-			grid_temp = (torch.arange(sz) - sz_half) / scale
-		# print(grid_temp)
-		X = torch.zeros((D, sz, N+D)) # template
-		j = 0
-		for val_y in grid_temp.view(-1):
-			k = int(torch.round(N * (val_y + 1) / 2))
-			for i in range(D):
-				# print(f"X[{i},{j+i},{k+i}] with j={j}, k={k}")
-				X[i,j,k+i] = 1.0
-			j += 1
-		self.P = X
-
-	def fit(self, delta=0.5):
+		D fixed-grid downsampling patterns N -> sz, stored as selected indices P_idx (D, sz);
+		pattern i is the base grid over N-D shifted by i
+		"""
+		self.P_idx = grid_idx(sz, N-D)[None,:] + np.arange(D)[:,None]
+		self.P_dense = None
+
+	@property
+	def P(self):
+		# dense one-hot downsampling matrices (D, sz, N), built on first use
+		if type(self.P_dense) == type(None):
+			self.P_dense = index_matrix(self.P_idx, self.N)
+		return self.P_dense
+
+	def fit(self, delta=0.5, cache_dir=None):
 		"""
 		return coefficients to predict truncated delay domain based on downsampled pilots:
 		\bar{h}_d = Q_pre \bar{h}_f
 			  = (Q_t^TQ_t)^{-1}Q_t \bar{h}_f
+		Q_pre is memoized by (M, N, N_t, D, delta) in memory and, with cache_dir, on disk
 		"""
-		P = self.P
 		D, M, N, N_t = self.D, self.M, self.N, self.N_t
-	
-		I = np.eye(N)
-		F = np.fft.fft(I) # get fft matrix
-
-		Q_pre = np.zeros((D, M, N_t), dtype="complex")
-		for i in range(D):
-			P_i = P[i,:,:]
-			Q = np.dot(P_i, F) 
-			Q = Q[:,:N_t] # truncate
-			QT_Q = np.dot(np.conj(Q).T, Q)
-			Q_diag = np.diag(np.diag(QT_Q))
-			if delta != 0:
-				QT_Q = (QT_Q - Q_diag) / (1 + delta) + Q_diag
-			Q_inv = np.linalg.inv(QT_Q)
-			Q_pre[i,:,:] = np.dot(Q_inv, np.conj(Q).T).T
-
-		self.Q_pre = Q_pre
+		key = f"p2d_diag_M{M}_N{N}_Nt{N_t}_D{D}_delta{delta}"
+		self.Q_pre = cached_fit(key, lambda: self.fit_patterns(delta), cache_dir=cache_dir)
 
-	def downsample(self, x):
+	def fit_patterns(self, delta):
+		"""
+		pattern i selects DFT rows P_idx[0]+i, so Q_i = Q_0 diag(phi_i) with phi_i[n] = exp(-2j*pi*i*n/N);
+		phi_i is unitary and commutes with the ODIR scaling, so Q_pre_i = diag(conj(phi_i)) Q_pre_0 -- one solve for all D patterns
+		"""
+		D, N, N_t = self.D, self.N, self.N_t
+		Q_pre_0 = odir_pinv(dft_rows(self.P_idx[0], N, N_t), delta) # (N_t, M)
+		phi_conj = dft_rows(np.arange(D), N, N_t, inverse=True) * N # (D, N_t)
+		return np.transpose(phi_conj[:,:,None] * Q_pre_0[None,:,:], (0,2,1)) # (D, M, N_t)
+
+	def check_fit_patterns(self, delta, rtol=1e-6):
+		"""
+		max relative deviation of fit_patterns(delta) from solving each pattern directly,
+		odir_pinv(dft_rows(P_idx[i], N, N_t), delta); raises AssertionError above rtol
+		"""
+		Q_pre = self.fit_patterns(delta)
+		Q_ref = np.stack([odir_pinv(dft_rows(self.P_idx[i], self.N, self.N_t), delta).T for i in range(self.D)])
+		err = np.max(np.abs(Q_pre - Q_ref)) / np.max(np.abs(Q_ref))
+		assert err <= rtol, f"P2D_Diag.fit_patterns deviates from per-pattern odir_pinv by {err:.3e} (M={self.M}, N={self.N}, N_t={self.N_t}, D={self.D}, delta={delta})"
+		return err
+
+	def apply_diag(self, x, mats, out_dim):
+		"""
+		row i of x (..., N_s, N_in) is multiplied by mats[i % D] (N_in, out_dim);
+		rows sharing a pilot pattern are stacked into one matmul, over all leading (batch) axes at once
+		"""
 		D = self.D
-		N_s, N_f = x.shape
-		y = np.zeros((N_s, self.M), dtype="complex")
-		for i in range(N_s):
-			d = i % D
-			P = self.P[d,:,:]
-			y[i,:] = np.dot(x[i,:], P.T)
-			# y[:,i,:] = np.expand_dims(np.dot(P, x[:,i,:]), 1)
+		y = np.zeros(x.shape[:-1] + (out_dim,), dtype="complex")
+		for d in range(D):
+			y[..., d::D, :] = np.matmul(x[..., d::D, :], mats[d])
 		return y
 
+	def downsample(self, x):
+		"""
+		x (..., N_s, N) -> (..., N_s, M), row i downsampled with pilot pattern P_idx[i % D] (gather)
+		"""
+		N_s = x.shape[-2]
+		idx = self.P_idx[np.arange(N_s) % self.D] # (N_s, M)
+		y = np.take_along_axis(x, np.broadcast_to(idx, x.shape[:-1] + (self.M,)), axis=-1)
+		return y.astype("complex", copy=False)
+
 	def predict(self, x):
-		D = self.D
-		N_s, M_f = x.shape
-		y = np.zeros((N_s, self.N_t), dtype="complex")
-		for i in range(N_s):
-			d = i % D
-			Q_pre = self.Q_pre[d,:,:]
-			y[i,:] = np.dot(x[i,:], Q_pre)
-		return y	
+		"""
+		x (..., N_s, M) -> (..., N_s, N_t), row i predicted with Q_pre[i % D]
+		"""
+		return self.apply_diag(x, self.Q_pre, self.N_t)
 
 class P2AD:
 	# pilots to angular-delay
@@ -144,69 +205,54 @@ class P2AD:
 		self.M_b = M_b # downsample size (spatial)
 		self.N_b = N_b # original size (spatial)
 		self.N_t = N_t # truncation value (delay axis)
-		self.P = self.make_downsample_matrix(M, N)
-		self.D = self.make_downsample_matrix(M_b, N_b)
+		self.P_idx = self.make_downsample_matrix(M, N)
+		self.D_idx = self.make_downsample_matrix(M_b, N_b)
+		self.P_dense = None
+		self.D_dense = None
 
 	def make_downsample_matrix(self, sz, N):
 		""" 
-		returns fixed-grid downsampling matrix taking N -> sz
-		"""
-		if sz % 2 == 0: # even size
-			sz_half = int(sz/2)
-			scale = sz_half - 0.5
-			grid_temp = (torch.arange(sz) + 0.5 - sz_half) / scale
-		else: # odd size
-			sz_half = int(sz/2)
-			scale = sz_half 
-			grid_temp = (torch.arange(sz) - sz_half) / scale
-		X = torch.zeros((sz, N)) # template
-		i = 0
-		for val_y in grid_temp.view(-1):
-			j = int(torch.round((N-1) * (val_y + 1) / 2))
-			X[i,j] = 1.0
-			i += 1
-		return X
-
-	def fit(self, delta=0.5, delta_ang=0.5):
+		returns fixed-grid downsampling N -> sz as selected indices (sz,)
+		"""
+		return grid_idx(sz, N-1)
+
+	@property
+	def P(self):
+		# dense one-hot downsampling matrix, frequency (M, N), built on first use
+		if type(self.P_dense) == type(None):
+			self.P_dense = index_matrix(self.P_idx, self.N)
+		return self.P_dense
+
+	@property
+	def D(self):
+		# dense one-hot downsampling matrix, spatial (M_b, N_b), built on first use
+		if type(self.D_dense) == type(None):
+			self.D_dense = index_matrix(self.D_idx, self.N_b)
+		return self.D_dense
+
+	def downsample(self, x):
+		"""
+		x (N, N_b) -> (M, M_b), frequency then spatial
+		"""
+		return x[self.P_idx,:][:,self.D_idx]
+
+	def fit(self, delta=0.5, delta_ang=0.5, cache_dir=None):
 		"""
 		return coefficients to predict truncated delay domain based on downsampled pilots:
 		\bar{h}_d = Q_pre \bar{h}_f
 			  = (Q_t^TQ_t)^{-1}Q_t \bar{h}_f
+		Q_pre/R_pre are memoized by (M, N, N_t, D, delta) in memory and, with cache_dir, on disk
 		"""
-		P, D = self.P, self.D
 		M, N, N_t = self.M, self.N, self.N_t
 		M_b, N_b = self.M_b, self.N_b
 
-		# get R matrix
-		I = np.eye(N_b)
-		F = np.fft.ifft(I) # get ifft matrix
-		R = np.dot(D, F) 
-
-		# pseudoinverse of D w/ ODIR regularization
-		RT_R = np.dot(np.conj(R).T, R)
-		R_diag = np.diag(np.diag(RT_R))
-		if delta_ang != 0:
-			RT_R = (RT_R - R_diag) / (1 + delta_ang) + R_diag
-		R_inv = np.linalg.inv(RT_R)
-		R_pre = np.dot(R_inv, np.conj(R).T)
-
-		self.R_pre = R_pre
-	
-		# get Q matrix
-		I = np.eye(N)
-		F = np.fft.fft(I) # get fft matrix
-		Q = np.dot(P, F) 
-		Q = Q[:,:N_t] # truncate
-
-		# pseudo inverse of Q w/ ODIR regularization
-		QT_Q = np.dot(np.conj(Q).T, Q)
-		Q_diag = np.diag(np.diag(QT_Q))
-		if delta != 0:
-			QT_Q = (QT_Q - Q_diag) / (1 + delta) + Q_diag
-		Q_inv = np.linalg.inv(QT_Q)
-		Q_pre = np.dot(Q_inv, np.conj(Q).T)
+		# R = D F^{-1}: selected rows of the ifft matrix; pseudoinverse w/ ODIR regularization
+		key = f"p2ad_R_M{M_b}_N{N_b}_Nt{N_b}_D1_delta{delta_ang}"
+		self.R_pre = cached_fit(key, lambda: odir_pinv(dft_rows(self.D_idx, N_b, N_b, inverse=True), delta_ang), cache_dir=cache_dir)
 
-		self.Q_pre = Q_pre
+		# Q = P F truncated to N_t taps; pseudoinverse w/ ODIR regularization
+		key = f"p2d_M{M}_N{N}_Nt{N_t}_D1_delta{delta}"
+		self.Q_pre = cached_fit(key, lambda: odir_pinv(dft_rows(self.P_idx, N, N_t), delta), cache_dir=cache_dir)
 
 	def predict(self, x):
 		# delay, then angle
@@ -215,3 +261,9 @@ class P2AD:
 		x = np.dot(x, self.R_pre.T)
 		x = np.transpose(x,(1,0))
 		return x
+
+if __name__ == "__main__":
+	# shared-solve P2D_Diag.fit_patterns vs. one odir_pinv per pattern
+	for M, N, N_t, D, delta in [(16, 256, 32, 2, 0.5), (32, 1024, 32, 4, 0.5), (12, 128, 16, 3, 1.0)]:
+		err = P2D_Diag(M, N, N_t, D).check_fit_patterns(delta)
+		print(f"P2D_Diag(M={M}, N={N}, N_t={N_t}, D={D}) delta={delta}: max rel. deviation {err:.3e}")
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import pickle as pkl
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .modules import P2D_Diag
+
+grid_data = {} # sweep inputs for run_cell, memory-mapped in each worker
+
+def add_noise_batch(x_down, x_pow, SNR_list, s, e):
+	"""
+	complex gaussian noise for samples s:e of x_down at every SNR level, (n_snr, e-s, N_s, M)
+	noise of each sample is scaled by (x_pow / noise_pow) / 10^(snr/10), as in snr_csi_sample_p2d.py
+	"""
+	snr_lin = 10**(np.array(SNR_list)/10)
+	shape = (len(SNR_list), e-s) + x_down.shape[1:]
+	noise = np.random.normal(0,1.0,size=shape)+1j*np.random.normal(0,1.0,size=shape)
+	noise_pow = np.sum(np.real(noise)**2 + np.imag(noise)**2, axis=(2,3))
+	snr_scale = (x_pow[None,s:e] / noise_pow) / snr_lin[:,None]
+	return noise * snr_scale[:,:,None,None]
+
+def snr_sweep(model, x_down, y_test, SNR_list, max_bytes=2**30):
+	"""
+	MSE/NMSE of model.predict(x_down + noise) against y_test for each SNR (dB) in SNR_list
+	x_down = downsampled pilots (n_all, N_s, M); y_test = truncated targets (n_all, N_s, N_t)
+	-> predict is linear, so the noiseless error y_test - predict(x_down) is computed once and only noise is predicted
+	-> noise for all SNR levels is one batched tensor, generated in sample chunks of at most ~max_bytes
+	returns [MSE, NMSE], lists over SNR_list
+	"""
+	n_all = x_down.shape[0]
+	n_snr = len(SNR_list)
+	x_pow = np.real(np.sum(np.conj(x_down)*x_down, axis=(1,2)))
+	err_clean = y_test - model.predict(x_down)
+
+	sample_bytes = 4 * n_snr * int(np.prod(x_down.shape[1:])) * 16 # noise draws, complex noise, scaled noise
+	chunk_size = max(1, int(max_bytes // sample_bytes))
+	SE = np.zeros((n_snr, n_all))
+	for s in range(0, n_all, chunk_size):
+		e = min(s+chunk_size, n_all)
+		noise_down = add_noise_batch(x_down, x_pow, SNR_list, s, e)
+		err = err_clean[None,s:e] - model.predict(noise_down)
+		SE[:,s:e] = np.sum(np.real(err)**2 + np.imag(err)**2, axis=(2,3))
+
+	MSE = np.sum(SE, axis=1) / n_all
+	NMSE = np.sum(SE / x_pow[None,:], axis=1) / n_all
+	return [list(MSE), list(NMSE)]
+
+def sweep_file_loc(mod_str, i_batch, n_all, D, sz, delta, out_dir="results"):
+	return f"{out_dir}/{mod_str}_ibatch{i_batch}_samples{n_all}_D{D}_sz{sz}_delta{delta:3.2f}.pkl"
+
+def save_sweep_results(file_loc, SNR_list, MSE, NMSE):
+	pkl_dict = {
+		"SNR": SNR_list,
+		"MSE": MSE,
+		"NMSE": NMSE
+	}
+	# write then rename, so an interrupted sweep never leaves a partial result behind
+	with open(f"{file_loc}.{os.getpid()}.tmp", "wb") as f:
+		pkl.dump(pkl_dict, f)
+		f.close()
+	os.replace(f"{file_loc}.{os.getpid()}.tmp", file_loc)
+
+def load_grid_data(data_dir):
+	# worker initializer: read-only memmaps share one copy of the inputs through the page cache
+	grid_data["freq"] = np.load(f"{data_dir}/freq_all_t.npy", mmap_mode="r")
+	grid_data["y_test"] = np.load(f"{data_dir}/y_test.npy", mmap_mode="r")
+	np.random.seed() # forked workers would otherwise share the parent's noise stream
+
+def run_cell(cell, cfg, seed=None):
+	"""
+	fit P2D_Diag for cell = (D, delta, sz), downsample grid_data["freq"], sweep SNR levels, save result pickle
+	"""
+	D, delta, sz = cell
+	if type(seed) != type(None):
+		np.random.seed(seed)
+	freq, y_test = grid_data["freq"], grid_data["y_test"]
+	model = P2D_Diag(sz, cfg["n_subcarriers"], cfg["N_t"], D)
+	model.fit(delta=delta, cache_dir=cfg["cache_dir"])
+	x_down = model.downsample(freq)
+	MSE, NMSE = snr_sweep(model, x_down, y_test, cfg["SNR_list"], max_bytes=cfg["max_bytes"])
+	save_sweep_results(sweep_file_loc(cfg["mod_str"], cfg["i_batch"], freq.shape[0], D, sz, delta, out_dir=cfg["out_dir"]), cfg["SNR_list"], MSE, NMSE)
+	return [cell, MSE, NMSE]
+
+def run_grid(freq_all_t, y_test, cells, SNR_list, n_subcarriers, N_t, mod_str, i_batch, n_workers=0, out_dir="results", data_dir=None, cache_dir=None, seed=None, max_bytes=2**30):
+	"""
+	run snr_sweep for each (D, delta, sz) in cells, writing one result pickle per cell
+	freq_all_t = frequency-domain data (n_all, N_s, n_subcarriers); y_test = truncated targets (n_all, N_s, N_t)
+	-> cells whose result pickle already exists are skipped, so interrupted sweeps resume
+	-> n_workers > 0: inputs are saved once to data_dir as .npy and memory-mapped by each worker process;
+	   if data_dir is None, a temporary directory is used and removed afterwards
+	-> cache_dir is passed to fit() so workers share fitted predictors on disk
+	-> seed: cell i uses seed+i (reproducible regardless of scheduling)
+	returns {cell: [MSE, NMSE]} for the cells run
+	"""
+	n_all = freq_all_t.shape[0]
+	todo = [(i, cell) for i, cell in enumerate(cells) if not os.path.exists(sweep_file_loc(mod_str, i_batch, n_all, cell[0], cell[2], cell[1], out_dir=out_dir))]
+	print(f"--- P2D grid: {len(todo)}/{len(cells)} cells to run ({len(cells)-len(todo)} done) ---")
+	cfg = {"SNR_list": SNR_list, "n_subcarriers": n_subcarriers, "N_t": N_t, "mod_str": mod_str, "i_batch": i_batch, "out_dir": out_dir, "cache_dir": cache_dir, "max_bytes": max_bytes}
+	cell_seed = lambda i: None if type(seed) == type(None) else seed + i
+	results = {}
+	if len(todo) == 0:
+		return results
+	if n_workers == 0:
+		grid_data["freq"], grid_data["y_test"] = freq_all_t, y_test
+		for i, cell in todo:
+			cell, MSE, NMSE = run_cell(cell, cfg, seed=cell_seed(i))
+			results[cell] = [MSE, NMSE]
+			print(f"-> D={cell[0]} | delta={cell[1]} | sz={cell[2]} done")
+		return results
+
+	tmp_dir = type(data_dir) == type(None)
+	data_dir = tempfile.mkdtemp(prefix=f"p2d_grid_ibatch{i_batch}_") if tmp_dir else data_dir
+	try:
+		os.makedirs(data_dir, exist_ok=True)
+		np.save(f"{data_dir}/freq_all_t.npy", freq_all_t)
+		np.save(f"{data_dir}/y_test.npy", y_test)
+		with ProcessPoolExecutor(max_workers=n_workers, initializer=load_grid_data, initargs=(data_dir,)) as executor:
+			futures = [executor.submit(run_cell, cell, cfg, cell_seed(i)) for i, cell in todo]
+			for future in as_completed(futures):
+				cell, MSE, NMSE = future.result()
+				results[cell] = [MSE, NMSE]
+				print(f"-> D={cell[0]} | delta={cell[1]} | sz={cell[2]} done")
+	finally:
+		if tmp_dir:
+			shutil.rmtree(data_dir, ignore_errors=True)
+	return results
@@ -0,0 +1,230 @@
+# benchmark.py
+# time hot paths (data loading, scoring, quantization, P2D, sum rate) on synthetic CSI; report throughput/peak memory as json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+import h5py
+import torch
+import numpy as np
+import scipy.io as sio
+
+sys.path.append(".")
+from utils.data_tools import dataset_pipeline_col, dataset_pipeline_full
+from utils.NMSE_performance import get_NMSE, calc_NMSE
+from utils.cosine_sim_performance import cosine_similarity_batch
+from utils.sumrate_performance import maximal_ratio_transmission, sum_rate
+from utils.unpack_json import get_keys_from_json
+from utils.timing import rss_mb, rss_peak_mb
+from models.latent_quantizers import SoftQuantize
+from P2D.modules import P2D_Diag
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-e", "--env", type=str, default="indoor", help="environment (either indoor or outdoor); selects config for data shapes")
+parser.add_argument("-n", "--n_samples", type=int, default=1000, help="number of synthetic samples")
+parser.add_argument("-nf", "--n_freq", type=int, default=256, help="number of delay/frequency bins for full CSI (dataset_pipeline_full, cosine similarity, P2D)")
+parser.add_argument("-r", "--repeats", type=int, default=5, help="timed repeats per benchmark (after one warmup)")
+parser.add_argument("-o", "--out_file", type=str, default=None, help="json file for results (printed to stdout if not given)")
+parser.add_argument("-k", "--only", type=str, nargs="+", default=None, help="run only benchmarks whose names start with any of these")
+parser.add_argument("-s", "--seed", type=int, default=0, help="seed for synthetic data")
+parser.add_argument("-v", "--verbose", type=int, default=0, help="1 -> keep stdout of benchmarked functions")
+
+def write_mat_h5(file_loc, key, data):
+    # MATLAB v7.3 layout: reversed axis order, as read back by np.transpose(f[key][()], [3,2,1,0])
+    with h5py.File(file_loc, "w") as f:
+        f.create_dataset(key, data=np.transpose(data, [3,2,1,0]))
+        f.close()
+
+def synthetic_csi(shape, rng, n_decay=8):
+    """
+    complex gaussian CSI with power decaying along axis -2 (delay), so truncation/normalization see realistic energy profiles
+    """
+    decay = np.exp(-np.arange(shape[-2]) / n_decay)[:,None]
+    return (rng.standard_normal(shape) + 1j*rng.standard_normal(shape)) * np.sqrt(decay / 2)
+
+def make_synthetic_dataset(data_dir, n_samples, T, n_delay, n_freq, n_angle, rng):
+    """
+    write synthetic timeslot files (dataset_pipeline_col), batch files (dataset_pipeline_full) and pow_diff files
+    returns [dataset_spec_col, dataset_spec_full, diff_spec]
+    """
+    for timeslot in range(1, T+1):
+        x_t = synthetic_csi((n_samples, n_delay, n_angle), rng)
+        x_t = np.stack([np.real(x_t), np.imag(x_t)], axis=1).astype("float32") # (n_samples, 2, n_delay, n_angle)
+        write_mat_h5(f"{data_dir}/H_user_t{timeslot}_32all.mat", "Hur_down_t1", x_t)
+        sio.savemat(f"{data_dir}/P_diff_T{timeslot}.mat", {"pow_diff": rng.uniform(0, 1e-3, size=(n_samples, 1))})
+    x_full = synthetic_csi((n_samples, T, n_freq, n_angle), rng)
+    write_mat_h5(f"{data_dir}/H_full_b0.mat", "H_full", x_full.astype("complex64")) # stored as (real, imag) compound, like MATLAB
+    dataset_spec_col = [f"{data_dir}/H_user_t", "32all.mat", "Hur_down_t1", 0.75]
+    dataset_spec_full = [f"{data_dir}/H_full_b", ".mat", "H_full", "H_full", 0.75]
+    diff_spec = [f"{data_dir}/P_diff_T"]
+    return [dataset_spec_col, dataset_spec_full, diff_spec]
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class PeakRSS(object):
+    """
+    sample RSS on a background thread while in context; delta_mb = peak RSS over the context minus RSS on entry
+    unlike tracemalloc, this includes torch/native allocations; allocations shorter than interval_s may be missed
+    """
+    def __init__(self, interval_s=1e-3):
+        self.interval_s = interval_s
+        self.delta_mb = None
+
+    def sample(self):
+        while not self.stop.wait(self.interval_s):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self.start = rss_mb()
+        if self.start is None: # rss unavailable on this platform
+            return self
+        self.peak = self.start
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.start is None:
+            return
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, rss_mb())
+        self.delta_mb = self.peak - self.start
+
+def bench(fn, n_samples, repeats=5, verbose=0):
+    """
+    time fn() over repeats (after one warmup), then measure its peak RSS increase in one more call
+    returns dict of timings, throughput (samples/s) and peak memory (MB)
+    """
+    quiet = contextlib.redirect_stdout(open(os.devnull, "w")) if verbose == 0 else contextlib.nullcontext()
+    with quiet:
+        fn() # warmup
+        times = []
+        for i in range(repeats):
+            t_start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t_start)
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        with PeakRSS() as peak_rss:
+            fn()
+    t_med = float(np.median(times))
+    result = {
+        "n_samples": n_samples,
+        "repeats": repeats,
+        "time_median_s": t_med,
+        "time_min_s": float(np.min(times)),
+        "time_max_s": float(np.max(times)),
+        "samples_per_sec": n_samples / max(t_med, 1e-12),
+        "peak_rss_delta_mb": peak_rss.delta_mb,
+        "process_rss_peak_mb": rss_peak_mb(), # high-water mark of the whole run so far, not of this benchmark
+    }
+    if torch.cuda.is_available():
+        result["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    return result
+
+def make_benchmarks(opt, data_dir, rng):
+    """
+    returns list of (name, fn, n_samples); inputs are built up front so only the hot path is timed
+    """
+    json_config = "config/csinet_indoor_cost2100_pow.json" if opt.env == "indoor" else "config/csinet_outdoor_cost2100_pow.json"
+    img_channels, data_format, T, n_delay = get_keys_from_json(json_config, keys=["img_channels", "data_format", "T", "n_delay"])
+    N, n_freq, n_angle = opt.n_samples, opt.n_freq, 32
+    spec_col, spec_full, diff_spec = make_synthetic_dataset(data_dir, N, T, n_delay, n_freq, n_angle, rng)
+
+    # scoring inputs, (N, T, 2, n_delay, n_angle)
+    x_test = rng.standard_normal((N, T, img_channels, n_delay, n_angle)).astype("float32")
+    x_hat = x_test + 0.1*rng.standard_normal(x_test.shape).astype("float32")
+    pow_diff = rng.uniform(0, 1e-3, size=(N, T, 1))
+    x_test_c = x_test[:,:,0] + 1j*x_test[:,:,1] # (N, T, n_delay, n_angle)
+    x_hat_c = x_hat[:,:,0] + 1j*x_hat[:,:,1]
+
+    # cosine similarity inputs, full frequency CSI (N, T, n_freq, n_angle)
+    A = synthetic_csi((N, T, n_freq, n_angle), rng)
+    B = A + 0.1*synthetic_csi(A.shape, rng)
+
+    # soft quantization, r=512 latent features, L=1024 centers of dim m=4
+    r, L, m = 512, 1024, 4
+    sq = SoftQuantize(r, L, m, sigma=1.0, sigma_trainable=False, bs=N)
+    sq.init_centers(torch.randn(m, L))
+    z = torch.randn(N, r)
+    def sq_forward(quant_mode):
+        sq.quant_mode = quant_mode
+        with torch.no_grad():
+            return sq(z)
+
+    # P2D, pilots in frequency (N, n_angle, n_freq) downsampled to n_freq/8
+    p2d = P2D_Diag(n_freq // 8, n_freq, n_delay, 4)
+    p2d.fit(delta=0.1)
+    x_down = p2d.downsample(np.transpose(A[:,0], (0,2,1)))
+
+    # sum rate, K=8 users, M=n_angle antennas, MRT precoder
+    K = 8
+    H = torch.complex(torch.randn(N, n_angle, K), torch.randn(N, n_angle, K))
+    gamma, V = maximal_ratio_transmission(torch.transpose(H, 1, 2), 1.0)
+    V = gamma[:,None,None] * torch.transpose(V, 1, 2)
+
+    return [
+        ("dataset_pipeline_col", lambda: dataset_pipeline_col(0, False, spec_col, diff_spec, 0, img_channels=img_channels, img_height=n_delay, img_width=n_angle, data_format=data_format, T=T, n_truncate=n_delay), N),
+        ("dataset_pipeline_full", lambda: dataset_pipeline_full(1, 0, 0, False, spec_full, diff_spec, 0, img_height=n_freq, img_width=n_angle, T=T, return_pow=False), N),
+        ("get_NMSE", lambda: [get_NMSE(x_hat_c[:,t], x_test_c[:,t], pow_diff_timeslot=pow_diff[:,t]) for t in range(T)], N),
+        ("calc_NMSE", lambda: calc_NMSE(x_hat, x_test, T=T, pow_diff=pow_diff), N),
+        ("cosine_similarity_numpy", lambda: cosine_similarity_batch(A, B), N),
+        ("cosine_similarity_torch", lambda: cosine_similarity_batch(A, B, backend="torch"), N),
+        ("SoftQuantize.forward_soft", lambda: sq_forward(1), N),
+        ("SoftQuantize.forward_hard", lambda: sq_forward(4), N),
+        ("P2D_Diag.predict", lambda: p2d.predict(x_down), N),
+        ("sum_rate", lambda: sum_rate(H, V, 1.0), N),
+    ]
+
+if __name__ == "__main__":
+    opt = parser.parse_args()
+    rng = np.random.default_rng(opt.seed)
+    torch.manual_seed(opt.seed)
+    data_dir = tempfile.mkdtemp(prefix="csi_bench_")
+    try:
+        results = {}
+        for name, fn, n in make_benchmarks(opt, data_dir, rng):
+            if type(opt.only) != type(None) and not any(name.startswith(k) for k in opt.only):
+                continue
+            results[name] = bench(fn, n, repeats=opt.repeats, verbose=opt.verbose)
+            print(f"--- {name}: {results[name]['samples_per_sec']:.1f} samples/s | median {results[name]['time_median_s']:.4f}s | peak +{results[name]['peak_rss_delta_mb'] or 0.0:.1f}MB ---", file=sys.stderr)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "env": opt.env,
+            "n_samples": opt.n_samples,
+            "n_freq": opt.n_freq,
+            "repeats": opt.repeats,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "cpu_count": os.cpu_count(),
+            "cuda": torch.cuda.is_available(),
+        },
+        "results": results,
+    }
+    if type(opt.out_file) != type(None):
+        with open(opt.out_file, "w") as f:
+            json.dump(report, f, indent=4)
+            f.close()
+        print(f"--- Wrote results to {opt.out_file} ---", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=4))
@@ -0,0 +1,175 @@
+import time
+import numpy as np
+
+RANS_L = np.uint64(1 << 23) # lower bound of normalized rANS state; state lives in [RANS_L, 2^31)
+BYTE_BITS = np.uint64(8)
+BYTE_MASK = np.uint64(0xff)
+
+class RANSCoder(object):
+    def __init__(self, L, n_features, scale_bits=16, per_feature=False):
+        """
+        rANS entropy coder for hard quantization indices from SoftQuantize.encode
+        L = number of cluster centers (alphabet size)
+        n_features = number of indices per sample (SoftQuantize.n_features)
+        scale_bits = precision of quantized symbol frequencies (frequencies sum to 2^scale_bits)
+        per_feature = False -> one symbol distribution shared by all features; True -> one distribution per feature
+
+        each sample is coded as its own byte payload; samples of a batch are coded in lockstep as interleaved,
+        vectorized rANS lanes, so encode/decode cost is n_features numpy steps per batch
+        """
+        assert(L <= (1 << (scale_bits-1)))
+        assert(scale_bits <= 16)
+        self.L = L
+        self.n_features = n_features
+        self.scale_bits = scale_bits
+        self.per_feature = per_feature
+        self.freq = None
+        self.cum = None
+
+    def fit(self, idx, alpha=1.0):
+        """
+        estimate symbol frequencies from training assignments idx (N, n_features)
+        alpha = additive smoothing, so centers unseen in training stay encodable
+        """
+        idx = self.as_array(idx)
+        if self.per_feature:
+            offset = np.arange(self.n_features)[None,:]*self.L
+            counts = np.bincount((idx + offset).ravel(), minlength=self.n_features*self.L).reshape(self.n_features, self.L)
+        else:
+            counts = np.bincount(idx.ravel(), minlength=self.L)[None,:]
+        self.freq = quantize_freqs(counts + alpha, self.scale_bits)
+        self.cum = np.concatenate([np.zeros((self.freq.shape[0], 1), dtype=np.uint64), np.cumsum(self.freq, axis=1, dtype=np.uint64)], axis=1)
+        return self
+
+    def as_array(self, idx):
+        # accept torch tensors from SoftQuantize.encode
+        idx = idx.cpu().numpy() if hasattr(idx, "cpu") else np.asarray(idx)
+        return idx.reshape(idx.shape[0], self.n_features).astype(np.int64)
+
+    def table(self, j):
+        t = j if self.per_feature else 0
+        return self.freq[t], self.cum[t]
+
+    def encode(self, idx):
+        """
+        encode indices (B, n_features) -> list of B byte payloads
+        """
+        assert(type(self.freq) != type(None))
+        idx = self.as_array(idx)
+        B = idx.shape[0]
+        scale_bits = np.uint64(self.scale_bits)
+        cap = 4 + self.n_features*(self.scale_bits // 8 + 2)
+        buf = np.zeros((B, cap), dtype=np.uint8)
+        ptr = np.full(B, cap, dtype=np.int64) # payloads are written back to front
+        x = np.full(B, RANS_L, dtype=np.uint64)
+        lanes = np.arange(B)
+        # rANS is LIFO: encode in reverse so decoding runs forward
+        for j in reversed(range(self.n_features)):
+            freq_t, cum_t = self.table(j)
+            freq, start = freq_t[idx[:,j]], cum_t[idx[:,j]]
+            x_max = ((RANS_L >> scale_bits) << BYTE_BITS) * freq
+            mask = x >= x_max
+            while mask.any():
+                ptr[mask] -= 1
+                buf[lanes[mask], ptr[mask]] = x[mask] & BYTE_MASK
+                x[mask] >>= BYTE_BITS
+                mask = x >= x_max
+            x = ((x // freq) << scale_bits) + (x % freq) + start
+        # flush state, little-endian
+        ptr -= 4
+        for k in range(4):
+            buf[lanes, ptr+k] = (x >> np.uint64(8*k)) & BYTE_MASK
+        return [buf[i, ptr[i]:].tobytes() for i in range(B)]
+
+    def decode(self, payloads):
+        """
+        decode list of B byte payloads -> indices (B, n_features)
+        """
+        assert(type(self.freq) != type(None))
+        B = len(payloads)
+        scale_bits = np.uint64(self.scale_bits)
+        slot_mask = np.uint64((1 << self.scale_bits) - 1)
+        max_len = max(len(p) for p in payloads)
+        buf = np.zeros((B, max_len), dtype=np.uint8)
+        for i, p in enumerate(payloads):
+            buf[i, :len(p)] = np.frombuffer(p, dtype=np.uint8)
+        x = np.zeros(B, dtype=np.uint64)
+        for k in range(4):
+            x |= buf[:,k].astype(np.uint64) << np.uint64(8*k)
+        ptr = np.full(B, 4, dtype=np.int64)
+        lanes = np.arange(B)
+        idx = np.zeros((B, self.n_features), dtype=np.int64)
+        for j in range(self.n_features):
+            freq_t, cum_t = self.table(j)
+            slot = x & slot_mask
+            s = np.searchsorted(cum_t, slot, side="right") - 1
+            idx[:,j] = s
+            x = freq_t[s] * (x >> scale_bits) + slot - cum_t[s]
+            mask = x < RANS_L
+            while mask.any():
+                x[mask] = (x[mask] << BYTE_BITS) | buf[lanes[mask], ptr[mask]].astype(np.uint64)
+                ptr[mask] += 1
+                mask = x < RANS_L
+        return idx
+
+    def ideal_bits(self, idx):
+        """
+        code length of each sample under the fitted model, -sum_j log2(freq/2^scale_bits), (B,)
+        """
+        idx = self.as_array(idx)
+        bits = np.zeros(idx.shape[0])
+        for j in range(self.n_features):
+            freq_t, _ = self.table(j)
+            bits += self.scale_bits - np.log2(freq_t[idx[:,j]].astype(np.float64))
+        return bits
+
+    def rate_report(self, idx, verify=True):
+        """
+        encode/decode idx, return feedback rate and throughput
+        -> bits_per_sample: mean payload size (state flush included)
+        -> ideal_bits_per_sample: mean model code length
+        -> raw_bits_per_sample: fixed-length coding, n_features*log2(L)
+        -> encode/decode_samples_per_sec
+        """
+        idx = self.as_array(idx)
+        B = idx.shape[0]
+        t_start = time.time()
+        payloads = self.encode(idx)
+        t_enc = time.time() - t_start
+        t_start = time.time()
+        idx_hat = self.decode(payloads)
+        t_dec = time.time() - t_start
+        if verify:
+            assert(np.array_equal(idx, idx_hat))
+        return {
+            "bits_per_sample": 8*np.mean([len(p) for p in payloads]),
+            "ideal_bits_per_sample": np.mean(self.ideal_bits(idx)),
+            "raw_bits_per_sample": self.n_features*np.log2(self.L),
+            "encode_samples_per_sec": B / max(t_enc, 1e-12),
+            "decode_samples_per_sec": B / max(t_dec, 1e-12),
+        }
+
+def quantize_freqs(counts, scale_bits):
+    """
+    integer symbol frequencies from counts (n_tables, L): every symbol gets at least 1, rows sum to 2^scale_bits
+    """
+    M = 1 << scale_bits
+    p = counts / np.sum(counts, axis=1, keepdims=True)
+    freq = np.maximum(1, np.floor(p*M)).astype(np.int64)
+    # absorb rounding error in the most probable symbol of each row
+    rows = np.arange(freq.shape[0])
+    top = np.argmax(freq, axis=1)
+    freq[rows, top] += M - np.sum(freq, axis=1)
+    assert(np.all(freq >= 1))
+    return freq.astype(np.uint64)
+
+if __name__ == "__main__":
+    # round trip on synthetic, skewed assignments
+    L, n_features, N = 1024, 64, 5000
+    rng = np.random.default_rng(0)
+    p = rng.dirichlet(0.1*np.ones(L))
+    idx_train = rng.choice(L, size=(N, n_features), p=p)
+    idx_test = rng.choice(L, size=(N, n_features), p=p)
+    coder = RANSCoder(L, n_features).fit(idx_train)
+    for key, val in coder.rate_report(idx_test).items():
+        print(f"{key}: {val:.2f}")
@@ -21,7 +21,7 @@ class SoftQuantize(torch.nn.Module):
         self.n_features = int(r/m)
         self.softmax = torch.nn.Softmax(dim=2)
         self.sigma_eps = 1e-4
-        self.quant_mode = 0 # 0 = pass through (no quantization), 1 = soft quantization, 2 = return softmax outputs, 3 = hard quantization with self.hard_sigma
+        self.quant_mode = 0 # 0 = pass through (no quantization), 1 = soft quantization, 2 = return softmax outputs, 3 = hard quantization with self.hard_sigma, 4 = hard quantization by nearest center (inference only)
         self.q_hot_template = torch.zeros(bs, self.n_features, self.L).to(device)
         self.device = device
         
@@ -39,22 +39,54 @@ class SoftQuantize(torch.nn.Module):
         b = x.shape[0]
         if self.quant_mode == 0:
             return x # no quantization in latent layer
+        elif self.quant_mode == 4:
+            return self.decode(self.encode(x)) # hard quantized outputs
         else:
-            z = x.view(b, self.n_features, self.m, 1).repeat(1, 1, 1, self.L)
-            c = self.c.view(1,1,self.m,self.L).repeat(b, self.n_features, 1, 1)
+            z = x.view(b, self.n_features, self.m)
             if self.sigma_trainable:
                 sigma = self.sigma.relu() + self.sigma_eps 
             elif self.quant_mode == 3:
                 sigma = self.hard_sigma
             else:
                 sigma = self.sigma
-            q = self.softmax(-sigma*torch.sum(torch.pow(z - c, 2), 2))
+            q = self.softmax(-sigma*self.center_dist(z))
             if self.quant_mode == 2:
                 return q # softmax outputs
-            c = self.c.view(1,self.m,self.L).repeat(b,1,1).transpose(2,1)
-            out = torch.matmul(q, c)
+            out = torch.matmul(q, self.c.view(self.m, self.L).t())
             return out.view(b, self.r) # soft quantized outputs
 
+    def center_dist(self, z):
+        """
+        squared distances from z (b, n_features, m) to each center, (b, n_features, L)
+        ||z-c||^2 = ||z||^2 - 2z.c + ||c||^2 without repeating z or c; ||z||^2 is kept so distances are true
+        (they are scaled by hard_sigma in quant_mode 3), and the result is clamped at 0 against float cancellation
+        """
+        c = self.c.view(self.m, self.L)
+        return (torch.sum(z*z, 2, keepdim=True) - 2*torch.matmul(z, c) + torch.sum(c*c, 0)).clamp(min=0)
+
+    def encode(self, x, chunk_size=None):
+        """
+        hard quantization: index of nearest center for each latent feature, (b, n_features) long on x's device
+        chunk_size -> run the argmin search over chunks of the batch, bounding memory to (chunk_size, n_features, L);
+        chunks are moved to the centers' device, so a CPU-resident validation set can be encoded on GPU
+        """
+        b = x.shape[0]
+        chunk_size = b if type(chunk_size) == type(None) else chunk_size
+        z = x.view(b, self.n_features, self.m)
+        idx = torch.empty(b, self.n_features, dtype=torch.long, device=x.device)
+        with torch.no_grad():
+            for s in range(0, b, chunk_size):
+                z_chunk = z[s:s+chunk_size].to(self.c.device)
+                idx[s:s+chunk_size] = torch.argmin(self.center_dist(z_chunk), dim=2).to(x.device)
+        return idx
+
+    def decode(self, idx):
+        """
+        latent features (b, r) from center indices (b, n_features)
+        """
+        b = idx.shape[0]
+        return self.c.view(self.m, self.L).t()[idx.to(self.c.device)].view(b, self.r)
+
 class SoftQuantizeMCR(SoftQuantize):
     def __init__(self, *args, **kwargs):
         """
@@ -75,12 +107,10 @@ class SoftQuantizeMCR(SoftQuantize):
         $\mathbf \Pi$ is the partition matrix
         """
         b = x.shape[0]
-        z = x.view(b, self.n_features, self.m, 1).repeat(1, 1, 1, self.L)
-        c = self.c.view(1,1,self.m,self.L).repeat(b, self.n_features, 1, 1)
+        z = x.view(b, self.n_features, self.m)
         sigma = self.hard_sigma if self.quant_mode == "hard" else self.sigma
-        q = self.softmax(-sigma*torch.sum(torch.pow(z - c, 2), 2))
-        c = self.c.view(1,self.m,self.L).repeat(b,1,1).transpose(2,1)
-        out = torch.matmul(q, c)
+        q = self.softmax(-sigma*self.center_dist(z))
+        out = torch.matmul(q, self.c.view(self.m, self.L).t())
         # Pi = torch.diag_embed(q.transpose(1,2)) # reshape to (b, L, m, m) [?]
         # print(f"-> Pi.size()={Pi.size()} -> sum batches (m={Pi.size(-1)}): {torch.sum(Pi.view(b,-1), axis=1)}")
         return [out.view(b, self.r), x.view(b, self.n_features, self.m), q] # soft quantized outputs and softmax output
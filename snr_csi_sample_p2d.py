@@ -5,12 +5,11 @@ import math
 import torch
 import argparse
 import numpy as np 
-import pickle as pkl
 from tqdm import tqdm
 from utils.data_tools import dataset_pipeline_full_batchwise, DatasetToDevice
 from utils.unpack_json import get_keys_from_json
 from utils.parsing import str2bool
-from P2D.modules import P2D_Diag
+from P2D.sweep import run_grid
 from torch.utils.data import DataLoader
 
 parser = argparse.ArgumentParser()
@@ -19,7 +18,9 @@ parser.add_argument("-g", "--gpu_num", type=int, default=0, help="number for tor
 # parser.add_argument("-b", "--n_batch", type=int, default=5, help="number of batches to load from target dir")
 parser.add_argument("-bo", "--batch_offset", type=int, default=0, help="batch offset w.r.t. mat file numbering")
 parser.add_argument("-a", "--angular_bool", type=str2bool, default=True, help="bool for angular domain (alternatively, spatial)")
-parser.add_argument("-sz", "--downsample_size", type=int, default=128, help="size after frequency downsampling")
+parser.add_argument("-sz", "--downsample_size", type=int, nargs="+", default=[128], help="size(s) after frequency downsampling")
+parser.add_argument("-w", "--n_workers", type=int, default=0, help="number of worker processes for (D, delta, sz) grid; 0 runs serially")
+parser.add_argument("-fc", "--fit_cache_dir", type=str, default=None, help="dir for cached P2D fits")
 
 SNR_list = [-20, -15, -10, -5, 0, 5, 10, 15, 20]
 D_list = [1, 2, 4, 8, 16]
@@ -41,7 +42,7 @@ img_channels = 2
 crop_height = 32
 crop_width = 32
 T = 10
-sz = opt.downsample_size # 128/1024 = 1/8
+sz_list = opt.downsample_size # 128/1024 = 1/8
 device = torch.device(f'cuda:{opt.gpu_num}' if torch.cuda.is_available() else 'cpu')
 
 # snippets from dataset_pipeline_full_batchwise
@@ -73,7 +74,7 @@ for i_batch in range(s_batch, e_batch):
         n_all, T, n_subcarriers, n_spatial = x_t_full.shape
 
         # make p2d sample from x_t_full
-        print(f"--- Perform P2D freq with downsample size = {crop_height}x{sz} - CR={sz/n_subcarriers} ---")
+        print(f"--- Perform P2D freq with downsample sizes = {crop_height}x{sz_list} - CR={[sz/n_subcarriers for sz in sz_list]} ---")
 
         x_t = x_t.view("complex")
         x_t_full = x_t_full.view("complex")
@@ -86,7 +87,7 @@ for i_batch in range(s_batch, e_batch):
 
         data_loader = DataLoader(dataset=DatasetToDevice(x_t_full, n_all, device), batch_size=batch_size, num_workers=0)
 
-        print(f"--- Downsampling data for T timeslots with DR_f = {sz}/{n_subcarriers} ---")
+        print("--- Transforming data for T timeslots ---")
         for i, (data_real, data_imag) in tqdm(enumerate(data_loader)):
             idx_s = i*batch_size
             idx_e = min(idx_s+batch_size, n_all)
@@ -116,70 +117,14 @@ for i_batch in range(s_batch, e_batch):
         freq_all = freq_all.numpy()
         pow_diff = pow_diff.numpy()
 
-        for D in D_list:
-            for delta in delta_list:
-                model = P2D_Diag(sz, n_subcarriers, crop_height, D)
-                model.fit(delta=delta) # fit model with regularization 
-        
-                freq_all_t = freq_all[:,0,:]
-                if D == 1:
-                    freq_all_down = np.dot(freq_all_t, model.P[0,:].T)
-                else:
-                    freq_all_down = np.zeros((n_all, n_spatial, sz), dtype="complex")
-                    tqdm_desc = f"t_{1}: Downsampling Size to {n_spatial}x{sz} using {D} diagonal pilots"
-                    for i in tqdm(range(n_all), desc=tqdm_desc):
-                        freq_all_down[i,:,:] = model.downsample(freq_all_t[i,:,:])
-
-                shape_freq_down = freq_all_down.shape
-
-                print(f"--- Sweep through SNR values ({SNR_list}) with DR_f = {sz}/{n_subcarriers}, D={D} ---")
-
-                freq_all_down_pow = np.real(np.sum(np.sum(np.conj(freq_all_down)*freq_all_down, axis=2), axis=1))
-                y_test = data_all_trunc
-
-
-                MSE = [0]*len(SNR_list)
-                NMSE = [0]*len(SNR_list)
-
-                for j, snr in enumerate(SNR_list):
-                    MSE_batch = 0
-                    NMSE_batch = 0
-                    noise_down = np.random.normal(0,1.0,size=shape_freq_down)+1j*np.random.normal(0,1.0,size=shape_freq_down)
-                    noise_pow = np.sum(np.sum(np.conj(noise_down)*noise_down, axis=2), axis=1)
-                    current_snr = freq_all_down_pow / noise_pow
-                    snr_scale = current_snr / (10**(snr/10))
-                    noise_down = np.reshape(np.reshape(noise_down, (n_all, -1)) * snr_scale[:, None], shape_freq_down)
-                    freq_all_down_noisy = freq_all_down + noise_down
-                    # y_hat_t = model.predict(freq_all_down_noisy)
-                    # y_err = y_test[i,0,:] - y_hat_t
-
-                    for i in tqdm(range(n_all), desc=f"-> initial accuracy for DR_f={sz}/{n_subcarriers}, Diag={D}, SNR={snr}"):
-                        y_hat_t = model.predict(freq_all_down_noisy[i,:])
-                        y_err = y_test[i,0,:] - y_hat_t
-                        SE = np.real(np.sum(np.real(y_err)**2) + np.sum(np.imag(y_err)**2))
-                        MSE_batch += SE / n_all
-                        NMSE_batch += SE / (freq_all_down_pow[i]*n_all)
-                        # y_hat[i,t,:,:] = y_hat_t
-
-                    MSE[j] = MSE_batch 
-                    NMSE[j] = NMSE_batch 
-        
-                print(f"--- D={D} | delta={delta} | mse/nmse results for SNR levels ---")
-                for i, (snr, mse_snr, nmse_snr) in enumerate(zip(SNR_list, MSE, NMSE)):
-                    print(f"-> SNR={snr}dB |  MSE (denormalized {mod_str} domain): {mse_snr:4.3E}")
-                    print(f"-> SNR={snr}dB | NMSE (denormalized {mod_str} domain): {10*np.log10(nmse_snr):4.3f}dB")
-
-                # pickle results 
-                pkl_dict = {
-                    "SNR": SNR_list,
-                    "MSE": MSE,
-                    "NMSE": NMSE
-                }
-
-                file_loc = f"results/{mod_str}_ibatch{i_batch}_samples{n_all}_D{D}_sz{sz}_delta{delta:3.2f}.pkl"
-                with open(file_loc, "wb") as f:
-                    pkl.dump(pkl_dict, f)
-                    f.close()
+        cells = [(D, delta, sz) for sz in sz_list for D in D_list for delta in delta_list]
+        results = run_grid(freq_all[:,0,:], data_all_trunc[:,0,:], cells, SNR_list, n_subcarriers, crop_height, mod_str, i_batch, n_workers=opt.n_workers, cache_dir=opt.fit_cache_dir)
+
+        for (D, delta, sz), (MSE, NMSE) in results.items():
+            print(f"--- D={D} | delta={delta} | sz={sz} | mse/nmse results for SNR levels ---")
+            for i, (snr, mse_snr, nmse_snr) in enumerate(zip(SNR_list, MSE, NMSE)):
+                print(f"-> SNR={snr}dB |  MSE (denormalized {mod_str} domain): {mse_snr:4.3E}")
+                print(f"-> SNR={snr}dB | NMSE (denormalized {mod_str} domain): {10*np.log10(nmse_snr):4.3f}dB")
 
     else:
         print(f"--- skipping {batch_str} ---")
\ No newline at end of file
@@ -2,6 +2,7 @@
 from .unpack_json import *
 import scipy.io as sio
 import numpy as np
+import os
 import pickle
 import math
 import time
@@ -35,72 +36,147 @@ def predict_with_model(model,d,aux_bool=0):
     print ("It cost %f sec per sample (%f samples)" % ((tEnd - tStart)/d["test"].shape[0],d["test"].shape[0]))
     return x_hat
 
-### helper function: denormalize H3
-def denorm_H3(data,minmax_file,link_type='down'):
+### memoized loaders for normalization statistics, keyed by path and mtime
+norm_stats_cache = {}
+
+def load_cached(path, loader):
+    """ return loader(path), reloading only if path has been modified since the last call """
+    key = (loader.__name__, path)
+    mtime = os.path.getmtime(path)
+    if key not in norm_stats_cache or norm_stats_cache[key][0] != mtime:
+        norm_stats_cache[key] = (mtime, loader(path))
+    return norm_stats_cache[key][1]
+
+def read_minmax_csv(minmax_file):
     fieldnames = ['link','min','max']
+    extrema = {}
     with open(minmax_file) as csv_file:
         csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
         for row in csv_reader:
-            if row['link']==link_type:
-                d_min = float(row['min'])
-                d_max = float(row['max'])
+            extrema[row['link']] = (float(row['min']), float(row['max']))
+    return extrema
+
+def read_pickle(pickle_file):
+    with open(pickle_file, "rb") as f:
+        out = pickle.load(f)
+        f.close()
+    return out
+
+def read_thresh_idx(thresh_idx_path):
+    return np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
+
+def read_minmax_file(minmax_file):
+    # csv -> {link: (min, max)}; pkl -> {"H_{link}_ext": [mins, maxs]}
+    return load_cached(minmax_file, read_minmax_csv if "csv" in minmax_file else read_pickle)
+
+def pick_extrema(extrema, link_type='down', timeslot=0):
+    """
+    extrema for minmax norms from read_minmax_file
+    pkl -> extrema over all timeslots unless timeslot == -1 (then last timeslot)
+    """
+    if link_type in extrema: # csv
+        return extrema[link_type]
+    extrema = extrema[f"H_{link_type}_ext"]
+    if timeslot != -1:
+        return np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
+    else:
+        return extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
+
+def pick_extrema_sph(extrema, link_type='down', timeslot=0, all_timeslots="global"):
+    """
+    extrema for spherical norms from read_minmax_file (pkl)
+    timeslot == -1 -> all_timeslots = "global" for extrema over all timeslots, "first" for first timeslot
+    """
+    extrema = extrema[f"H_{link_type}_ext"]
+    if timeslot != -1:
+        return extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
+    elif all_timeslots == "first":
+        return extrema[0][0], extrema[1][0]
+    else:
+        return np.min(extrema[0]), np.max(extrema[1])
+
+def load_extrema(minmax_file, link_type='down', timeslot=0):
+    """ extrema for minmax norms (csv or pkl); see pick_extrema """
+    if "csv" in minmax_file or "pkl" in minmax_file:
+        return pick_extrema(read_minmax_file(minmax_file), link_type=link_type, timeslot=timeslot)
+
+def load_extrema_sph(minmax_file, link_type='down', timeslot=0, all_timeslots="global"):
+    """ extrema for spherical norms (pkl); see pick_extrema_sph """
+    return pick_extrema_sph(read_minmax_file(minmax_file), link_type=link_type, timeslot=timeslot, all_timeslots=all_timeslots)
+
+def load_link_power(t1_power_file, link_type='down', thresh_idx_path=False):
+    """ per-sample power from {t1_power_file}.pkl, optionally indexed by thresh_idx_path """
+    link_power = load_cached(f"{t1_power_file}.pkl", read_pickle)[f"pow_{link_type}"]
+    if thresh_idx_path != False:
+        link_power = link_power[load_cached(thresh_idx_path, read_thresh_idx)]
+    return link_power
+
+def scale_by_sample(data, scale):
+    """ multiply each sample (axis 0) of data by scale """
+    return data * np.reshape(scale, (-1,)+(1,)*(len(data.shape)-1))
+
+def mu_comp(x, mu):
+    return np.sign(x)*np.log(1+mu*np.abs(x)) / np.log(1+mu)
+
+def mu_inv(x, mu):
+    return np.sign(x)*((1+mu)**np.abs(x)-1) / mu
+
+def split_mag_pha(data):
+    """ split [mag, phase] channels of 4 or 5 axis data; returns [data_mag, data_pha, concat_axis] """
+    if len(data.shape) == 4:
+        return [data[:,0,:,:], data[:,1,:,:], 1]
+    elif len(data.shape) == 5:
+        return [data[:,:,0,:,:], data[:,:,1,:,:], 2]
+    return [None, None, None]
+
+def mag_pha_to_re_im(data_mag, data_pha, concat_axis):
+    # incoming data channels are [mag, phase]; convert to re/im
+    data_re = np.expand_dims(data_mag*np.cos(data_pha), axis=concat_axis)
+    data_im = np.expand_dims(data_mag*np.sin(data_pha), axis=concat_axis)
+    return np.concatenate((data_re, data_im), axis=concat_axis)
+
+def re_im_to_complex(data):
+    """ combine [re, im] channels of 4 or 5 axis data; returns [data, concat_axis] """
+    if len(data.shape) == 4:
+        return [data[:,0,:,:]+data[:,1,:,:]*1j, 1]
+    elif len(data.shape) == 5:
+        return [data[:,:,0,:,:]+data[:,:,1,:,:]*1j, 2]
+    return [None, None]
+
+### helper function: denormalize H3
+def denorm_H3(data,minmax_file,link_type='down'):
+    d_min, d_max = load_cached(minmax_file, read_minmax_csv)[link_type]
     data = data*(d_max-d_min)+d_min
     return data
 
+### helper function: normalize H3 (minmax scaling)
+def renorm_H3(data,minmax_file,link_type='down'):
+    d_min, d_max = load_cached(minmax_file, read_minmax_csv)[link_type]
+    data = (data-d_min)/(d_max-d_min)
+    return data
+
 ### helper function: denormalize H4
 def denorm_H4(data,minmax_file,link_type='down', timeslot=0):
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
     data = (data+1)/2*(d_max-d_min)+d_min
     return data
 
 ### helper function: normalize H4 (minmax scaling)
 def renorm_H4(data, minmax_file, link_type='down', timeslot=0):
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
     data = 2 * (data-d_min)/(d_max-d_min) - 1
     return data
 
 ### helper function: normalize tanh 
 def renorm_tanh(data, meanvar_file, n_stddev=4):
-    f = sio.loadmat(meanvar_file)
+    f = load_cached(meanvar_file, sio.loadmat)
     mu, sigma = f["mean_all"], np.sqrt(f["var_all"])
     data = np.tanh((data-mu)/(n_stddev*sigma))
     return data
 
 ### helper function: normalize tanh 
 def denorm_tanh(data, meanvar_file, n_stddev=4, eps=0.01):
-    f = sio.loadmat(meanvar_file)
+    f = load_cached(meanvar_file, sio.loadmat)
     mu, sigma = f["mean_all"], np.sqrt(f["var_all"])
     # data = np.tanh((data-mu)/(n_stddev*sigma))
     data = np.clip(data, -1+eps, 1-eps)
@@ -109,49 +185,14 @@ def denorm_tanh(data, meanvar_file, n_stddev=4, eps=0.01):
 
 ### helper function: normalize mu compander 
 def renorm_muH4(data, minmax_file, link_type='down', timeslot=0, mu=1):
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    mu_comp = lambda x, mu: np.sign(x)*np.log(1+mu*np.abs(x)) / np.log(1+mu)
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
     mu_min, mu_max = mu_comp(d_min, mu), mu_comp(d_max, mu)
     data = 2 * ((mu_comp(data, mu) - mu_min) / (mu_max - mu_min)) - 1
     return data
 
 ### helper function: denormalize mu compander 
 def denorm_muH4(data, minmax_file, link_type='down', timeslot=0, mu=1):
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    mu_comp = lambda x, mu: np.sign(x)*np.log(1+mu*np.abs(x)) / np.log(1+mu)
-    mu_inv = lambda x, mu: np.sign(x)*((1+mu)**np.abs(x)-1) / mu
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
     mu_min, mu_max = mu_comp(d_min, mu), mu_comp(d_max, mu)
     data = (data+1)/2*(mu_max-mu_min)+mu_min
     data = mu_inv(data, mu)
@@ -160,203 +201,64 @@ def denorm_muH4(data, minmax_file, link_type='down', timeslot=0, mu=1):
 ### helper function: normalize spherical + mu compander 
 def renorm_sphmuH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, mu=1, thresh_idx_path=False):
     # spherical norm
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    if thresh_idx_path != False:
-        thresh_idx = np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
-        print(f"thresh_idx.shape: {thresh_idx.shape}\nthresh_idx: {thresh_idx}")
-        link_power = link_power[thresh_idx]
-    data = np.reshape(np.reshape(data, (data.shape[0], -1)) / link_power[:,None], data.shape)
-
-    # load minmax
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-
+    link_power = load_link_power(t1_power_file, link_type=link_type, thresh_idx_path=thresh_idx_path)
+    data = scale_by_sample(data, 1 / link_power)
     # mu law companding
-    mu_comp = lambda x, mu: np.sign(x)*np.log(1+mu*np.abs(x)) / np.log(1+mu)
-    mu_min, mu_max = mu_comp(d_min, mu), mu_comp(d_max, mu)
-    data = 2 * ((mu_comp(data, mu) - mu_min) / (mu_max - mu_min)) - 1
-    return data
+    return renorm_muH4(data, minmax_file, link_type=link_type, timeslot=timeslot, mu=mu)
 
 ### helper function: denormalize spherical + mu compander 
-def denorm_sphmuH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, mu=1, thresh_idx_path=False):
-    # load minmax
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-
+def denorm_sphmuH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, mu=1, thresh_idx_path=False, idx=None):
     # mu law companding
-    mu_comp = lambda x, mu: np.sign(x)*np.log(1+mu*np.abs(x)) / np.log(1+mu)
-    mu_inv = lambda x, mu: np.sign(x)*((1+mu)**np.abs(x)-1) / mu
-    mu_min, mu_max = mu_comp(d_min, mu), mu_comp(d_max, mu)
-    data = (data+1)/2*(mu_max-mu_min)+mu_min
-    data = mu_inv(data, mu)
-
+    data = denorm_muH4(data, minmax_file, link_type=link_type, timeslot=timeslot, mu=mu)
     # spherical norm
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    if thresh_idx_path != False:
-        thresh_idx = np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
-        print(f"thresh_idx.shape: {thresh_idx.shape}\nthresh_idx: {thresh_idx}")
-        link_power = link_power[thresh_idx]
-    temp = np.reshape(data, (data.shape[0], -1)) * link_power[:, None]
-    data = np.reshape(temp, data.shape)
-
-    return data
+    link_power = load_link_power(t1_power_file, link_type=link_type, thresh_idx_path=thresh_idx_path)
+    return scale_by_sample(data, link_power if type(idx) == type(None) else link_power[idx])
 
 ### helper function: denormalize H4 with spherical normalization
-def denorm_sphH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, thresh_idx_path=False):
-    # iterate through batches, denormalize based on extrema of given timeslot
-    with open(f"{minmax_file}", "rb") as f:
-        extrema_dict = pickle.load(f)
-        f.close()
-    extrema = extrema_dict[f"H_{link_type}_ext"]
-    if timeslot != -1:
-        # print(f"--- Denorm by timeslot={timeslot} ---")
-        d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    else:
-        d_min = extrema[0][0]
-        d_max = extrema[1][0]
+def denorm_sphH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, thresh_idx_path=False, idx=None):
+    # denormalize based on extrema of given timeslot
+    d_min, d_max = load_extrema_sph(minmax_file, link_type=link_type, timeslot=timeslot, all_timeslots="first")
     data = (data+1)/2*(d_max-d_min)+d_min
-    # with open(f"{t1_power_file}1.pkl", "rb") as f:
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    if thresh_idx_path != False:
-        thresh_idx = np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
-        print(f"thresh_idx.shape: {thresh_idx.shape}\nthresh_idx: {thresh_idx}")
-        link_power = link_power[thresh_idx]
-    data_len = data.shape[0]
-    temp = np.reshape(data, (data.shape[0], -1)) * link_power[:data_len, None]
-    data = np.reshape(temp, data.shape)
-    return data
+    link_power = load_link_power(t1_power_file, link_type=link_type, thresh_idx_path=thresh_idx_path)
+    return scale_by_sample(data, link_power[:data.shape[0]] if type(idx) == type(None) else link_power[idx])
 
 ### helper function: renormalize H4 with spherical normalization
 def renorm_sphH4(data, minmax_file, t1_power_file, link_type='down', timeslot=0, thresh_idx_path=False):
-    # with open(f"{t1_power_file}1.pkl", "rb") as f:
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    if thresh_idx_path != False:
-        thresh_idx = np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
-        print(f"thresh_idx.shape: {thresh_idx.shape}\nthresh_idx: {thresh_idx}")
-        link_power = link_power[thresh_idx]
-    data_len = data.shape[0]
-    data = np.reshape(np.reshape(data, (data.shape[0], -1)) / link_power[:data_len,None], data.shape)
+    link_power = load_link_power(t1_power_file, link_type=link_type, thresh_idx_path=thresh_idx_path)
+    data = scale_by_sample(data, 1 / link_power[:data.shape[0]])
     # perform minmax scaling on estimates
-    with open(f"{minmax_file}", "rb") as f:
-        extrema_dict = pickle.load(f)
-        f.close()
-    extrema = extrema_dict[f"H_{link_type}_ext"]
-    if timeslot != -1:
-        d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    else:
-        d_min = np.min(extrema[0])
-        d_max = np.max(extrema[1])
+    d_min, d_max = load_extrema_sph(minmax_file, link_type=link_type, timeslot=timeslot)
     data = 2 * (data-d_min)/(d_max-d_min) - 1
     return data
 
 ### helper function: denormalize H3 [0,1] with spherical normalization, magnitude/phase
-def denorm_sph_magH3(data, minmax_file, t1_power_file, batch_num, link_type='down', timeslot=0):
+def denorm_sph_magH3(data, minmax_file, t1_power_file, batch_num, link_type='down', timeslot=0, idx=None):
     # undo minmax scaling on magnitude estimates
-    with open(f"{minmax_file}", "rb") as f:
-        extrema_dict = pickle.load(f)
-        f.close()
-    extrema = extrema_dict[f"H_{link_type}_ext"]
-    if timeslot != -1:
-        d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    else:
-        d_min = np.min(extrema[0])
-        d_max = np.max(extrema[1])
-    if len(data.shape) == 4:
-        data_mag, data_pha = data[:,0,:,:], data[:,1,:,:]
-        concat_axis = 1
-    elif len(data.shape) == 5:
-        data_mag, data_pha = data[:,:,0,:,:], data[:,:,1,:,:]
-        concat_axis = 2
-    else:
+    d_min, d_max = load_extrema_sph(minmax_file, link_type=link_type, timeslot=timeslot)
+    data_mag, data_pha, concat_axis = split_mag_pha(data)
+    if concat_axis == None:
         print("--- renorm_sph_magH3: data are not correct shape. Expected 4 or 5 axes. ---")
         return None
     # data_mag = np.clip(data_mag, 0, 1) # trying this; avoid negative magnitude values 
     data_mag = data_mag*(d_max-d_min) + d_min
-    # incoming data channels are [mag, phase]; convert to re/im
-    data_re = np.expand_dims(data_mag*np.cos(data_pha), axis=concat_axis)
-    data_im = np.expand_dims(data_mag*np.sin(data_pha), axis=concat_axis)
-    data = np.concatenate((data_re, data_im), axis=concat_axis)
+    data = mag_pha_to_re_im(data_mag, data_pha, concat_axis)
     # denorm by sample power
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    # data = np.reshape(np.reshape(data, (data.shape[0], -1)) / link_power[:,None], data.shape)
-    temp = np.reshape(data, (data.shape[0], -1)) * link_power[:, None]
-    data = np.reshape(temp, data.shape)
-    return data
+    link_power = load_link_power(t1_power_file, link_type=link_type)
+    return scale_by_sample(data, link_power if type(idx) == type(None) else link_power[idx])
 
 ### helper function: renormalize H3 [0,1] with spherical normalization, magnitude/phase
 def renorm_sph_magH3(data, minmax_file, t1_power_file, batch_num, link_type='down', timeslot=0):
-    with open(f"{t1_power_file}.pkl", "rb") as f:
-        batch_power = pickle.load(f)
-        f.close()
-    link_power = batch_power[f"pow_{link_type}"]
-    data = np.reshape(np.reshape(data, (data.shape[0], -1)) / link_power[:,None], data.shape)
+    link_power = load_link_power(t1_power_file, link_type=link_type)
+    data = scale_by_sample(data, 1 / link_power)
     # split mag/phase
-    if len(data.shape) == 4:
-        data = data[:,0,:,:]+data[:,1,:,:]*1j
-        concat_axis = 1
-    elif len(data.shape) == 5:
-        data = data[:,:,0,:,:]+data[:,:,1,:,:]*1j
-        concat_axis = 2
-    else:
+    data, concat_axis = re_im_to_complex(data)
+    if concat_axis == None:
         print("--- renorm_sph_magH3: data are not correct shape. Expected 4 or 5 axes. ---")
         return None
     data_mag = np.abs(data)
     data_ang = np.angle(data)
     # perform minmax scaling on magnitude estimates
-    with open(f"{minmax_file}", "rb") as f:
-        extrema_dict = pickle.load(f)
-        f.close()
-    extrema = extrema_dict[f"H_{link_type}_ext"]
-    if timeslot != -1:
-        d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-    else:
-        d_min = np.min(extrema[0])
-        d_max = np.max(extrema[1])
+    d_min, d_max = load_extrema_sph(minmax_file, link_type=link_type, timeslot=timeslot)
     data_mag = (data_mag-d_min)/(d_max-d_min)
     data = np.concatenate([np.expand_dims(data_mag, concat_axis), np.expand_dims(data_ang, concat_axis)], axis=concat_axis)
     return data
@@ -364,38 +266,15 @@ def renorm_sph_magH3(data, minmax_file, t1_power_file, batch_num, link_type='dow
 ### helper function: renormalize H3 [0,1] with minmax normalization, magnitude/phase
 def renorm_magH3(data, minmax_file, link_type='down', timeslot=0):
     # split mag/phase
-    if len(data.shape) == 4:
-        data = data[:,0,:,:]+data[:,1,:,:]*1j
-        concat_axis = 1
-    elif len(data.shape) == 5:
-        data = data[:,:,0,:,:]+data[:,:,1,:,:]*1j
-        concat_axis = 2
-    else:
+    data, concat_axis = re_im_to_complex(data)
+    if concat_axis == None:
         print("--- renorm_magH3: data are not correct shape. Expected 4 or 5 axes. ---")
         return None
     data_mag = np.abs(data)
     data_ang = np.angle(data)
 
-    # load extrema
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-
     # perform minmax scaling on magnitude estimates
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
     print(f"--- renorm_magH3: d_min={d_min}, d_max={d_max}---")
     data_mag = (data_mag-d_min)/(d_max-d_min)
     data = np.concatenate([np.expand_dims(data_mag, concat_axis), np.expand_dims(data_ang, concat_axis)], axis=concat_axis)
@@ -403,42 +282,95 @@ def renorm_magH3(data, minmax_file, link_type='down', timeslot=0):
 
 def denorm_magH3(data, minmax_file, link_type='down', timeslot=0):
     # undo minmax scaling on magnitude estimates
-
-    fieldnames = ['link','min','max']
-    if "csv" in minmax_file:
-        with open(minmax_file) as csv_file:
-            csv_reader = csv.DictReader(csv_file,fieldnames=fieldnames,delimiter=',')
-            for row in csv_reader:
-                if row['link']==link_type:
-                    d_min = float(row['min'])
-                    d_max = float(row['max'])
-    elif "pkl" in minmax_file:
-        with open(f"{minmax_file}", "rb") as f:
-            extrema_dict = pickle.load(f)
-            f.close()
-        extrema = extrema_dict[f"H_{link_type}_ext"]
-        if timeslot != -1:
-            d_min, d_max = np.min(extrema[0]), np.max(extrema[1]) # assume single timeslot performance
-        else:
-            d_min, d_max = extrema[0][timeslot], extrema[1][timeslot] # assume single timeslot performance
-
-    if len(data.shape) == 4:
-        data_mag, data_pha = data[:,0,:,:], data[:,1,:,:]
-        concat_axis = 1
-    elif len(data.shape) == 5:
-        data_mag, data_pha = data[:,:,0,:,:], data[:,:,1,:,:]
-        concat_axis = 2
-    else:
+    d_min, d_max = load_extrema(minmax_file, link_type=link_type, timeslot=timeslot)
+    data_mag, data_pha, concat_axis = split_mag_pha(data)
+    if concat_axis == None:
         print("--- renorm_sph_magH3: data are not correct shape. Expected 4 or 5 axes. ---")
         return None
     # data_mag = np.clip(data_mag, 0, 1) # trying this; avoid negative magnitude values 
     data_mag = data_mag*(d_max-d_min) + d_min
-    # incoming data channels are [mag, phase]; convert to re/im
-    data_re = np.expand_dims(data_mag*np.cos(data_pha), axis=concat_axis)
-    data_im = np.expand_dims(data_mag*np.sin(data_pha), axis=concat_axis)
-    data = np.concatenate((data_re, data_im), axis=concat_axis)
+    return mag_pha_to_re_im(data_mag, data_pha, concat_axis)
 
-    return data
+class NormContext(object):
+    """
+    denorm/renorm for a given norm_range; statistics files (extrema, per-sample power, threshold
+    indices) are read once in __init__ (memoized by path and mtime, see load_cached), so per-batch
+    denorm calls only index into arrays already in memory
+
+    norm_range in ["norm_H3", "norm_H4", "norm_sphH4", "norm_sph_magH3", "norm_magH3", "norm_muH4", "norm_sphmuH4"]
+    """
+    def __init__(self, norm_range, minmax_file, t1_power_file=None, link_type='down', thresh_idx_path=False, mu=1):
+        assert(norm_range in ["norm_H3", "norm_H4", "norm_sphH4", "norm_sph_magH3", "norm_magH3", "norm_muH4", "norm_sphmuH4"])
+        if norm_range in ["norm_sphH4", "norm_sph_magH3", "norm_sphmuH4"]:
+            assert(type(t1_power_file) != type(None))
+        self.norm_range = norm_range
+        self.minmax_file = minmax_file
+        self.t1_power_file = t1_power_file
+        self.link_type = link_type
+        self.thresh_idx_path = thresh_idx_path
+        self.mu = mu
+        self.extrema = read_minmax_file(minmax_file)
+        self.link_power = None
+        if norm_range in ["norm_sphH4", "norm_sphmuH4"]:
+            self.link_power = load_link_power(t1_power_file, link_type=link_type, thresh_idx_path=thresh_idx_path)
+        elif norm_range == "norm_sph_magH3": # magnitude norms do not use threshold indices
+            self.link_power = load_link_power(t1_power_file, link_type=link_type)
+
+    def ext(self, timeslot, sph=False, all_timeslots="global"):
+        if sph:
+            return pick_extrema_sph(self.extrema, link_type=self.link_type, timeslot=timeslot, all_timeslots=all_timeslots)
+        return pick_extrema(self.extrema, link_type=self.link_type, timeslot=timeslot)
+
+    def power(self, n, idx=None):
+        # per-sample power of n samples starting at 0, or of samples idx
+        return self.link_power[:n] if type(idx) == type(None) else self.link_power[idx]
+
+    def denorm(self, data, timeslot=0, idx=None):
+        """
+        idx -> indices/slice of data's samples within the full set, for norms with per-sample power (sph);
+               None assumes data starts at sample 0
+        """
+        norm_range = self.norm_range
+        if norm_range in ["norm_H3", "norm_magH3"]:
+            d_min, d_max = self.ext(timeslot)
+            if norm_range == "norm_H3":
+                return data*(d_max-d_min)+d_min
+            data_mag, data_pha, concat_axis = split_mag_pha(data)
+            return mag_pha_to_re_im(data_mag*(d_max-d_min) + d_min, data_pha, concat_axis)
+        elif norm_range == "norm_H4":
+            d_min, d_max = self.ext(timeslot)
+            return (data+1)/2*(d_max-d_min)+d_min
+        elif norm_range == "norm_sphH4":
+            d_min, d_max = self.ext(timeslot, sph=True, all_timeslots="first")
+            return scale_by_sample((data+1)/2*(d_max-d_min)+d_min, self.power(data.shape[0], idx))
+        elif norm_range == "norm_sph_magH3":
+            d_min, d_max = self.ext(timeslot, sph=True)
+            data_mag, data_pha, concat_axis = split_mag_pha(data)
+            data = mag_pha_to_re_im(data_mag*(d_max-d_min) + d_min, data_pha, concat_axis)
+            return scale_by_sample(data, self.power(data.shape[0], idx))
+        elif norm_range in ["norm_muH4", "norm_sphmuH4"]:
+            d_min, d_max = self.ext(timeslot)
+            mu_min, mu_max = mu_comp(d_min, self.mu), mu_comp(d_max, self.mu)
+            data = mu_inv((data+1)/2*(mu_max-mu_min)+mu_min, self.mu)
+            return data if norm_range == "norm_muH4" else scale_by_sample(data, self.power(data.shape[0], idx))
+
+    def renorm(self, data, timeslot=0):
+        norm_range = self.norm_range
+        if norm_range in ["norm_sphH4", "norm_sph_magH3", "norm_sphmuH4"]:
+            data = scale_by_sample(data, 1 / self.power(data.shape[0]))
+        if norm_range in ["norm_H3", "norm_H4", "norm_sphH4"]:
+            d_min, d_max = self.ext(timeslot, sph=(norm_range == "norm_sphH4"))
+            data = (data-d_min)/(d_max-d_min)
+            return data if norm_range == "norm_H3" else 2*data - 1
+        elif norm_range in ["norm_sph_magH3", "norm_magH3"]:
+            data, concat_axis = re_im_to_complex(data)
+            d_min, d_max = self.ext(timeslot, sph=(norm_range == "norm_sph_magH3"))
+            data_mag = (np.abs(data)-d_min)/(d_max-d_min)
+            return np.concatenate([np.expand_dims(data_mag, concat_axis), np.expand_dims(np.angle(data), concat_axis)], axis=concat_axis)
+        elif norm_range in ["norm_muH4", "norm_sphmuH4"]:
+            d_min, d_max = self.ext(timeslot)
+            mu_min, mu_max = mu_comp(d_min, self.mu), mu_comp(d_max, self.mu)
+            return 2 * ((mu_comp(data, self.mu) - mu_min) / (mu_max - mu_min)) - 1
 
 # calculate NMSE
 def calc_NMSE(x_hat,x_test,T=3,pow_diff=None):
@@ -510,38 +442,50 @@ def calc_NMSE(x_hat,x_test,T=3,pow_diff=None):
 #     else:
 #         return nmse
 
-# method 2: use trace of error matrix
-def get_NMSE(x_hat, x_test, n_del=32, n_ang=32, return_mse=False, pow_diff_timeslot=None, n_train=0):
+# method 2: squared Frobenius norm of error matrix, i.e., trace of error matrix times its hermitian
+def get_NMSE(x_hat, x_test, n_del=32, n_ang=32, return_mse=False, pow_diff_timeslot=None, n_train=0, chunk_size=None):
     """
     return NMSE in dB. optionally return MSE
-    reshape based on delay/angle counts
+    samples with zero power are excluded from the sums (but still counted in N)
+    chunk_size -> if not None, score chunk_size samples at a time to bound memory
+    """
+    N = x_test.shape[0]
+    chunk_size = N if chunk_size == None else chunk_size
+    acc = NMSEAccumulator()
+    for idx_s in range(0, N, chunk_size):
+        idx_e = min(idx_s+chunk_size, N)
+        pow_diff_i = None if type(pow_diff_timeslot) == type(None) else np.reshape(pow_diff_timeslot, (N,))[idx_s:idx_e]
+        acc.update(x_hat[idx_s:idx_e], x_test[idx_s:idx_e], pow_diff=pow_diff_i)
+    return acc.result(return_mse=return_mse)
+
+class NMSEAccumulator(object):
     """
-    x_err = np.reshape(x_test - x_hat, (x_test.shape[0], n_ang, n_del))
-    x_test = np.reshape(x_test, (len(x_test), -1))
-    power = np.sum(np.conj(x_test)*x_test, axis=1)
-    # print(f"x_err.shape: {x_err.shape} - power.shape: {power.shape}")
-    # mse = np.sum(np.conj(x_err)*x_err, axis=1)
-    # mse = mse[np.nonzero(power)]
-    # power = power[np.nonzero(power)] 
-    mse = 0
-    nmse = 0
-    N = x_err.shape[0]
-    N_zero = 0
-    for i in range(N):
-        pow_diff = 0 if type(pow_diff_timeslot) == type(None) else pow_diff_timeslot[i]
-        tr_term = np.trace(np.matmul(x_err[i,:,:],np.conj(x_err[i,:,:].T)))
-        if np.real(power[i]) > 0: # ignore term if power is 0
-            mse += (tr_term + np.real(pow_diff)) / N
-            nmse += (tr_term + np.real(pow_diff)) / ((np.real(power[i]) + np.real(pow_diff))*N)
+    running sums for get_NMSE, so NMSE can be computed batch by batch without holding all estimates
+    result() over all update() batches equals get_NMSE over the concatenated batches
+    """
+    def __init__(self):
+        self.n = 0
+        self.mse_sum = 0.0
+        self.nmse_sum = 0.0
+
+    def update(self, x_hat, x_test, pow_diff=None):
+        n_b = x_test.shape[0]
+        x_test = np.reshape(x_test, (n_b, -1))
+        x_err = x_test - np.reshape(x_hat, (n_b, -1))
+        err_pow = np.sum(np.real(x_err)**2 + np.imag(x_err)**2, axis=1) # ||E_i||_F^2 = tr(E_i E_i^H)
+        power = np.sum(np.real(x_test)**2 + np.imag(x_test)**2, axis=1)
+        pow_diff = np.zeros(n_b) if type(pow_diff) == type(None) else np.real(np.reshape(pow_diff, (n_b,)))
+        nonzero = power > 0 # ignore term if power is 0
+        self.mse_sum += np.sum(err_pow[nonzero] + pow_diff[nonzero])
+        self.nmse_sum += np.sum((err_pow[nonzero] + pow_diff[nonzero]) / (power[nonzero] + pow_diff[nonzero]))
+        self.n += n_b
+
+    def result(self, return_mse=False):
+        nmse = 10*math.log10(self.nmse_sum / self.n)
+        if return_mse:
+            return [float(self.mse_sum / self.n), nmse]
         else:
-            N_zero += 1
-    nmse =  10*math.log10(np.real(nmse))
-    # print(f"--- N_zero={N_zero} ---")
-
-    if return_mse:
-        return [np.real(mse).item(), nmse]
-    else:
-        return nmse
+            return nmse
 
 # calculate rms for a window of a signal
 def calc_rms(x, window, idx):
@@ -1,49 +1,46 @@
+import torch
 import numpy as np
-from tqdm import tqdm
 
-def cosine_similarity_mat(A, B, pow_diff_T=None):
-    """ 
-    -> np.array form; use numpy builtins
-    -> return average cosine similarity between elements in estimate and ground truth  (A and B)
+def cosine_similarity_batch(A, B, chunk_size=None, backend="numpy", device="cpu", return_breakdown=False):
+    """
+    -> batched cosine similarity between elements in estimate and ground truth (A and B)
     A.shape = B.shape = (n_samples, T, n_freq, n_ang)
+    -> chunk_size: if not None, process chunk_size samples at a time to bound memory
+    -> backend: "numpy" or "torch" (torch computes on device)
+    -> return_breakdown: if True, return dict with average ("rho"), per-timeslot ("rho_timeslot", shape (T,))
+       and per-sample ("rho_sample", shape (n_samples,)) cosine similarity
     """
+    assert(backend in ["numpy", "torch"])
     N, T, n_freq, n_ant = A.shape
-    rho_trunc = 0
-    rho = 0
-    for i in tqdm(range(N)):
-        A_i = A[i,:,:,:]
-        B_i = B[i,:,:,:]
-        num = np.abs(np.sum(np.multiply(A_i,np.conj(B_i)), axis=2))
-        A_norm = np.sqrt(np.sum(np.multiply(A_i,np.conj(A_i)), axis=2))
-        B_norm = np.sqrt(np.sum(np.multiply(B_i,np.conj(B_i)), axis=2))
-        rho += np.sum(num / (A_norm * B_norm)) / (N*T*n_freq)
-    return np.real(rho)
+    chunk_size = N if chunk_size == None else chunk_size
+    rho_nt = np.zeros((N, T)) # average over frequencies for each sample/timeslot
+    for idx_s in range(0, N, chunk_size):
+        idx_e = min(idx_s+chunk_size, N)
+        if backend == "numpy":
+            A_i, B_i = A[idx_s:idx_e], B[idx_s:idx_e]
+            num = np.abs(np.sum(A_i*np.conj(B_i), axis=3))
+            A_norm = np.sqrt(np.sum(np.real(A_i)**2 + np.imag(A_i)**2, axis=3))
+            B_norm = np.sqrt(np.sum(np.real(B_i)**2 + np.imag(B_i)**2, axis=3))
+            rho_nt[idx_s:idx_e] = np.mean(num / (A_norm*B_norm), axis=2)
+        else:
+            A_i, B_i = torch.as_tensor(A[idx_s:idx_e]).to(device), torch.as_tensor(B[idx_s:idx_e]).to(device)
+            num = torch.abs(torch.sum(A_i*torch.conj(B_i), dim=3))
+            A_norm = torch.linalg.vector_norm(A_i, dim=3)
+            B_norm = torch.linalg.vector_norm(B_i, dim=3)
+            rho_nt[idx_s:idx_e] = torch.mean(num / (A_norm*B_norm), dim=2).to("cpu").numpy()
+    rho = np.mean(rho_nt)
+    if return_breakdown:
+        return {"rho": rho, "rho_timeslot": np.mean(rho_nt, axis=0), "rho_sample": np.mean(rho_nt, axis=1)}
+    return rho
 
-def cosine_similarity(A, B, pow_diff_T=None):
+def cosine_similarity(A, B):
     """ 
     -> return average cosine similarity between elements in estimate and ground truth  (A and B)
     A.shape = B.shape = (n_samples, T, n_freq, n_ang)
     """
-    N, T, n_freq, n_ant = A.shape
-    rho_trunc = 0
-    # rho_all = 0
-    n_samples = 0
-    for i in range(N):
-        for t in range(T):
-            # assume power uniformly distributed among angles
-            # pow_diff = 0 if type(pow_diff_T) == type(None) else pow_diff_T[i,t,0] / n_ant
-            for i_freq in range(n_freq):
-                A_i = A[i,t,i_freq,:]
-                B_i = B[i,t,i_freq,:]
-                AB_dot = np.abs(np.dot(A_i, np.conj(B_i)))
-                A_norm = np.sqrt(np.sum(A_i*np.conj(A_i)))
-                B_norm = np.sqrt(np.sum(B_i*np.conj(B_i))) 
-                # if A_norm > 0 and B_norm > 0:
-                #     rho_trunc += AB_dot / (A_norm*B_norm) 
-                #     n_samples += 1
-                rho_trunc += AB_dot / (A_norm*B_norm) / (T*n_freq*N)
-    # return [np.real(rho_trunc), np.real(rho_all)]
-    return np.real(rho_trunc)
+    return cosine_similarity_batch(A, B)
+
+cosine_similarity_mat = cosine_similarity # former np.array-only variant; same engine
 
 if __name__ == "__main__":
     N = 100
@@ -63,4 +60,6 @@ if __name__ == "__main__":
         # print(f"sigma={sigma:2.1E} -> cos_truncate(A,B): {AB_rho} - cos_all(A,B): {AB_rho_all}")
         AB_rho = cosine_similarity(A,B)
         AB_rho_mat = cosine_similarity_mat(A,B)
-        print(f"sigma={sigma:2.1E} -> cos_truncate(A,B): {AB_rho} - cos_truncate_mat(A,B): {AB_rho_mat}")
\ No newline at end of file
+        print(f"sigma={sigma:2.1E} -> cos_truncate(A,B): {AB_rho} - cos_truncate_mat(A,B): {AB_rho_mat}")
+        AB_rho_torch = cosine_similarity_batch(A, B, chunk_size=32, backend="torch", return_breakdown=True)
+        print(f"sigma={sigma:2.1E} -> cos_truncate_torch(A,B): {AB_rho_torch['rho']} - per timeslot: {AB_rho_torch['rho_timeslot']}")
\ No newline at end of file
@@ -1,15 +1,24 @@
 # data_tools.py
 # functions for importing/manipulating data for training/validation
+import os
+import json
+import queue
+import itertools
+import threading
 import torch
 import numpy as np
 import pickle as pkl
 import h5py
 import scipy.io as sio
 from .unpack_json import get_keys_from_json
+from .timing import get_span
 # from QuantizeData import quantize 
 
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+from torch.utils.data.dataloader import default_collate
 from tqdm import tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 class DatasetToDevice(Dataset):
     def __init__(self, data, length, device):
@@ -43,6 +52,206 @@ class CSIDataset(Dataset):
 			sample = self.transform(sample)
 		return sample # TODO: does this need to be a tuple? possibly due to "aux" input (side info, uplink, etc)
 
+class CSIBatchLoader(object):
+	"""
+	Batch-level loader for in-memory CSI data; replaces DataLoader(CSIDataset(...)) in fit()/score() (see as_loader).
+	Each step takes a contiguous slice of the underlying tensor (a gathered slice when shuffling), and transform is
+	applied once to the whole batch. per_sample=True instead applies transform to each sample and collates the results,
+	for the single-sample transforms in utils/transforms.py.
+	Batches are prepared on a background thread, keeping up to prefetch batches ready. For a cuda device, batches are
+	staged in a ring of reusable pinned buffers and copied with non_blocking; a buffer is only refilled once its copy has
+	completed. Otherwise the slice/gather (or transform output) is yielded as is -- no extra copy, and never a reused buffer.
+	"""
+	def __init__(self, data, batch_size=200, shuffle=False, transform=None, per_sample=False, prefetch=2, device="cpu", pin_memory=None):
+		assert(prefetch > 0)
+		self.data = data if torch.is_tensor(data) else torch.from_numpy(data)
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.transform = transform
+		self.per_sample = per_sample
+		self.prefetch = prefetch
+		self.device = device
+		# pinned staging only pays off for host -> cuda copies
+		pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+		self.pin_memory = pin_memory and torch.device(device).type == "cuda"
+
+	def __len__(self):
+		return (self.data.size(0) + self.batch_size - 1) // self.batch_size
+
+	def get_batch(self, i, perm):
+		idx_s = i*self.batch_size
+		idx_e = min(idx_s+self.batch_size, self.data.size(0))
+		batch = self.data[idx_s:idx_e] if perm is None else self.data[perm[idx_s:idx_e]]
+		if self.transform and self.per_sample:
+			batch = default_collate([self.transform(sample) for sample in batch])
+		elif self.transform:
+			batch = self.transform(batch)
+		return batch
+
+	def copy_to_buffer(self, batch, buffer):
+		# batch may be a tensor or a tuple of tensors (e.g., transforms returning (sample, aug_sample))
+		tensors = list(batch) if isinstance(batch, (list, tuple)) else [batch]
+		if buffer is None or len(buffer) != len(tensors) or any(b.shape[1:] != t.shape[1:] or b.dtype != t.dtype or b.size(0) < t.size(0) for b, t in zip(buffer, tensors)):
+			buffer = [torch.empty(t.shape, dtype=t.dtype, pin_memory=self.pin_memory) for t in tensors]
+		out = [b[:t.size(0)].copy_(t) for b, t in zip(buffer, tensors)]
+		return buffer, (out if isinstance(batch, (list, tuple)) else out[0])
+
+	def put(self, q, stop, item):
+		while not stop.is_set():
+			try:
+				q.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				continue
+
+	def producer(self, q, stop, perm, events):
+		try:
+			buffers = [None]*len(events) # prefetch in queue + one being filled + one held by consumer
+			for i in range(len(self)):
+				if stop.is_set():
+					return
+				j = i % len(buffers)
+				if not self.pin_memory:
+					self.put(q, stop, (j, self.get_batch(i, perm)))
+					continue
+				if events[j] is not None:
+					events[j].synchronize() # wait for pending non_blocking copy out of buffers[j]
+				buffers[j], out = self.copy_to_buffer(self.get_batch(i, perm), buffers[j])
+				self.put(q, stop, (j, out))
+			self.put(q, stop, None)
+		except Exception as e:
+			self.put(q, stop, e)
+
+	def to_device(self, batch):
+		if isinstance(batch, (list, tuple)):
+			return [b.to(self.device, non_blocking=self.pin_memory) for b in batch]
+		return batch.to(self.device, non_blocking=self.pin_memory)
+
+	def __iter__(self):
+		perm = torch.randperm(self.data.size(0)) if self.shuffle else None
+		q = queue.Queue(maxsize=self.prefetch)
+		stop = threading.Event()
+		events = [None]*(self.prefetch+2)
+		async_copy = self.pin_memory
+		thread = threading.Thread(target=self.producer, args=(q, stop, perm, events), daemon=True)
+		thread.start()
+		try:
+			while True:
+				item = q.get()
+				if item is None:
+					break
+				if isinstance(item, Exception):
+					raise item
+				j, batch = item
+				batch = self.to_device(batch)
+				if async_copy:
+					events[j] = torch.cuda.Event()
+					events[j].record()
+				yield batch
+		finally:
+			stop.set()
+			thread.join()
+
+def as_loader(data, batch_size, shuffle=False, device="cpu", transform=None):
+	"""
+	CSIBatchLoader over data if it is an in-memory tensor/array; any other loader (DataLoader, CSIStreamDataset, ...) is returned as is
+	"""
+	if torch.is_tensor(data) or isinstance(data, np.ndarray):
+		return CSIBatchLoader(data, batch_size=batch_size, shuffle=shuffle, transform=transform, device=device)
+	return data
+
+class CSIStreamDataset(IterableDataset):
+	"""
+	Streaming dataset for batch-wise HDF5 files which do not fit in memory (see dataset_pipeline_full).
+	Reads chunk_size samples at a time straight from disk, applying the timeslot window (t_offset/T),
+	delay truncation (n_truncate) and train/val split on the fly, and yields minibatches of batch_size
+	samples. The next chunk is read on a background thread while the current one is consumed, so at
+	most two chunks are held in memory. If provided, transform is applied to each minibatch.
+
+	Use with DataLoader(dataset, batch_size=None); with num_workers > 0, chunks are divided among workers
+	and, if shuffle, each worker shuffles its own share, so every chunk is read exactly once per epoch.
+	"""
+	def __init__(self, dataset_spec, batch_num, batch_offset=0, split="train", mode="full", t_offset=0, T=10, n_truncate=None, batch_size=200, chunk_size=1000, shuffle=False, drop_last=False, transform=None):
+		assert(len(dataset_spec) == 5)
+		dataset_str, dataset_tail, dataset_key, dataset_full_key, val_split = dataset_spec
+		assert(mode in ["truncate", "full"])
+		assert(split in ["train", "val"])
+		self.key = dataset_key if mode == "truncate" else dataset_full_key
+		self.batch_strs = [f"{dataset_str}{batch + batch_offset}{dataset_tail}" for batch in range(batch_num)]
+		self.t_offset = t_offset
+		self.T = T
+		self.n_truncate = n_truncate
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.drop_last = drop_last
+		self.transform = transform
+
+		# sample counts from file metadata; MATLAB v7.3 stores arrays transposed, so samples are the last axis
+		n_file = []
+		for batch_str in self.batch_strs:
+			with h5py.File(batch_str, 'r') as f:
+				n_file.append(f[self.key].shape[-1])
+				f.close()
+		n_total = sum(n_file)
+		val_idx = int(n_total*val_split)
+		idx_s, idx_e = (0, val_idx) if split == "train" else (val_idx, n_total)
+		self.n_samples = idx_e - idx_s
+
+		# (file, start, end) for each chunk within split
+		self.chunks = []
+		offset = 0
+		for i, n in enumerate(n_file):
+			s, e = max(idx_s - offset, 0), min(idx_e - offset, n)
+			for c_s in range(s, e, chunk_size):
+				self.chunks.append((i, c_s, min(c_s + chunk_size, e)))
+			offset += n
+
+	def read_chunk(self, chunk):
+		i, s, e = chunk
+		t_i, t_e = self.t_offset, self.t_offset + self.T
+		with h5py.File(self.batch_strs[i], 'r') as f:
+			# on-disk layout is (n_angle, n_delay, T, n_samples); slice before transposing
+			x = np.transpose(f[self.key][:, :self.n_truncate, t_i:t_e, s:e], [3,2,1,0])
+			f.close()
+		if x.dtype.names is not None: # MATLAB complex data -> compound (real, imag) dtype
+			x = x["real"] + 1j*x["imag"]
+		x = np.ascontiguousarray(x, dtype="complex64" if np.iscomplexobj(x) else "float32")
+		x = torch.from_numpy(x)
+		if self.shuffle:
+			x = x[torch.randperm(x.size(0))]
+		return x
+
+	def make_batch(self, x):
+		return self.transform(x) if self.transform else x
+
+	def __iter__(self):
+		chunks = self.chunks
+		worker_info = get_worker_info()
+		if worker_info is not None:
+			# shard before shuffling, so workers partition the same chunk list regardless of per-worker seeds
+			chunks = chunks[worker_info.id::worker_info.num_workers]
+		if self.shuffle:
+			chunks = [chunks[i] for i in torch.randperm(len(chunks)).tolist()]
+		if len(chunks) == 0:
+			return
+		carry = None
+		with ThreadPoolExecutor(max_workers=1) as pool:
+			future = pool.submit(self.read_chunk, chunks[0])
+			for j in range(len(chunks)):
+				x = future.result()
+				if j + 1 < len(chunks):
+					future = pool.submit(self.read_chunk, chunks[j+1]) # prefetch next chunk
+				if carry is not None:
+					x = torch.cat([carry, x])
+					carry = None
+				n_full = (x.size(0) // self.batch_size) * self.batch_size
+				for b_s in range(0, n_full, self.batch_size):
+					yield self.make_batch(x[b_s:b_s+self.batch_size])
+				if n_full < x.size(0):
+					carry = x[n_full:]
+		if carry is not None and not self.drop_last:
+			yield self.make_batch(carry)
+
 # TODO: write this, if useful
 # def make_dummy_data(N, n_delay=32, n_angle=32, n_channels=2, data_format="channels_first"):
 #     """ make dummy CSI data for proving out different functions """
@@ -207,7 +416,7 @@ def combine_complex(data, height=32, width=32, n_chan=0, T=10):
         elif len(data.shape) == 4:
             return data[:,0,:,:] + data[:,1,:,:]*1j
 
-def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32):
+def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32, cache_dir=None):
     """
     Load and split dataset according to arguments
     Assumes batch-wise splits (i.e., concatenating along axis=0)
@@ -215,6 +424,7 @@ def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool,
     Returns batch inexed by i_batch
     mode -> "full" returns non-truncated matrices
          -> "truncate" returns truncated matrices
+    cache_dir -> if not None, memory-map arrays from cache (built on first call; see save_csi_cache)
     Returns: [pow_diff, data_train, data_val]
     """
 
@@ -223,6 +433,15 @@ def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool,
     assert(len(dataset_spec) == 5)
     dataset_str, dataset_tail, dataset_key, dataset_full_key, val_split = dataset_spec
 
+    cache_tag = f"full_batchwise{i_batch}"
+    cache_params = {"dataset_spec": dataset_spec, "diff_spec": diff_spec, "i_batch": i_batch, "batch_offset": batch_offset, "img_height": img_height, "img_width": img_width, "n_truncate": n_truncate}
+    cache = load_csi_cache(cache_dir, cache_tag, cache_params) if type(cache_dir) != type(None) else None
+    if type(cache) != type(None):
+        print(f"--- Loading batch #{i_batch} from cache in {cache_dir} ---")
+        pow_all, x_all, x_all_full = cache["pow_all"], cache["x_all"], cache["x_all_full"]
+        data_t = [np.zeros((len(x_all), M_1)).astype('float32'), x_all] if aux_bool else x_all
+        return [pow_all, data_t, x_all_full]
+
     batch_str = f"{dataset_str}{i_batch}{dataset_tail}"
     print(f"--- Adding batch #{i_batch} from {batch_str} ---")
     with h5py.File(batch_str, 'r') as f:
@@ -230,8 +449,8 @@ def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool,
         x_t_full = np.transpose(f[dataset_full_key][()], [3,2,1,0]) 
         f.close()
     # def add_batch_full(data, batch, n_delay, n_angle, n_truncate):
-    x_all = add_batch_full(x_all, x_t, img_height, img_width, n_truncate)
-    x_all_full = add_batch_full(x_all_full, x_t_full, img_height, img_width, n_truncate)
+    x_all = add_batch_full(x_all, x_t, img_height, img_width, n_truncate, 1, 0)
+    x_all_full = add_batch_full(x_all_full, x_t_full, img_height, img_width, n_truncate, 1, 0)
 
     if aux_bool:
         aux_t = np.zeros((len(x_all), M_1)).astype('float32')
@@ -250,6 +469,14 @@ def dataset_pipeline_full_batchwise(i_batch, batch_offset, debug_flag, aux_bool,
     idx_e = idx_s + x_all.shape[0]
     print(f"--- idx_s: {idx_s}, idx_e: {idx_e} ---")
     pow_all = pow_all[idx_s:idx_e, :]
+
+    if type(cache_dir) != type(None):
+        sources = [batch_str] + [f"{diff_spec[0]}{timeslot}.mat" for timeslot in range(1,T+1)]
+        save_csi_cache(cache_dir, cache_tag, cache_params, {"pow_all": pow_all, "x_all": x_all, "x_all_full": x_all_full}, sources=sources)
+        # return memmaps, as on later (cached) calls
+        cache = load_csi_cache(cache_dir, cache_tag, cache_params)
+        pow_all, x_all, x_all_full = cache["pow_all"], cache["x_all"], cache["x_all_full"]
+        data_t = [data_t[0], x_all] if aux_bool else x_all
     
     return [pow_all, data_t, x_all_full]
     # return [pow_all, data_train, data_val, x_train_full, x_val_full]
@@ -319,15 +546,19 @@ def dataset_pipeline_p2d(batch_num, batch_offset, batch_size, sz, D, val_split,
     return out_dict
     # return [pow_all, data_train, data_val, x_train_full, x_val_full]
 
-def dataset_pipeline_full(batch_num, batch_offset, debug_flag, aux_bool, dataset_spec, diff_spec, M_1, t_offset=0, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32, mode="full", return_pow=True):
+def dataset_pipeline_full(batch_num, batch_offset, debug_flag, aux_bool, dataset_spec, diff_spec, M_1, t_offset=0, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32, mode="full", return_pow=True, cache_dir=None, n_workers=0, pool_type="process", timers=None):
     """
     Load and split dataset according to arguments
     Assumes batch-wise splits (i.e., concatenating along axis=0)
     Assumes dataset_full_key, indicating presence of full CSI matrices 
     mode -> "full" returns non-truncated matrices
          -> "truncate" returns truncated matrices
+    cache_dir -> if not None, memory-map arrays from cache (built on first call; see save_csi_cache)
+    n_workers, pool_type -> read batch files concurrently (see map_ordered)
+    timers -> if timers["profiler"] is given, record load (incl. timeslot window)/transpose/cache/split spans (see utils.timing.get_span)
     Returns: [pow_diff, data_train, data_val]
     """
+    span = get_span(timers)
     print(f"=== dataset_pipeline_full with T={T} timeslots, t_offset={t_offset} ===")
 
     # x_train = x_val = x_train_full = x_val_full = None
@@ -340,58 +571,70 @@ def dataset_pipeline_full(batch_num, batch_offset, debug_flag, aux_bool, dataset
     assert(mode in ["truncate", "full"])
     target_key = dataset_key if mode == "truncate" else dataset_full_key
 
-    for batch in range(batch_num):
+    cache_params = {"dataset_spec": dataset_spec, "diff_spec": diff_spec, "batch_num": batch_num, "batch_offset": batch_offset, "t_offset": t_offset, "T": T, "mode": mode, "return_pow": return_pow}
+    cache = load_csi_cache(cache_dir, "full", cache_params) if type(cache_dir) != type(None) else None
+    if type(cache) != type(None):
+        print(f"--- Loading batches from cache in {cache_dir} ---")
+        x_all, pow_all = cache["x_all"], cache["pow_all"]
+
+    # truncate along timeslot axis
+    t_i, t_e = t_offset, t_offset+T
+    batches = range(batch_num if type(cache) == type(None) else 0)
+    batch_strs = [f"{dataset_str}{batch + batch_offset}{dataset_tail}" for batch in batches]
+    read_args = [(batch_str, target_key, t_i, t_e) for batch_str in batch_strs]
+    for batch, batch_str, x_t in zip(batches, batch_strs, spanned(map_ordered(read_batch_full, read_args, n_workers=n_workers, pool_type=pool_type), span, "load")):
     # for batch in range(1,batch_num+1):
-        true_batch = batch + batch_offset
-        batch_str = f"{dataset_str}{true_batch}{dataset_tail}"
         print(f"--- Adding batch #{batch} from {batch_str} with key={target_key} ---")
-        with h5py.File(batch_str, 'r') as f:
-            x_t = np.transpose(f[target_key][()], [3,2,1,0])
-            # x_t_full = np.transpose(f[dataset_full_key][()], [3,2,1,0]) if type(dataset_full_key) != type(None) else None
-            f.close()
-        # def add_batch_full(data, batch, n_delay, n_angle, n_truncate):
-        # truncate along timeslot axis
-        t_i, t_e = t_offset, t_offset+T
-        x_t = x_t[:,t_i:t_e,:,:]
-        x_all = add_batch_full(x_all, x_t, img_height, img_width, n_truncate, batch_num, batch)
+        with span("transpose"): # copy MATLAB-ordered read into C-ordered buffer
+            x_all = add_batch_full(x_all, x_t, img_height, img_width, n_truncate, batch_num, batch)
         # x_all_full = add_batch_full(x_all_full, x_t_full, img_height, img_width, x_t_full.shape[2])
 
-    # split to train/val
-    val_idx = int(x_all.shape[0]*val_split) 
-    x_train = x_all[:val_idx,:,:,:]
-    x_val = x_all[val_idx:,:,:,:]
-
-    data_list = [x_train, x_val]
-    data_strs = ["x_train", "x_val"]
-    for data_i, str_i in zip(data_list, data_strs):
-        print(f"-> {str_i}.shape: {data_i.shape}")
-
-    if aux_bool and mode == "truncate":
-        if train_argv:
-            aux_train = np.zeros((len(x_train),M_1))
-            data_train = [aux_train, x_train]
-        aux_val = np.zeros((len(x_val),M_1)).astype('float32')
-        data_val = [aux_val, x_val]
-    else:
-        data_train = x_train
-        data_val = x_val
-
-    if return_pow:
+    if return_pow and type(cache) == type(None):
         T = x_all.shape[1]
         for timeslot in range(1,T+1):
             print(f"--- Adding pow #{timeslot} using {diff_spec[0]}{timeslot}.mat ---")
-            pow_diff, pow_diff_up = load_pow_diff(diff_spec, T=timeslot)
+            with span("load"):
+                pow_diff, pow_diff_up = load_pow_diff(diff_spec, T=timeslot)
             pow_all = add_batch_pow(pow_all, pow_diff)
 
         # TODO: get rid of this once we are using all batches
         pow_all = pow_all[:x_all.shape[0]]
-    else:
+    elif not return_pow:
         pow_all = None
-    
+
+    if type(cache_dir) != type(None) and type(cache) == type(None):
+        sources = batch_strs + ([f"{diff_spec[0]}{timeslot}.mat" for timeslot in range(1,x_all.shape[1]+1)] if return_pow else [])
+        with span("cache"):
+            save_csi_cache(cache_dir, "full", cache_params, {"x_all": x_all, "pow_all": pow_all}, sources=sources)
+            # return memmaps, as on later (cached) calls and in dataset_pipeline_col
+            cache = load_csi_cache(cache_dir, "full", cache_params)
+        x_all, pow_all = cache["x_all"], cache["pow_all"]
+
+    with span("split"):
+        # split to train/val
+        val_idx = int(x_all.shape[0]*val_split) 
+        x_train = x_all[:val_idx,:,:,:]
+        x_val = x_all[val_idx:,:,:,:]
+
+        data_list = [x_train, x_val]
+        data_strs = ["x_train", "x_val"]
+        for data_i, str_i in zip(data_list, data_strs):
+            print(f"-> {str_i}.shape: {data_i.shape}")
+
+        if aux_bool and mode == "truncate":
+            if train_argv:
+                aux_train = np.zeros((len(x_train),M_1))
+                data_train = [aux_train, x_train]
+            aux_val = np.zeros((len(x_val),M_1)).astype('float32')
+            data_val = [aux_val, x_val]
+        else:
+            data_train = x_train
+            data_val = x_val
+
     return [pow_all, data_train, data_val]
     # return [pow_all, data_train, data_val, x_train_full, x_val_full]
 
-def dataset_pipeline_Kusers(batch_num, batch_offset, dataset_spec, K = 2, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32, mode="full"):
+def dataset_pipeline_Kusers(batch_num, batch_offset, dataset_spec, K = 2, img_channels = 2, img_height = 32, img_width = 32, T = 10, train_argv = True, n_truncate=32, mode="full", n_workers=0, pool_type="process"):
     """
     Load and split dataset according to arguments
     Assumes batch-wise splits (i.e., concatenating along axis=0)
@@ -399,6 +642,7 @@ def dataset_pipeline_Kusers(batch_num, batch_offset, dataset_spec, K = 2, img_ch
     Assumes K users for distributed channel estimation/precoding
     mode -> "full" returns non-truncated matrices
          -> "truncate" returns truncated matrices
+    n_workers, pool_type -> read batch files concurrently (see map_ordered)
     Returns: [pow_diff, data_train, data_val]
     """
 
@@ -412,22 +656,12 @@ def dataset_pipeline_Kusers(batch_num, batch_offset, dataset_spec, K = 2, img_ch
     assert(mode in ["truncate", "full"])
     # target_key = dataset_key if mode == "truncate" else dataset_full_key
 
-    for batch in range(1,batch_num+1):
-        down_str = f"{dataset_str}{batch}_down{dataset_tail}"
-        print(f"--- Adding batch #{batch} from {down_str} ---")
-        mat = sio.loadmat(down_str)
-        x_t = mat[dataset_key_down]
-        x_t = np.reshape(x_t, (x_t.shape[0], K, T, img_height, img_width))
-        x_t = np.fft.ifft(x_t, axis=3)
-        up_str = f"{dataset_str}{batch}_up{dataset_tail}"
-        print(f"--- Adding batch #{batch} from {up_str} ---")
-        mat = sio.loadmat(up_str)
-        x_t_u = mat[dataset_key_up]
-        x_t_u = np.reshape(x_t_u, (x_t.shape[0], K, T, img_height, img_width))
-        x_t_u = np.fft.ifft(x_t_u, axis=3)
-
-        x_all_down = add_batch_full_Kusers(x_all_down, x_t, img_height, img_width, n_truncate)
-        x_all_up = add_batch_full_Kusers(x_all_up, x_t_u, img_height, img_width, n_truncate)
+    batches = range(1,batch_num+1)
+    read_args = [(f"{dataset_str}{batch}_down{dataset_tail}", f"{dataset_str}{batch}_up{dataset_tail}", dataset_key_down, dataset_key_up, K, T, img_height, img_width) for batch in batches]
+    for batch, (x_t, x_t_u) in zip(batches, map_ordered(read_batch_Kusers, read_args, n_workers=n_workers, pool_type=pool_type)):
+        print(f"--- Adding batch #{batch} from {dataset_str}{batch}_[down/up]{dataset_tail} ---")
+        x_all_down = add_batch_full_Kusers(x_all_down, x_t, img_height, img_width, n_truncate, batch_num, batch-1)
+        x_all_up = add_batch_full_Kusers(x_all_up, x_t_u, img_height, img_width, n_truncate, batch_num, batch-1)
 
     # split to train/val
     val_idx = int(x_all_down.shape[0]*val_split) 
@@ -628,12 +862,18 @@ def dataset_pipeline_complex(debug_flag, aux_bool, dataset_spec, diff_spec, M_1,
     # else:
     return data_train, data_val
 
-def dataset_pipeline_col(debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img_channels = 2, img_height = 32, img_width = 32, data_format = "channels_first", T = 10, train_argv = True, quant_config = None, idx_split=0, n_truncate=32, total_num_files=21, subsample_prop=1.0, thresh_idx_path=False, stride=1, mat_type=0):
+def dataset_pipeline_col(debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img_channels = 2, img_height = 32, img_width = 32, data_format = "channels_first", T = 10, train_argv = True, quant_config = None, idx_split=0, n_truncate=32, total_num_files=21, subsample_prop=1.0, thresh_idx_path=False, stride=1, mat_type=0, preallocate=True, cache_dir=None, n_workers=0, pool_type="process", timers=None):
     """
     Load and split dataset according to arguments
     Assumes timeslot splits (i.e., concatenating along axis=1)
+    preallocate -> True: size (N, T, C, H, W) float32 buffer from first timeslot, write each timeslot in place
+                -> False: grow buffer by concatenating along time axis (legacy)
+    cache_dir -> if not None, memory-map arrays from cache (built on first call; see save_csi_cache)
+    n_workers, pool_type -> read timeslot files concurrently (see map_ordered)
+    timers -> if timers["profiler"] is given, record load/truncate/transpose/cache/split spans (see utils.timing.get_span)
     Returns: [pow_diff, data_train, data_val]
     """
+    span = get_span(timers)
     x_all = pow_all = None
     x_all_up = pow_all_up = None
     if(len(dataset_spec) == 4):
@@ -646,99 +886,117 @@ def dataset_pipeline_col(debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img
         H_thresh_idx = np.squeeze(sio.loadmat(f"{thresh_idx_path}")["i_percent"]) - 1 # subtract one from matlab idx
         print(f"H_thresh_idx.shape: {H_thresh_idx.shape}\nH_thresh_idx: {H_thresh_idx}")
 
-    for timeslot in range(1,T*stride+1,stride):
-        batch_str = f"{dataset_str}{timeslot}_{dataset_tail}"
+    cache_params = {"dataset_spec": dataset_spec, "diff_spec": diff_spec, "T": T, "stride": stride, "n_truncate": n_truncate, "subsample_prop": subsample_prop, "thresh_idx_path": thresh_idx_path, "mat_type": mat_type, "img_channels": img_channels, "img_height": img_height, "img_width": img_width, "preallocate": preallocate}
+    cache = load_csi_cache(cache_dir, "col", cache_params) if type(cache_dir) != type(None) else None
+    if type(cache) != type(None):
+        print(f"--- Loading timeslots from cache in {cache_dir} ---")
+        x_all, x_all_up, pow_all, pow_all_up = cache["x_all"], cache["x_all_up"], cache["pow_all"], cache["pow_all_up"]
+
+    timeslots = range(1,T*stride+1,stride) if type(cache) == type(None) else []
+    batch_strs = [f"{dataset_str}{timeslot}_{dataset_tail}" for timeslot in timeslots]
+    read_args = [(batch_str, dataset_key, dataset_key_up, mat_type, img_channels, img_height, img_width) for batch_str in batch_strs]
+    for timeslot, batch_str, (x_t, x_t_up) in zip(timeslots, batch_strs, spanned(map_ordered(read_batch_col, read_args, n_workers=n_workers, pool_type=pool_type), span, "load")):
         print(f"--- Adding batch #{timeslot} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[dataset_key][()], [3,2,1,0])
-                x_t_up = np.transpose(f[dataset_key_up][()], [3,2,1,0]) if type(dataset_key_up) != type(None) else None
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[dataset_key]
-            x_t_up = mat[dataset_key_up]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-            x_t_up = np.reshape(x_t_up, (x_t_up.shape[0], img_channels, img_height, img_width))
         # x_val  = add_batch(x_val, mat, 'val', T, img_channels, img_height, img_width, data_format, n_truncate)
         # x_t = sio.loadmat(f"{dataset_str}{timeslot}_{dataset_tail}")[dataset_key]
         if len(diff_spec) > 0:
-            pow_diff, pow_diff_up = load_pow_diff(diff_spec, T=timeslot)
+            with span("load"):
+                pow_diff, pow_diff_up = load_pow_diff(diff_spec, T=timeslot)
         if timeslot == 1:
             # np.random.seed(1)
             data_size = x_t.shape[0] if thresh_idx_path == False else H_thresh_idx.shape[0]
             # rand_idx = np.random.permutation(range(data_size))
             subsample_idx = int(subsample_prop*data_size) 
-        if thresh_idx_path != False:
-            x_t = x_t[H_thresh_idx]
-            x_t_up = x_t_up[H_thresh_idx] if type(dataset_key_up) != type(None) else None
-            pow_diff = pow_diff[H_thresh_idx] 
-            pow_diff_up = pow_diff_up[H_thresh_idx] if type(dataset_key_up) != type(None) else None
-        if subsample_prop < 1.0:
-            x_t = x_t[(timeslot-1)*subsample_idx:timeslot*subsample_idx,:,:,:]
-            x_t_up = x_t_up[(timeslot-1)*subsample_idx:timeslot*subsample_idx,:,:,:] if type(dataset_key_up) != type(None) else None
-            pow_diff = pow_diff[(timeslot-1)*subsample_idx:timeslot*subsample_idx]
-            pow_diff_up = pow_diff_up[(timeslot-1)*subsample_idx:timeslot*subsample_idx] if type(dataset_key_up) != type(None) else None
-            # x_t = x_t[rand_idx[(timeslot-1)*subsample_idx:timeslot*subsample_idx],:,:,:]
-            # pow_diff = pow_diff[rand_idx[(timeslot-1)*subsample_idx:timeslot*subsample_idx]]
-        x_all = add_batch_col(x_all, x_t, img_channels, img_height, img_width, data_format, n_truncate)
-        x_all_up = add_batch_col(x_all_up, x_t_up, img_channels, img_height, img_width, data_format, n_truncate) if type(dataset_key_up) != type(None) else None
+        with span("truncate"): # sample selection; delay truncation is fused into the buffer copy below
+            if thresh_idx_path != False:
+                x_t = x_t[H_thresh_idx]
+                x_t_up = x_t_up[H_thresh_idx] if type(dataset_key_up) != type(None) else None
+                pow_diff = pow_diff[H_thresh_idx] 
+                pow_diff_up = pow_diff_up[H_thresh_idx] if type(dataset_key_up) != type(None) else None
+            if subsample_prop < 1.0:
+                x_t = x_t[(timeslot-1)*subsample_idx:timeslot*subsample_idx,:,:,:]
+                x_t_up = x_t_up[(timeslot-1)*subsample_idx:timeslot*subsample_idx,:,:,:] if type(dataset_key_up) != type(None) else None
+                pow_diff = pow_diff[(timeslot-1)*subsample_idx:timeslot*subsample_idx]
+                pow_diff_up = pow_diff_up[(timeslot-1)*subsample_idx:timeslot*subsample_idx] if type(dataset_key_up) != type(None) else None
+                # x_t = x_t[rand_idx[(timeslot-1)*subsample_idx:timeslot*subsample_idx],:,:,:]
+                # pow_diff = pow_diff[rand_idx[(timeslot-1)*subsample_idx:timeslot*subsample_idx]]
+        with span("transpose"): # copy MATLAB-ordered read into C-ordered buffer
+            if preallocate:
+                t_idx = (timeslot-1) // stride
+                x_all = add_batch_col_prealloc(x_all, x_t, T, t_idx, n_truncate)
+                x_all_up = add_batch_col_prealloc(x_all_up, x_t_up, T, t_idx, n_truncate) if type(dataset_key_up) != type(None) else None
+            else:
+                x_all = add_batch_col(x_all, x_t, img_channels, img_height, img_width, data_format, n_truncate)
+                x_all_up = add_batch_col(x_all_up, x_t_up, img_channels, img_height, img_width, data_format, n_truncate) if type(dataset_key_up) != type(None) else None
 
         if len(diff_spec) > 0:
-            pow_all = add_batch_pow(pow_all, pow_diff)
-            pow_all_up = add_batch_pow(pow_all_up, pow_diff_up) if type(dataset_key_up) != type(None) else None
-
-    # split to train/val
-    val_idx = int(x_all.shape[0]*val_split) 
-    x_train = x_all[:val_idx,:,:,:,:]
-    x_val = x_all[val_idx:,:,:,:,:]
-    if type(dataset_key_up) != type(None):
-        x_train_up = x_all_up[:val_idx,:,:,:,:] 
-        x_val_up = x_all_up[val_idx:,:,:,:,:] 
-
-    # pow_val = pow_all[val_idx:,:,:]
+            if preallocate:
+                pow_all = add_batch_pow_prealloc(pow_all, pow_diff, T, t_idx)
+                pow_all_up = add_batch_pow_prealloc(pow_all_up, pow_diff_up, T, t_idx) if type(dataset_key_up) != type(None) else None
+            else:
+                pow_all = add_batch_pow(pow_all, pow_diff)
+                pow_all_up = add_batch_pow(pow_all_up, pow_diff_up) if type(dataset_key_up) != type(None) else None
+
+    if type(cache_dir) != type(None) and type(cache) == type(None):
+        sources = batch_strs + ([f"{diff_spec[0]}{timeslot}.mat" for timeslot in timeslots] if len(diff_spec) > 0 else []) + ([thresh_idx_path] if thresh_idx_path != False else [])
+        with span("cache"):
+            save_csi_cache(cache_dir, "col", cache_params, {"x_all": x_all.astype('float32', copy=False), "x_all_up": x_all_up, "pow_all": pow_all, "pow_all_up": pow_all_up}, sources=sources)
+            cache = load_csi_cache(cache_dir, "col", cache_params)
+        x_all, x_all_up, pow_all, pow_all_up = cache["x_all"], cache["x_all_up"], cache["pow_all"], cache["pow_all_up"]
+
+    with span("split"):
+        # split to train/val
+        val_idx = int(x_all.shape[0]*val_split) 
+        x_train = x_all[:val_idx,:,:,:,:]
+        x_val = x_all[val_idx:,:,:,:,:]
+        if type(dataset_key_up) != type(None):
+            x_train_up = x_all_up[:val_idx,:,:,:,:] 
+            x_val_up = x_all_up[val_idx:,:,:,:,:] 
+
+        # pow_val = pow_all[val_idx:,:,:]
+
+        # bundle training data calls so they are skippable
+        # astype/reshape are no-copy views when x_all was preallocated as float32
+        if train_argv:
+            # x_train = subsample_time(x_train,T)
+            x_train = x_train.astype('float32', copy=False)
+            x_train_up = x_train_up.astype('float32', copy=False) if type(dataset_key_up) != type(None) else None
+            if img_channels > 0:
+                x_train = np.reshape(x_train, get_data_shape(len(x_train), T, img_channels, img_height, n_truncate, data_format))  # adapt this if using `channels_first` image data format
+                x_train_up = np.reshape(x_train_up, get_data_shape(len(x_train), T, img_channels, img_height, n_truncate, data_format)) if type(dataset_key_up) != type(None) else None # adapt this if using `channels_first` image data format
+            if aux_bool:
+                aux_train = np.zeros((len(x_train),M_1))
+
+        x_val = x_val.astype('float32', copy=False)
+        x_val_up = x_val_up.astype('float32', copy=False) if type(dataset_key_up) != type(None) else None
 
-    # bundle training data calls so they are skippable
-    if train_argv:
-        # x_train = subsample_time(x_train,T)
-        x_train = x_train.astype('float32')
-        x_train_up = x_train_up.astype('float32') if type(dataset_key_up) != type(None) else None
         if img_channels > 0:
-            x_train = np.reshape(x_train, get_data_shape(len(x_train), T, img_channels, img_height, n_truncate, data_format))  # adapt this if using `channels_first` image data format
-            x_train_up = np.reshape(x_train_up, get_data_shape(len(x_train), T, img_channels, img_height, n_truncate, data_format)) if type(dataset_key_up) != type(None) else None # adapt this if using `channels_first` image data format
+            x_val = np.reshape(x_val, get_data_shape(len(x_val), T, img_channels, img_height, n_truncate, data_format))  # adapt this if using `channels_first` image data format
+            x_val_up = np.reshape(x_val_up, get_data_shape(len(x_val_up), T, img_channels, img_height, n_truncate, data_format)) if type(dataset_key_up) != type(None) else None  # adapt this if using `channels_first` image data format
         if aux_bool:
-            aux_train = np.zeros((len(x_train),M_1))
+            aux_val = np.zeros((len(x_val),M_1)).astype('float32')
 
-    x_val = x_val.astype('float32')
-    x_val_up = x_val_up.astype('float32') if type(dataset_key_up) != type(None) else None
-
-    if img_channels > 0:
-        x_val = np.reshape(x_val, get_data_shape(len(x_val), T, img_channels, img_height, n_truncate, data_format))  # adapt this if using `channels_first` image data format
-        x_val_up = np.reshape(x_val_up, get_data_shape(len(x_val_up), T, img_channels, img_height, n_truncate, data_format)) if type(dataset_key_up) != type(None) else None  # adapt this if using `channels_first` image data format
-    if aux_bool:
-        aux_val = np.zeros((len(x_val),M_1)).astype('float32')
-
-    # concat and (optionally) quantize data
-    # TODO: Re-validate. Changed since last run of quantized CSI. 
-    quant_bool = type(quant_config) != type(None)
-    if quant_bool:
-        val_min, val_max, bits = get_keys_from_json(quant_config, keys=['val_min','val_max','bits'])
-    if train_argv:
-        data_train = x_train if not quant_bool else quantize(x_train,val_min,val_max,bits) 
-        data_train_up = x_train_up if not quant_bool else quantize(x_train,val_min,val_max,bits) 
-
-    data_val = x_val if not quant_bool else quantize(x_val,val_min,val_max,bits) 
-    data_val_up = x_val_up if not quant_bool else quantize(x_val,val_min,val_max,bits) 
-    if aux_bool:
+        # concat and (optionally) quantize data
+        # TODO: Re-validate. Changed since last run of quantized CSI. 
+        quant_bool = type(quant_config) != type(None)
+        if quant_bool:
+            val_min, val_max, bits = get_keys_from_json(quant_config, keys=['val_min','val_max','bits'])
         if train_argv:
-            data_train = [aux_train, data_train]
-            data_train_up = [aux_train, data_train_up]
-        data_val = [aux_val, data_val]
-        data_val_up = [aux_val, data_val_up]
+            data_train = x_train if not quant_bool else quantize(x_train,val_min,val_max,bits) 
+            data_train_up = x_train_up if not quant_bool else quantize(x_train,val_min,val_max,bits) 
 
-    if (not train_argv):
-        data_train = None
-        data_train_up = None
+        data_val = x_val if not quant_bool else quantize(x_val,val_min,val_max,bits) 
+        data_val_up = x_val_up if not quant_bool else quantize(x_val,val_min,val_max,bits) 
+        if aux_bool:
+            if train_argv:
+                data_train = [aux_train, data_train]
+                data_train_up = [aux_train, data_train_up]
+            data_val = [aux_val, data_val]
+            data_val_up = [aux_val, data_val_up]
+
+        if (not train_argv):
+            data_train = None
+            data_train_up = None
 
     # if img_channels > 0:
     #     return data_train[:,:,:n_truncate,:], data_val[:,:,:n_truncate,:], data_test[:,:,:n_truncate,:]
@@ -750,6 +1008,89 @@ def dataset_pipeline_col(debug_flag, aux_bool, dataset_spec, diff_spec, M_1, img
     else:
         return pow_all, data_train, data_val
 
+def read_batch_col(batch_str, dataset_key, dataset_key_up=None, mat_type=0, img_channels=2, img_height=32, img_width=32):
+    """
+    read single timeslot file for dataset_pipeline_col
+    Returns: [x_t, x_t_up]
+    """
+    if mat_type == 0:
+        with h5py.File(batch_str, 'r') as f:
+            x_t = np.transpose(f[dataset_key][()], [3,2,1,0])
+            x_t_up = np.transpose(f[dataset_key_up][()], [3,2,1,0]) if type(dataset_key_up) != type(None) else None
+            f.close()
+    elif mat_type == 1:
+        mat = sio.loadmat(batch_str)
+        x_t = mat[dataset_key]
+        x_t_up = mat[dataset_key_up]
+        x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
+        x_t_up = np.reshape(x_t_up, (x_t_up.shape[0], img_channels, img_height, img_width))
+    return [x_t, x_t_up]
+
+def read_batch_full(batch_str, key, t_i, t_e):
+    """
+    read single batch file for dataset_pipeline_full, truncated to timeslots [t_i, t_e)
+    """
+    with h5py.File(batch_str, 'r') as f:
+        x_t = np.transpose(f[key][()], [3,2,1,0])
+        f.close()
+    return x_t[:,t_i:t_e,:,:]
+
+def read_batch_Kusers(down_str, up_str, key_down, key_up, K, T, img_height, img_width):
+    """
+    read downlink/uplink batch files for dataset_pipeline_Kusers; ifft along axis 3
+    Returns: [x_t, x_t_u]
+    """
+    mat = sio.loadmat(down_str)
+    x_t = mat[key_down]
+    x_t = np.reshape(x_t, (x_t.shape[0], K, T, img_height, img_width))
+    x_t = np.fft.ifft(x_t, axis=3)
+    mat = sio.loadmat(up_str)
+    x_t_u = mat[key_up]
+    x_t_u = np.reshape(x_t_u, (x_t.shape[0], K, T, img_height, img_width))
+    x_t_u = np.fft.ifft(x_t_u, axis=3)
+    return [x_t, x_t_u]
+
+def map_ordered(fn, args_list, n_workers=0, pool_type="process"):
+    """
+    apply fn to each tuple of args in args_list, yielding results in order
+
+    Parameters
+    ----------
+    n_workers : int
+                0 -> serial (no pool)
+                > 0 -> keep up to n_workers calls in flight; memory is bounded by n_workers+1 results
+    pool_type : str
+                "process" -> ProcessPoolExecutor; h5py serializes calls behind a global lock, so use for HDF5 reads
+                "thread" -> ThreadPoolExecutor; sufficient for scipy.io.loadmat
+    """
+    if n_workers == 0:
+        for args in args_list:
+            yield fn(*args)
+        return
+    assert(pool_type in ["process", "thread"])
+    executor = ProcessPoolExecutor if pool_type == "process" else ThreadPoolExecutor
+    args_iter = iter(args_list)
+    with executor(max_workers=n_workers) as pool:
+        futures = deque(pool.submit(fn, *args) for args in itertools.islice(args_iter, n_workers))
+        while futures:
+            out = futures.popleft().result()
+            for args in itertools.islice(args_iter, 1):
+                futures.append(pool.submit(fn, *args))
+            yield out
+
+def spanned(iterable, span, name):
+    """
+    yield from iterable, recording the time spent waiting on each item (e.g., file reads in map_ordered) as span name
+    """
+    it = iter(iterable)
+    done = object()
+    while True:
+        with span(name):
+            item = next(it, done)
+        if item is done:
+            return
+        yield item
+
 def add_batch_col(dataset, batch, img_channels, img_height, img_width, data_format, n_truncate):
     # concatenate batch data along time axis 
     # Inputs:
@@ -763,6 +1104,19 @@ def add_batch_col(dataset, batch, img_channels, img_height, img_width, data_form
         # return np.concatenate((dataset, batch[:,:,:,:,:n_truncate]), axis=1) if img_channels > 0 else np.concatenate((dataset,truncate_flattened_matrix(batch, img_height, img_width, n_truncate)), axis=1)
         return np.concatenate((dataset, batch[:,:,:,:n_truncate,:]), axis=1) 
 
+def add_batch_col_prealloc(dataset, batch, T, t_idx, n_truncate, dtype="float32"):
+    # write batch data into preallocated buffer along time axis
+    # Inputs:
+    # -> dataset = np.array for downlink; allocated on first call if None
+    # -> batch = mat file for a single timeslot, shape (n_batch, n_chan, n_delay, n_angle)
+    # -> t_idx = index of timeslot along time axis
+    batch = batch[:,:,:n_truncate,:]
+    if dataset is None:
+        data_shape = (batch.shape[0], T) + batch.shape[1:]
+        dataset = np.empty(data_shape, dtype=dtype) # preallocate data
+    dataset[:,t_idx] = batch
+    return dataset
+
 def add_batch_full(data, batch, n_delay, n_angle, n_truncate, batch_num, batch_idx):
     # concatenate batch data onto end of data
     # data/batch shape is (n_batch, T, n_delay, n_angle)
@@ -781,16 +1135,21 @@ def add_batch_full(data, batch, n_delay, n_angle, n_truncate, batch_num, batch_i
     # else:
         # return np.vstack((data,batch[:,:,:n_truncate,:])) 
 
-def add_batch_full_Kusers(data, batch, n_delay, n_angle, n_truncate):
-    # concatenate batch data onto end of data
-    # data/batch shape is (n_batch, T, n_delay, n_angle)
+def add_batch_full_Kusers(data, batch, n_delay, n_angle, n_truncate, batch_num, batch_idx):
+    # write batch data into preallocated data
+    # data/batch shape is (n_batch, K, T, n_delay, n_angle)
     # Inputs:
     # -> data = np.array for downlink
     # -> batch = mat file to add to np.array
+    batch = batch[:,:,:,:n_truncate,:]
+    batch_size = batch.shape[0]
     if data is None:
-        return batch[:,:,:,:n_truncate,:] 
-    else:
-        return np.vstack((data,batch[:,:,:,:n_truncate,:])) 
+        data_shape = (batch_size*batch_num,)+batch.shape[1:]
+        data = np.zeros(data_shape, dtype=batch.dtype) # preallocate data
+    idx_s = batch_idx * batch_size
+    idx_e = idx_s + batch_size
+    data[idx_s:idx_e,:] = batch
+    return data
 
 def add_batch_pow(dataset, batch, concat_axis=1):
     # concatenate batch data along time axis 
@@ -805,6 +1164,75 @@ def add_batch_pow(dataset, batch, concat_axis=1):
     else:
         return np.concatenate((dataset, batch), axis=concat_axis) 
 
+def add_batch_pow_prealloc(dataset, batch, T, t_idx):
+    # write batch data into preallocated buffer along time axis
+    # Inputs:
+    # -> dataset = np.array for downlink; allocated on first call if None
+    # -> batch = pow_diff for a single timeslot
+    # -> t_idx = index of timeslot along time axis
+    if dataset is None:
+        data_shape = (batch.shape[0], T) + batch.shape[1:]
+        dataset = np.empty(data_shape, dtype=batch.dtype) # preallocate data
+    dataset[:,t_idx] = batch
+    return dataset
+
+def source_stats(sources):
+    # (mtime_ns, size) of each source file, None if missing; used to invalidate caches when sources change
+    stats = {}
+    for src in sources:
+        stats[src] = [os.stat(src).st_mtime_ns, os.stat(src).st_size] if os.path.isfile(src) else None
+    return stats
+
+def save_csi_cache(cache_dir, tag, params, arrays, sources=[]):
+    """
+    write arrays to C-contiguous .npy files in cache_dir, plus a json manifest
+    recording the params the arrays were built with, their shapes/dtypes and the mtime/size of the source files
+    manifest is written last, so an interrupted build is never picked up by load_csi_cache
+
+    Parameters
+    ----------
+    cache_dir : str, directory for cache files
+    tag : str, prefix for cache files (one per pipeline)
+    params : dict, json-serializable args which determine array contents
+    arrays : dict, name -> np.array (or None)
+    sources : list, paths of files the arrays were read from
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = {"params": params, "sources": source_stats(sources), "arrays": {}}
+    for name, data in arrays.items():
+        if type(data) == type(None):
+            manifest["arrays"][name] = None
+            continue
+        np.save(f"{cache_dir}/{tag}_{name}.npy", np.ascontiguousarray(data))
+        manifest["arrays"][name] = {"shape": list(data.shape), "dtype": str(data.dtype)}
+    with open(f"{cache_dir}/{tag}_manifest.json", "w") as f:
+        json.dump(manifest, f, indent=4)
+        f.close()
+    print(f"--- Wrote cache to {cache_dir}/{tag}_manifest.json ---")
+
+def load_csi_cache(cache_dir, tag, params, mmap_mode="r"):
+    """
+    memory-map arrays written by save_csi_cache
+    Returns: dict, name -> np.memmap (or None); None if cache is missing, was built with different params,
+    or any source file recorded by save_csi_cache was modified, resized or removed since
+    """
+    manifest_file = f"{cache_dir}/{tag}_manifest.json"
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+        f.close()
+    if manifest["params"] != json.loads(json.dumps(params)):
+        print(f"--- {manifest_file} was built with different params; ignoring cache ---")
+        return None
+    if manifest.get("sources", {}) != source_stats(manifest.get("sources", {}).keys()):
+        print(f"--- source files of {manifest_file} changed; ignoring cache ---")
+        return None
+    cache = {}
+    for name, spec in manifest["arrays"].items():
+        cache[name] = None if type(spec) == type(None) else np.load(f"{cache_dir}/{tag}_{name}.npy", mmap_mode=mmap_mode)
+    return cache
+
 def load_pow_diff(diff_spec,T=1):
     # TODO: load data for T > 1
     # re: magic numbers -- matfiles have __header__, __version__, and __global__ keys
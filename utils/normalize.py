@@ -4,663 +4,348 @@ import h5py
 # import os # for checking process memory
 import pickle
 
-def get_t1_power_col(dataset_spec, outpath, stride=1, T=10, img_channels=2, img_height=32, img_width=32, mat_type=0):
-    # iterate through timeslots, store:
-    # 1. running min and max of each timeslot
-    # 2. power for each timeslot
-    assert(len(dataset_spec) == 4)
-    dataset_str, dataset_tail, dataset_key, val_split = dataset_spec
+### streaming statistics engine: each file is read once, in sample chunks, and every statistic is accumulated in the same sweep
+
+class RunningExtrema(object):
+    """
+    running min/max over streamed chunks, one entry per index of shape
+    seed=None -> exact extrema; seed=0 -> extrema bounded by 0 (zero-initialized accumulators)
+    """
+    def __init__(self, shape, seed=None):
+        self.min = np.full(shape, np.inf if seed is None else seed, dtype=np.float64)
+        self.max = np.full(shape, -np.inf if seed is None else seed, dtype=np.float64)
+
+    def update(self, x, keep_axes=(), idx=Ellipsis):
+        # reduce over every axis of x not in keep_axes; result must match shape of self.min[idx]
+        axis = tuple(i for i in range(x.ndim) if i not in keep_axes)
+        self.min[idx] = np.minimum(self.min[idx], np.min(x, axis=axis))
+        self.max[idx] = np.maximum(self.max[idx], np.max(x, axis=axis))
+
+    def update_complex(self, z, keep_axes=(), idx=Ellipsis):
+        # extrema over real and imaginary parts, as for data stored with [re, im] channels
+        self.update(np.real(z), keep_axes=keep_axes, idx=idx)
+        self.update(np.imag(z), keep_axes=keep_axes, idx=idx)
+
+    def ext(self):
+        return [self.min, self.max]
+
+def save_pickle(pickle_dict, fname):
+    with open(fname, "wb") as f:
+        pickle.dump(pickle_dict, f)
+        f.close()
 
-    H_down_min_pre = np.zeros(T)
-    H_down_max_pre = np.zeros(T)
-    H_down_min = np.zeros(T)
-    H_down_max = np.zeros(T)
-    for timeslot in range(1,T*stride+1,stride):
+def as_complex(x):
+    # h5py returns matlab complex data as a ('real','imag') compound dtype
+    return x.view("complex") if type(x.dtype.names) != type(None) else x
+
+def sample_power(x, n_keep=1):
+    # l2 norm over all but the first n_keep axes; complex entries contribute re^2+im^2
+    x = np.reshape(x, x.shape[:n_keep]+(-1,))
+    sq = np.real(x)**2 + np.imag(x)**2 if np.iscomplexobj(x) else x**2
+    return np.sqrt(np.sum(sq, axis=-1))
+
+def read_stats_chunks(batch_str, keys, chunk_size=1000, mat_type=0, shapes=None):
+    """
+    yield [x_key for key in keys] over consecutive sample chunks of batch_str, sample axis first
+    mat_type 0: v7.3 (h5py) files are read as hyperslabs along the sample axis, so only one chunk is resident
+    mat_type 1: scipy.io.loadmat reads the whole file; keys[i] is reshaped to (N,)+shapes[i] and sliced into chunks
+    chunk_size=None -> whole file in one chunk (only chunk_size samples are resident for mat_type 0 otherwise)
+    """
+    if mat_type == 0:
+        with h5py.File(batch_str, 'r') as f:
+            n_samples = f[keys[0]].shape[-1]
+            chunk_size = n_samples if type(chunk_size) == type(None) else chunk_size
+            for s in range(0, n_samples, chunk_size):
+                e = min(s+chunk_size, n_samples)
+                yield [np.transpose(f[key][..., s:e]) for key in keys]
+    elif mat_type == 1:
+        mat = sio.loadmat(batch_str)
+        xs = [np.reshape(mat[key], (mat[key].shape[0],)+shape) for key, shape in zip(keys, shapes)]
+        del mat
+        n_samples = xs[0].shape[0]
+        chunk_size = n_samples if type(chunk_size) == type(None) else chunk_size
+        for s in range(0, n_samples, chunk_size):
+            e = min(s+chunk_size, n_samples)
+            yield [x[s:e] for x in xs]
+    else:
+        raise ValueError(f"read_stats_chunks: unrecognized mat_type={mat_type}")
+
+def stream_stats_col(dataset_spec, stride=1, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, chunk_size=1000):
+    """
+    single pass over timeslot files {dataset_str}{timeslot}_{dataset_tail}, timeslot in range(1,T*stride+1,stride)
+    dataset_spec: [dataset_str, dataset_tail, key_down, val_split] or [dataset_str, dataset_tail, key_down, key_up, val_split]
+    returns stats[link] for link in ["down"] or ["down", "up"] with
+        "pow": list of per-sample power for each timeslot
+        "pre", "mag": extrema of raw data/magnitude per timeslot
+        "sph", "sph_mag": extrema of data/magnitude normalized by first-timeslot power per timeslot
+    """
+    assert(len(dataset_spec) in [4, 5])
+    dataset_str, dataset_tail = dataset_spec[:2]
+    keys = dataset_spec[2:-1]
+    links = ["down", "up"][:len(keys)]
+    shapes = [(img_channels, img_height, img_width)]*len(keys)
+    stats = {link: {"pow": [], "pre": RunningExtrema(T), "sph": RunningExtrema(T), "mag": RunningExtrema(T), "sph_mag": RunningExtrema(T)} for link in links}
+    for j, timeslot in enumerate(range(1,T*stride+1,stride)):
         batch_str = f"{dataset_str}{timeslot}_{dataset_tail}"
         print(f"--- Adding batch #{timeslot} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[dataset_key][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[dataset_key]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-        else:
-            print("--- Unrecognized mat_type ---")
-            return None
-        if timeslot == 1:
-            samples, num_channels, img_height, img_width = x_t.shape
-
-        # first, get power of first timeslot
-        # Hur_up = np.reshape(Hur_up, (samples, T, -1))
-        x_t = np.reshape(x_t, (samples, -1))
-        pow_down = np.sqrt(np.sum(x_t**2, axis=1))
-        # pow_up = np.sqrt(np.sum(H_t_up**2, axis=1))
-        if timeslot == 1:
-            # print(f"H_t_down.shape: {H_t_down.shape} - H_t_up.shape: {H_t_up.shape} - pow_down.shape: {pow_down.shape} - pow_up.shape: {pow_up.shape}")
-            # pow_t1_up = pow_up
-            pow_t1_down = pow_down
-            print(f"pow_t1_down range: {np.min(pow_t1_down)} to {np.max(pow_t1_down)} -- pow_t1_down.shape: {pow_t1_down.shape}")
-        # pickle_dict = {"pow_up": pow_up, "pow_down": pow_down}
-        pickle_dict = {"pow_down": pow_down}
-        with open(f"{outpath}/H_t{timeslot}_power.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-        # second, iterate over each timeslot, normalize by pow_t1, and calculate extrema per timeslot
-
-        j = timeslot - 1 # alias for timeslot - 1
-        H_down_min_pre[j] = np.min(x_t)
-        H_down_max_pre[j] = np.max(x_t)
-
-        # somehow, this might be the problem?
-        norm_down = x_t / pow_t1_down[:,None]
-
-        H_down_min[j] = np.min(norm_down)
-        H_down_max[j] = np.max(norm_down)
-        print(f"H_down_min: {H_down_min[j]} - H_down_max: {H_down_max[j]} - H_down_min: {H_down_min_pre[j]} - H_down_max: {H_down_max_pre[j]}")
-        
-    for i in range(T):
-        print(f"t{i+1}: sph_min={H_down_min[i]} - sph_max={H_down_max[i]} - pre_min={H_down_min_pre[i]} - pre_max={H_down_max_pre[i]}")
-
-    # extrema_dict = {"H_down_ext": [H_down_min, H_down_max], "H_up_ext": [H_up_min, H_up_max],}
-    extrema_dict = {"H_down_ext": [H_down_min, H_down_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # extrema_dict_pre = {"H_down_ext": [H_down_min_pre, H_down_max_pre], "H_up_ext": [H_up_min_pre, H_up_max_pre],}
-    extrema_dict_pre = {"H_down_ext": [H_down_min_pre, H_down_max_pre]}
-    with open(f"{outpath}/H_timeslot_extrema_pre.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
-
-def get_t1_power_col_mag(dataset_spec, outpath, stride=1, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32):
-    # magnitude-based spherical normalization -- get power 
+        pow_chunks = {link: [] for link in links}
+        s = 0
+        for chunk in read_stats_chunks(batch_str, keys, chunk_size=chunk_size, mat_type=mat_type, shapes=shapes):
+            e = s + chunk[0].shape[0]
+            for link, x_t in zip(links, chunk):
+                pow_t = sample_power(x_t)
+                pow_chunks[link].append(pow_t)
+                pow_t1 = pow_t if j == 0 else stats[link]["pow"][0][s:e]
+                norm_t = x_t / np.reshape(pow_t1, (-1,)+(1,)*(x_t.ndim-1))
+                stats[link]["pre"].update(x_t, idx=j)
+                stats[link]["sph"].update(norm_t, idx=j)
+                stats[link]["mag"].update(np.hypot(x_t[:,0], x_t[:,1]), idx=j)
+                stats[link]["sph_mag"].update(np.hypot(norm_t[:,0], norm_t[:,1]), idx=j)
+            s = e
+        for link in links:
+            stats[link]["pow"].append(np.concatenate(pow_chunks[link]))
+            st = stats[link]
+            print(f"t{j+1} {link}: sph_min={st['sph'].min[j]} - sph_max={st['sph'].max[j]} - pre_min={st['pre'].min[j]} - pre_max={st['pre'].max[j]} - mag_min={st['mag'].min[j]} - mag_max={st['mag'].max[j]}")
+    return stats
+
+def write_stats_col(stats, outpath, stride=1, outputs=["power", "sph", "pre", "sph_mag", "mag"]):
+    """
+    write pickles from stream_stats_col
+    "power" -> H_t{timeslot}_power.pkl; "sph"/"pre"/"sph_mag"/"mag" -> H_timeslot_extrema_{name}.pkl
+    """
+    links = list(stats.keys())
+    if "power" in outputs:
+        for j in range(len(stats[links[0]]["pow"])):
+            timeslot = j*stride + 1
+            save_pickle({f"pow_{link}": stats[link]["pow"][j] for link in links}, f"{outpath}/H_t{timeslot}_power.pkl")
+    for name in ["sph", "sph_mag", "pre", "mag"]:
+        if name in outputs:
+            save_pickle({f"H_{link}_ext": stats[link][name].ext() for link in links}, f"{outpath}/H_timeslot_extrema_{name}.pkl")
+
+def get_t1_power_col(dataset_spec, outpath, stride=1, T=10, img_channels=2, img_height=32, img_width=32, mat_type=0, chunk_size=1000):
     # iterate through timeslots, store:
     # 1. running min and max of each timeslot
     # 2. power for each timeslot
-    assert(len(dataset_spec) == 5)
-    dataset_str, dataset_tail, key_down, key_up, val_split = dataset_spec
-
-    H_down_min_pre = np.zeros(T)
-    H_down_max_pre = np.zeros(T)
-    H_down_min = np.zeros(T)
-    H_down_max = np.zeros(T)
-    H_mag_down_min = np.zeros(T)
-    H_mag_down_max = np.zeros(T)
-    H_up_min_pre = np.zeros(T)
-    H_up_max_pre = np.zeros(T)
-    H_up_min = np.zeros(T)
-    H_up_max = np.zeros(T)
-    H_mag_up_min = np.zeros(T)
-    H_mag_up_max = np.zeros(T)
-    for timeslot in range(1,T*stride+1,stride):
-        batch_str = f"{dataset_str}{timeslot}_{dataset_tail}"
-        print(f"--- Adding batch #{timeslot} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[key_down][()], [3,2,1,0])
-                x_t_u = np.transpose(f[key_up][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[key_down]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-            x_t_u = mat[key_up]
-            x_t_u = np.reshape(x_t_u, (x_t_u.shape[0], img_channels, img_height, img_width))
-        else:
-            print("--- Unrecognized mat_type ---")
-            return None
-
-        if timeslot == 1:
-            samples, num_channels, n_delay, n_angle = x_t.shape
-
-        # first, get power of first timeslot
-        # Hur_up = np.reshape(Hur_up, (samples, T, -1))
-        x_t = np.reshape(x_t, (samples, -1))
-        pow_down = np.sqrt(np.sum(x_t**2, axis=1))
-        x_t_u = np.reshape(x_t_u, (samples, -1))
-        pow_down = np.sqrt(np.sum(x_t**2, axis=1))
-        pow_up = np.sqrt(np.sum(x_t_u**2, axis=1))
-        # pow_up = np.sqrt(np.sum(H_t_up**2, axis=1))
-        if timeslot == 1:
-            # print(f"H_t_down.shape: {H_t_down.shape} - H_t_up.shape: {H_t_up.shape} - pow_down.shape: {pow_down.shape} - pow_up.shape: {pow_up.shape}")
-            # pow_t1_up = pow_up
-            pow_t1_down, pow_t1_up = pow_down, pow_up
-            print(f"pow_t1_down range: {np.min(pow_t1_down)} to {np.max(pow_t1_down)} -- pow_t1_down.shape: {pow_t1_down.shape}")
-            print(f"pow_t1_up range: {np.min(pow_t1_up)} to {np.max(pow_t1_up)} -- pow_t1_up.shape: {pow_t1_up.shape}")
-        # pickle_dict = {"pow_up": pow_up, "pow_down": pow_down}
-        pickle_dict = {"pow_down": pow_down, "pow_up": pow_up}
-        with open(f"{outpath}/H_t{timeslot}_power.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-        # second, iterate over each timeslot, normalize by pow_t1, and calculate extrema per timeslot
-
-        j = timeslot - 1 # alias for timeslot - 1
-        H_down_min_pre[j] = np.min(x_t)
-        H_down_max_pre[j] = np.max(x_t)
-        H_up_min_pre[j] = np.min(x_t_u)
-        H_up_max_pre[j] = np.max(x_t_u)
-
-        # normalize by power
-        norm_down = x_t / pow_t1_down[:,None]
-        norm_up = x_t_u / pow_t1_up[:,None]
-
-        H_down_min[j] = np.min(norm_down)
-        H_down_max[j] = np.max(norm_down)
-        H_up_min[j] = np.min(norm_up)
-        H_up_max[j] = np.max(norm_up)
-
-        norm_down = np.reshape(norm_down, (samples, num_channels, n_delay, n_angle))
-        norm_up = np.reshape(norm_up, (samples, num_channels, n_delay, n_angle))
-        # H_mag_down = np.sqrt(norm_down[:,0,:,:]**2, norm_down[:,1,:,:]**2)
-        # H_mag_up   = np.sqrt(norm_up[:,0,:,:]**2, norm_up[:,1,:,:]**2)
-        H_mag_down = np.absolute(norm_down[:,0,:,:]+norm_down[:,1,:,:]*1j)
-        H_mag_up = np.absolute(norm_up[:,0,:,:]+norm_up[:,1,:,:]*1j)
-        H_mag_down_min[j] = np.min(H_mag_down)
-        H_mag_down_max[j] = np.max(H_mag_down)
-        H_mag_up_min[j] = np.min(H_mag_up) 
-        H_mag_up_max[j] = np.max(H_mag_up)
-        print(f"H_down_min: {H_down_min[j]} - H_down_max: {H_down_max[j]} - H_down_min: {H_down_min_pre[j]} - H_down_max: {H_down_max_pre[j]} - H_mag_down_min: {H_mag_down_min[j]} - H_mag_down_max: {H_mag_down_max[j]}")
-        print(f"H_up_min: {H_up_min[j]} - H_up_max: {H_up_max[j]} - H_up_min: {H_up_min_pre[j]} - H_up_max: {H_up_max_pre[j]}- H_mag_up_min: {H_mag_up_min[j]} - H_mag_up_max: {H_mag_up_max[j]}")
-
-    for i in range(T):
-        print(f"t{i+1} down: sph_min={H_down_min[i]} - sph_max={H_down_max[i]} - pre_min={H_down_min_pre[i]} - pre_max={H_down_max_pre[i]} - mag_min={H_mag_down_min} - mag_max={H_mag_down_max}")
-        print(f"t{i+1}   up: sph_min={H_up_min[i]} - sph_max={H_up_max[i]} - pre_min={H_up_min_pre[i]} - pre_max={H_up_max_pre[i]} - mag_min={H_mag_up_min} - mag_max={H_mag_up_max}")
-
-    # extrema_dict = {"H_down_ext": [H_down_min, H_down_max], "H_up_ext": [H_up_min, H_up_max],}
-    extrema_dict = {"H_down_ext": [H_down_min, H_down_max], "H_up_ext": [H_up_min, H_up_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # extrema_dict = {"H_down_ext": [H_down_min, H_down_max], "H_up_ext": [H_up_min, H_up_max],}
-    extrema_dict = {"H_down_ext": [H_mag_down_min, H_mag_down_max], "H_up_ext": [H_mag_up_min, H_mag_up_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph_mag.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # extrema_dict_pre = {"H_down_ext": [H_down_min_pre, H_down_max_pre], "H_up_ext": [H_up_min_pre, H_up_max_pre],}
-    extrema_dict_pre = {"H_down_ext": [H_down_min_pre, H_down_max_pre], "H_up_ext": [H_up_min_pre, H_up_max_pre]}
-    with open(f"{outpath}/H_timeslot_extrema_pre.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
+    assert(len(dataset_spec) == 4)
+    stats = stream_stats_col(dataset_spec, stride=stride, T=T, mat_type=mat_type, img_channels=img_channels, img_height=img_height, img_width=img_width, chunk_size=chunk_size)
+    write_stats_col(stats, outpath, stride=stride, outputs=["power", "sph", "pre"])
 
-def get_t1_col_mag(dataset_spec, outpath, stride=1, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32):
-    # magnitude-based minmax normalization 
+def get_t1_power_col_mag(dataset_spec, outpath, stride=1, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, chunk_size=1000):
+    # magnitude-based spherical normalization -- get power
     # iterate through timeslots, store:
     # 1. running min and max of each timeslot
+    # 2. power for each timeslot
     assert(len(dataset_spec) == 5)
-    dataset_str, dataset_tail, key_down, key_up, val_split = dataset_spec
+    stats = stream_stats_col(dataset_spec, stride=stride, T=T, mat_type=mat_type, img_channels=img_channels, img_height=img_height, img_width=img_width, chunk_size=chunk_size)
+    write_stats_col(stats, outpath, stride=stride, outputs=["power", "sph", "sph_mag", "pre"])
 
-    H_down_min = np.zeros(T)
-    H_down_max = np.zeros(T)
-    H_mag_down_min = np.zeros(T)
-    H_mag_down_max = np.zeros(T)
-    H_up_min = np.zeros(T)
-    H_up_max = np.zeros(T)
-    H_mag_up_min = np.zeros(T)
-    H_mag_up_max = np.zeros(T)
-    for timeslot in range(1,T*stride+1,stride):
-        batch_str = f"{dataset_str}{timeslot}_{dataset_tail}"
-        print(f"--- Adding batch #{timeslot} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[key_down][()], [3,2,1,0])
-                x_t_u = np.transpose(f[key_up][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[key_down]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-            x_t_u = mat[key_up]
-            x_t_u = np.reshape(x_t_u, (x_t_u.shape[0], img_channels, img_height, img_width))
-        else:
-            print("--- Unrecognized mat_type ---")
-            return None
-
-        if timeslot == 1:
-            samples, num_channels, n_delay, n_angle = x_t.shape
-
-        # iterate over each timeslot, and calculate magnitude extrema per timeslot
-
-        j = timeslot - 1 # alias for timeslot - 1
-        H_down_min[j] = np.min(x_t)
-        H_down_max[j] = np.max(x_t)
-        H_up_min[j] = np.min(x_t_u)
-        H_up_max[j] = np.max(x_t_u)
-
-        # H_mag_down = np.sqrt(norm_down[:,0,:,:]**2, norm_down[:,1,:,:]**2)
-        # H_mag_up   = np.sqrt(norm_up[:,0,:,:]**2, norm_up[:,1,:,:]**2)
-        H_mag_down = np.absolute(x_t[:,0,:,:]+x_t[:,1,:,:]*1j)
-        H_mag_up = np.absolute(x_t_u[:,0,:,:]+x_t_u[:,1,:,:]*1j)
-        H_mag_down_min[j] = np.min(H_mag_down)
-        H_mag_down_max[j] = np.max(H_mag_down)
-        H_mag_up_min[j] = np.min(H_mag_up) 
-        H_mag_up_max[j] = np.max(H_mag_up)
-        print(f"H_down_min: {H_down_min[j]} - H_down_max: {H_down_max[j]} - H_mag_down_min: {H_mag_down_min[j]} - H_mag_down_max: {H_mag_down_max[j]}")
-        print(f"H_up_min: {H_up_min[j]} - H_up_max: {H_up_max[j]} - H_mag_up_min: {H_mag_up_min[j]} - H_mag_up_max: {H_mag_up_max[j]}")
-
-    for i in range(T):
-        print(f"t{i+1} down: pre_min: {H_down_min[j]} - pre_max: {H_down_max[j]} - mag_min={H_mag_down_min} - mag_max={H_mag_down_max}")
-        print(f"t{i+1}   up: pre_min: {H_up_min[j]} - pre_max: {H_up_max[j]} - mag_min={H_mag_up_min} - mag_max={H_mag_up_max}")
-
-    extrema_dict = {"H_down_ext": [H_mag_down_min, H_mag_down_max], "H_up_ext": [H_mag_up_min, H_mag_up_max]}
-    with open(f"{outpath}/H_timeslot_extrema_mag.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-
-def get_t1_pow_Kusers(dataset_spec, outpath, n_batch=10, K=2, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, batches=None):
-    # get extrema for minmax/spherical normalization 
+def get_t1_col_mag(dataset_spec, outpath, stride=1, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, chunk_size=1000):
+    # magnitude-based minmax normalization
     # iterate through timeslots, store:
     # 1. running min and max of each timeslot
     assert(len(dataset_spec) == 5)
+    stats = stream_stats_col(dataset_spec, stride=stride, T=T, mat_type=mat_type, img_channels=img_channels, img_height=img_height, img_width=img_width, chunk_size=chunk_size)
+    write_stats_col(stats, outpath, stride=stride, outputs=["mag"])
+
+def stream_stats_Kusers(dataset_spec, n_batch=10, K=2, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, batches=None, chunk_size=1000):
+    """
+    single pass over batch files of (N, K, T, n_delay, n_angle) data
+    returns stats[link] for link in ["down", "up"] with
+        "pow": per-sample, per-user power of first timeslot, (N_total, K)
+        "pre", "sph": (K, T) extrema of raw data and data normalized by first-timeslot power; seeded at 0
+    """
+    assert(len(dataset_spec) == 5)
     dataset_str, dataset_tail, key_down, key_up, val_split = dataset_spec
-
-    H_down_min = np.zeros((K,T))
-    H_down_max = np.zeros((K,T))
-    H_sph_down_min = np.zeros((K,T))
-    H_sph_down_max = np.zeros((K,T))
-    H_up_min = np.zeros((K,T))
-    H_up_max = np.zeros((K,T))
-    H_sph_up_min = np.zeros((K,T))
-    H_sph_up_max = np.zeros((K,T))
+    shape = (K, T, img_height, img_width)
+    stats = {link: {"pow": [], "pre": RunningExtrema((K,T), seed=0), "sph": RunningExtrema((K,T), seed=0)} for link in ["down", "up"]}
 
     batches = range(1,n_batch+1) if type(batches) is type(None) else batches
     for batch in batches:
-        batch_str = f"{dataset_str}{batch}_{dataset_tail}"
-        if mat_type == 0:
+        if mat_type in [0, 1]:
+            batch_str = f"{dataset_str}{batch}_{dataset_tail}"
             print(f"--- Adding batch #{batch} from {batch_str} ---")
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[key_down][()], [3,2,1,0])
-                x_t_u = np.transpose(f[key_up][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[key_down]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-            x_t_u = mat[key_up]
-            x_t_u = np.reshape(x_t_u, (x_t_u.shape[0], img_channels, img_height, img_width))
+            chunks = read_stats_chunks(batch_str, [key_down, key_up], chunk_size=chunk_size, mat_type=mat_type, shapes=[shape, shape])
         elif mat_type == 2:
             down_str = f"{dataset_str}{batch}_down{dataset_tail}"
-            print(f"--- Adding batch #{batch} from {down_str} ---")
-            mat = sio.loadmat(down_str)
-            x_t = mat[key_down]
-            x_t = np.reshape(x_t, (x_t.shape[0], K, T, img_height, img_width))
-            x_t = np.fft.ifft(x_t, axis=3)
             up_str = f"{dataset_str}{batch}_up{dataset_tail}"
-            print(f"--- Adding batch #{batch} from {up_str} ---")
-            mat = sio.loadmat(up_str)
-            x_t_u = mat[key_up]
-            x_t_u = np.reshape(x_t_u, (x_t.shape[0], K, T, img_height, img_width))
-            x_t_u = np.fft.ifft(x_t_u, axis=3)
+            print(f"--- Adding batch #{batch} from {down_str}, {up_str} ---")
+            chunks = ([np.fft.ifft(x_d, axis=3), np.fft.ifft(x_u, axis=3)] for [x_d], [x_u] in zip(
+                        read_stats_chunks(down_str, [key_down], chunk_size=chunk_size, mat_type=1, shapes=[shape]),
+                        read_stats_chunks(up_str, [key_up], chunk_size=chunk_size, mat_type=1, shapes=[shape])))
         else:
             print("--- Unrecognized mat_type ---")
             return None
 
-        if batch == 1:
-            samples, K, T, n_delay, n_angle = x_t.shape
-            all_down_pow = np.zeros((samples*n_batch,K))
-            all_up_pow = np.zeros((samples*n_batch,K))
-        x_t = np.concatenate([np.expand_dims(np.real(x_t), axis=3), np.expand_dims(np.imag(x_t), axis=3)], axis=3)
-        x_t_u = np.concatenate([np.expand_dims(np.real(x_t_u), axis=3), np.expand_dims(np.imag(x_t_u), axis=3)], axis=3)
-
-        # iterate over each timeslot, and calculate extrema per timeslot
-
-        for t in range(T):
-            # minmax
-            x_down_t = x_t[:,:,t,:,:,:]
-            x_up_t = x_t_u[:,:,t,:,:,:]
-
-            # sph
-            x_down_flat = np.reshape(x_down_t, (x_down_t.shape[:2])+(-1,))
-            x_up_flat = np.reshape(x_up_t, (x_up_t.shape[:2])+(-1,))
-            if t == 0:
-                x_down_pow = np.sqrt(np.sum(x_down_flat*x_down_flat, axis=2))
-                x_up_pow = np.sqrt(np.sum(x_up_flat*x_up_flat, axis=2))
-                all_down_pow[(batch-1)*samples:batch*samples,:] = x_down_pow
-                all_up_pow[(batch-1)*samples:batch*samples,:] = x_up_pow
+        for chunk in chunks:
+            for link, x_t in zip(["down", "up"], chunk):
+                x_t = as_complex(x_t)
+                x_pow = sample_power(x_t[:,:,0], n_keep=2) # (n, K)
+                stats[link]["pow"].append(x_pow)
+                stats[link]["pre"].update_complex(x_t, keep_axes=(1,2))
+                stats[link]["sph"].update_complex(x_t / x_pow[:,:,None,None,None], keep_axes=(1,2))
+
+    for link in ["down", "up"]:
+        stats[link]["pow"] = np.concatenate(stats[link]["pow"], axis=0)
+        for i in range(T):
             for k in range(K):
-                H_down_min[k,t] = np.min([np.min(x_down_t[:,k,:]), H_down_min[k,t]])
-                H_down_max[k,t] = np.max([np.max(x_down_t[:,k,:]), H_down_max[k,t]])
-                H_up_min[k,t] = np.min([np.min(x_up_t[:,k,:]), H_up_min[k,t]])
-                H_up_max[k,t] = np.max([np.max(x_up_t[:,k,:]), H_up_max[k,t]])
-                x_sph_down = x_down_flat[:,k,:] / x_down_pow[:,k,None]
-                x_sph_up   = x_up_flat[:,k,:] / x_up_pow[:,k,None]
-                H_sph_down_min[k,t] = np.min([np.min(x_sph_down), H_sph_down_min[k,t]])
-                H_sph_down_max[k,t] = np.max([np.max(x_sph_down), H_sph_down_max[k,t]])
-                H_sph_up_min[k,t] = np.min([np.min(x_sph_up), H_sph_up_min[k,t]])
-                H_sph_up_max[k,t] = np.max([np.max(x_sph_up), H_sph_up_max[k,t]])
-                print(f"k={k} - t={t} - H_down_min: {H_down_min[k,t]} - H_down_max: {H_down_max[k,t]} - H_sph_down_min: {H_sph_down_min[k,t]} - H_sph_down_max: {H_sph_down_max[k,t]}")
-                print(f"k={k} - t={t} - H_up_min: {H_up_min[k,t]} - H_up_max: {H_up_max[k,t]} - H_sph_up_min: {H_sph_up_min[k,t]} - H_sph_up_max: {H_sph_up_max[k,t]}")
-
-    for i in range(T):
-        for k in range(K):
-            print(f"t{i+1} k={k+1} - down: pre_min: {H_down_min[k,i]} - pre_max: {H_down_max[k,i]} - sph_min={H_sph_down_min[k,i]} - sph_max={H_sph_down_max[k,i]}")
-            print(f"t{i+1} k={k+1} - up: pre_min: {H_up_min[k,i]} - pre_max: {H_up_max[k,i]} - sph_min={H_sph_up_min[k,i]} - sph_max={H_sph_up_max[k,i]}")
-
-    pickle_dict = {"pow_down": all_down_pow, "pow_up": all_up_pow}
-    with open(f"{outpath}/H_t1_power.pkl", "wb") as f:
-        pickle.dump(pickle_dict, f)
-        f.close()
+                print(f"t{i+1} k={k+1} - {link}: pre_min: {stats[link]['pre'].min[k,i]} - pre_max: {stats[link]['pre'].max[k,i]} - sph_min={stats[link]['sph'].min[k,i]} - sph_max={stats[link]['sph'].max[k,i]}")
+    return stats
 
+def get_t1_pow_Kusers(dataset_spec, outpath, n_batch=10, K=2, T=10, mat_type=0, img_channels=2, img_height=32, img_width=32, batches=None, chunk_size=1000):
+    # get extrema for minmax/spherical normalization
+    # iterate through timeslots, store:
+    # 1. running min and max of each timeslot
+    stats = stream_stats_Kusers(dataset_spec, n_batch=n_batch, K=K, T=T, mat_type=mat_type, img_channels=img_channels, img_height=img_height, img_width=img_width, batches=batches, chunk_size=chunk_size)
+    if type(stats) == type(None):
+        return None
+    save_pickle({"pow_down": stats["down"]["pow"], "pow_up": stats["up"]["pow"]}, f"{outpath}/H_t1_power.pkl")
     # spherical norm dict
-    extrema_dict = {"H_down_ext": [H_sph_down_min, H_sph_down_max], "H_up_ext": [H_sph_up_min, H_sph_up_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
+    save_pickle({"H_down_ext": stats["down"]["sph"].ext(), "H_up_ext": stats["up"]["sph"].ext()}, f"{outpath}/H_timeslot_extrema_sph.pkl")
     # minmax norm dict
-    extrema_dict_pre = {"H_down_ext": [H_down_min, H_down_max], "H_up_ext": [H_up_min, H_up_max]}
-    with open(f"{outpath}/H_timeslot_extrema_pre.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
-
-def get_t1_power_full(n_batches, dataset_spec, outpath, stride=1, T=10, img_channels=2, img_height=1024, img_width=32, mat_type=0, batch_offset=0):
-    # iterate through batches, store:
-    # 1. running min and max of each timeslot
-    # 2. power for each timeslot
+    save_pickle({"H_down_ext": stats["down"]["pre"].ext(), "H_up_ext": stats["up"]["pre"].ext()}, f"{outpath}/H_timeslot_extrema_pre.pkl")
+
+def stream_stats_full(n_batches, dataset_spec, timeslots=None, mat_type=0, batch_offset=0, N_truncate=0, img_channels=2, img_height=1024, img_width=32, T=10, chunk_size=1000):
+    """
+    single pass over batch files {dataset_str}{batch+batch_offset}{dataset_tail} of complex (N, T, n_delay, n_spatial) data
+    for each of timeslots (default: all; timeslot 0 is always included as the spherical reference), returns stats[domain] for
+        domain "del_spa" (native), "freq_spa" (fft over delay), "del_ang" (fft over spatial) with
+        "pow": per-sample power, (N_total, len(stats["timeslots"]))
+        "pre": minmax extrema
+        "sph": extrema normalized by each sample's power in the same timeslot
+        "sph_t1": extrema normalized by each sample's power in timeslot 0
+    timeslots=None also keeps, for the files written by write_stats_t1_full, stats["freq_spa"] entries
+        "pow_last", "pow_sq_last": real l2 norm and sqrt of the complex sum of squares over delay, last batch only
+        "pre_re", "sph_t1_re": extrema of the real part, raw and divided by pow_sq_last of timeslot 0
+    N_truncate > 0 keeps the first N_truncate delay bins of del_ang and adds domain "del_spa_nt" (del_spa truncated the same way;
+        del_spa itself is never truncated); extrema are seeded at 0
+    """
     assert(len(dataset_spec) == 5)
     dataset_str, dataset_tail, dataset_key, dataset_full_key, val_split = dataset_spec
-
-    H_down_min_pre = np.zeros(T)
-    H_down_max_pre = np.zeros(T)
-    H_down_min = np.zeros(T)
-    H_down_max = np.zeros(T)
-    H_down_f_min_pre = np.zeros(T)
-    H_down_f_max_pre = np.zeros(T)
-    H_down_f_min = np.zeros(T)
-    H_down_f_max = np.zeros(T)
+    domains = ["del_spa", "freq_spa", "del_ang"] + (["del_spa_nt"] if N_truncate > 0 else [])
+    stats = {"N_truncate": N_truncate}
     for batch in range(n_batches):
         true_batch = batch + batch_offset
         batch_str = f"{dataset_str}{true_batch}{dataset_tail}"
         print(f"--- Adding batch #{batch} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[dataset_full_key][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[dataset_full_key]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-        else:
-            print("--- Unrecognized mat_type ---")
-            return None
-        if batch == 0:
-            samples, T, img_height, img_width = x_t.shape # complex data
-
-        # first, get power of first timeslot
-        # Hur_up = np.reshape(Hur_up, (samples, T, -1))
-
-        x_f = np.fft.fft(x_t.view("complex"), axis=2)
-        x_f_re = np.expand_dims(np.real(x_f.view("complex")).astype('float32'),axis=2) # real portion
-        x_f_im = np.expand_dims(np.imag(x_f.view("complex")).astype('float32'),axis=2) # imag portion
-        x_t = np.concatenate((x_f_re,x_f_im),axis=2)
-        x_t = np.reshape(x_f, (samples, T, -1))
-        pow_down_f = np.sqrt(np.sum(x_f**2, axis=2))
-
-        x_re = np.expand_dims(np.real(x_t.view("complex")).astype('float32'),axis=2) # real portion
-        x_im = np.expand_dims(np.imag(x_t.view("complex")).astype('float32'),axis=2) # imag portion
-        x_t = np.concatenate((x_re,x_im),axis=2)
-        x_t = np.reshape(x_t, (samples, T, -1))
-        pow_down = np.sqrt(np.sum(x_t**2, axis=2))
-        
-        # pow_up = np.sqrt(np.sum(H_t_up**2, axis=1))
-        pow_t1_down = pow_down[:,0]
-        print(f"pow_t1_down range: {np.min(pow_t1_down)} to {np.max(pow_t1_down)} -- pow_t1_down.shape: {pow_t1_down.shape}")
-        pow_t1_down_f = pow_down_f[:,0]
-        print(f"pow_t1_down_f range: {np.min(pow_t1_down_f)} to {np.max(pow_t1_down_f)} -- pow_t1_down.shape: {pow_t1_down_f.shape}")
-
-        # second, iterate over each timeslot, normalize by pow_t1, and calculate extrema per timeslot
-        for t in range(T):
-
-            # somehow, this might be the problem?
-            norm_down = x_t[:,t,:] / pow_t1_down[:,None]
-            norm_f_down = x_f[:,t,:] / pow_t1_down_f[:,None]
-
-            H_down_min[t] = np.min([np.min(norm_down), H_down_min[t]])
-            H_down_max[t] = np.max([np.max(norm_down), H_down_max[t]])
-            H_down_min_pre[t] = np.min([np.min(x_t[:,t,:]), H_down_min_pre[t]])
-            H_down_max_pre[t] = np.max([np.max(x_t[:,t,:]), H_down_max_pre[t]])
-            H_down_f_min[t] = np.min([np.min(norm_f_down), H_down_f_min[t]])
-            H_down_f_max[t] = np.max([np.max(norm_f_down), H_down_f_max[t]])
-            H_down_f_min_pre[t] = np.min([np.min(x_f[:,t,:]), H_down_f_min_pre[t]])
-            H_down_f_max_pre[t] = np.max([np.max(x_f[:,t,:]), H_down_f_max_pre[t]])
-            print(f"t{t+1} - H_down range: {H_down_min[t]} to {H_down_max[t]} - H_down_pre range: {H_down_min_pre[t]} to {H_down_max_pre[t]} - H_down_f_pre range: {H_down_f_min_pre[t]} to {H_down_f_max_pre[t]} - H_down_f range: {H_down_f_min[t]} to {H_down_f_max[t]}")
-
-        del x_t, x_f
-        
-    for t in range(T):
-        print(f"t{t+1}: sph_min={H_down_min[t]} - sph_max={H_down_max[t]} - pre_min={H_down_min_pre[t]} - pre_max={H_down_max_pre[t]}")
-        pickle_dict = {"pow_down": pow_down[:,t]}
-        with open(f"{outpath}/H_t{t+1}_power.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-        pickle_dict = {"pow_down": pow_down_f[:,t]}
-        with open(f"{outpath}/H_t{t+1}_freq_power.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-    # angle-delay - sph extrema
-    extrema_dict = {"H_down_ext": [H_down_min, H_down_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # angle-delay - minmax extrema
-    extrema_dict_pre = {"H_down_ext": [H_down_min_pre, H_down_max_pre]}
-    with open(f"{outpath}/H_timeslot_extrema_pre.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
-
-    # angle-freq - sph extrema
-    extrema_dict = {"H_down_f_ext": [H_down_f_min, H_down_f_max]}
-    with open(f"{outpath}/H_timeslot_extrema_sph_freq.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # angle-freq - minmax extrema
-    extrema_dict_pre = {"H_down_f_ext": [H_down_f_min_pre, H_down_f_max_pre]}
-    with open(f"{outpath}/H_timeslot_extrema_pre_freq.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
+        batch_pow, batch_sq = [], []
+        for [x] in read_stats_chunks(batch_str, [dataset_full_key], chunk_size=chunk_size, mat_type=mat_type, shapes=[(T, img_height, img_width)]):
+            x = as_complex(x)
+            if "timeslots" not in stats:
+                stats["timeslots"] = sorted(set([0] + list(range(x.shape[1]) if type(timeslots) == type(None) else timeslots)))
+                n_ts = len(stats["timeslots"])
+                for domain in domains:
+                    stats[domain] = {"pow": [], "pre": RunningExtrema(n_ts, seed=0), "sph": RunningExtrema(n_ts, seed=0), "sph_t1": RunningExtrema(n_ts, seed=0)}
+                if type(timeslots) == type(None):
+                    stats["freq_spa"].update({"pre_re": RunningExtrema(n_ts, seed=0), "sph_t1_re": RunningExtrema(n_ts, seed=0)})
+            if len(stats["timeslots"]) < x.shape[1]:
+                x = x[:,stats["timeslots"]]
+            n_t = x.shape[2] if N_truncate == 0 else N_truncate
+            z_dict = {
+                "del_spa": x.astype(np.complex64),
+                "freq_spa": np.fft.fft(x, axis=2).astype(np.complex64),
+                "del_ang": np.fft.fft(x, axis=3)[:,:,:n_t].astype(np.complex64),
+            }
+            if N_truncate > 0:
+                z_dict["del_spa_nt"] = z_dict["del_spa"][:,:,:n_t]
+            del x
+            for domain in domains:
+                z = z_dict[domain]
+                z_pow = sample_power(z, n_keep=2) # (n, n_ts)
+                stats[domain]["pow"].append(z_pow)
+                stats[domain]["pre"].update_complex(z, keep_axes=(1,))
+                stats[domain]["sph"].update_complex(z / z_pow[:,:,None,None], keep_axes=(1,))
+                stats[domain]["sph_t1"].update_complex(z / z_pow[:,:1,None,None], keep_axes=(1,))
+            if "pre_re" in stats["freq_spa"]:
+                z = z_dict["freq_spa"]
+                z_sq = np.sqrt(np.sum(z**2, axis=2)) # (n, n_ts, n_spatial), complex
+                batch_pow.append(stats["freq_spa"]["pow"][-1])
+                batch_sq.append(z_sq)
+                stats["freq_spa"]["pre_re"].update(np.real(z), keep_axes=(1,))
+                stats["freq_spa"]["sph_t1_re"].update(np.real(z / z_sq[:,:1,None,:]), keep_axes=(1,))
+            del z_dict
+        if "timeslots" in stats and "pre_re" in stats["freq_spa"]:
+            stats["freq_spa"]["pow_last"] = np.concatenate(batch_pow, axis=0)
+            stats["freq_spa"]["pow_sq_last"] = np.concatenate(batch_sq, axis=0)
+
+    for domain in domains:
+        stats[domain]["pow"] = np.concatenate(stats[domain]["pow"], axis=0)
+        st = stats[domain]
+        for i, t in enumerate(stats["timeslots"]):
+            print(f"t{t+1} {domain}: pre range: {st['pre'].min[i]} to {st['pre'].max[i]} - sph range: {st['sph'].min[i]} to {st['sph'].max[i]} - sph_t1 range: {st['sph_t1'].min[i]} to {st['sph_t1'].max[i]}")
+    return stats
+
+def write_stats_t1_full(stats, outpath):
+    # per-timeslot power and first-timeslot spherical extrema from stream_stats_full (timeslots=None)
+    # same names and values as the original get_t1_power_full: "power" and the angle-delay extrema hold
+    # frequency-domain values, power is from the last batch only, and the freq extrema are over real parts
+    fs = stats["freq_spa"]
+    for i, t in enumerate(stats["timeslots"]):
+        save_pickle({"pow_down": fs["pow_last"][:,i]}, f"{outpath}/H_t{t+1}_power.pkl")
+        save_pickle({"pow_down": fs["pow_sq_last"][:,i]}, f"{outpath}/H_t{t+1}_freq_power.pkl")
+    # angle-delay - sph/minmax extrema
+    save_pickle({"H_down_ext": fs["sph_t1"].ext()}, f"{outpath}/H_timeslot_extrema_sph.pkl")
+    save_pickle({"H_down_ext": fs["pre"].ext()}, f"{outpath}/H_timeslot_extrema_pre.pkl")
+    # angle-freq - sph/minmax extrema
+    save_pickle({"H_down_f_ext": fs["sph_t1_re"].ext()}, f"{outpath}/H_timeslot_extrema_sph_freq.pkl")
+    save_pickle({"H_down_f_ext": fs["pre_re"].ext()}, f"{outpath}/H_timeslot_extrema_pre_freq.pkl")
+
+    # corrected values under their own names: delay-spatial (_del) and frequency-spatial (_freq) power over all batches,
+    # delay-spatial extrema, and frequency-spatial extrema over [re, im]
+    for i, t in enumerate(stats["timeslots"]):
+        save_pickle({"pow_down": stats["del_spa"]["pow"][:,i]}, f"{outpath}/H_t{t+1}_power_del.pkl")
+        save_pickle({"pow_down": fs["pow"][:,i]}, f"{outpath}/H_t{t+1}_power_freq.pkl")
+    save_pickle({"H_down_ext": stats["del_spa"]["sph_t1"].ext()}, f"{outpath}/H_timeslot_extrema_sph_del.pkl")
+    save_pickle({"H_down_ext": stats["del_spa"]["pre"].ext()}, f"{outpath}/H_timeslot_extrema_pre_del.pkl")
+    save_pickle({"H_down_f_ext": fs["sph_t1"].ext()}, f"{outpath}/H_timeslot_extrema_sph_freq_reim.pkl")
+    save_pickle({"H_down_f_ext": fs["pre"].ext()}, f"{outpath}/H_timeslot_extrema_pre_freq_reim.pkl")
+
+def write_stats_timeslot_full(stats, outpath, timeslot, val_prop=0.0):
+    # single-timeslot power and spherical extrema from stream_stats_full
+    # same names and values as the original get_timeslot_power_full: delay-spatial files are not delay-truncated
+    # even under _Nt_ names, and the delay-angular validation file holds delay-spatial power
+    i = stats["timeslots"].index(timeslot)
+    N_truncate = stats["N_truncate"]
+    nt_str = "" if N_truncate == 0 else f"_Nt_{N_truncate}"
+    ext = lambda domain, name: [[stats[domain][name].min[i]], [stats[domain][name].max[i]]]
+
+    # power for delay-spatial/delay-angular domains (all, validation) and freq-spatial domain (all)
+    pow_spa = stats["del_spa"]["pow"][:,i]
+    n_val = int(pow_spa.shape[0]*val_prop)
+    for domain, fname in [("del_spa", f"H_t{timeslot+1}_power{nt_str}"), ("del_ang", f"H_t{timeslot+1}_delang_power{nt_str}")]:
+        save_pickle({"pow_down": stats[domain]["pow"][:,i]}, f"{outpath}/{fname}.pkl")
+        if val_prop > 0:
+            save_pickle({"pow_down": pow_spa[n_val:]}, f"{outpath}/{fname}_val.pkl")
+    save_pickle({"pow_down": stats["freq_spa"]["pow"][:,i]}, f"{outpath}/H_t{timeslot+1}_freq_power.pkl")
+
+    # sph/minmax extrema
+    save_pickle({"H_down_ext": ext("del_spa", "sph")}, f"{outpath}/H_timeslot_extrema_sph{nt_str}.pkl")
+    save_pickle({"H_down_ext": ext("del_spa", "pre")}, f"{outpath}/H_timeslot_extrema_pre{nt_str}.pkl")
+    save_pickle({"H_down_ext": ext("freq_spa", "sph")}, f"{outpath}/H_timeslot_extrema_sph_freq.pkl")
+    save_pickle({"H_down_ext": ext("freq_spa", "pre")}, f"{outpath}/H_timeslot_extrema_pre_freq.pkl")
+    save_pickle({"H_down_ext": ext("del_ang", "sph")}, f"{outpath}/H_timeslot_extrema_sph_delang{nt_str}.pkl")
+    save_pickle({"H_down_ext": ext("del_ang", "pre")}, f"{outpath}/H_timeslot_extrema_pre_delang{nt_str}.pkl")
+
+    # corrected values under their own names: delay-truncated delay-spatial files (_del_Nt_), delay-angular validation power
+    if val_prop > 0:
+        save_pickle({"pow_down": stats["del_ang"]["pow"][n_val:,i]}, f"{outpath}/H_t{timeslot+1}_delang_power{nt_str}_val_delang.pkl")
+    if N_truncate > 0:
+        pow_down = stats["del_spa_nt"]["pow"][:,i]
+        save_pickle({"pow_down": pow_down}, f"{outpath}/H_t{timeslot+1}_power_del{nt_str}.pkl")
+        if val_prop > 0:
+            save_pickle({"pow_down": pow_down[n_val:]}, f"{outpath}/H_t{timeslot+1}_power_del{nt_str}_val.pkl")
+        save_pickle({"H_down_ext": ext("del_spa_nt", "sph")}, f"{outpath}/H_timeslot_extrema_sph_del{nt_str}.pkl")
+        save_pickle({"H_down_ext": ext("del_spa_nt", "pre")}, f"{outpath}/H_timeslot_extrema_pre_del{nt_str}.pkl")
+
+def get_t1_power_full(n_batches, dataset_spec, outpath, stride=1, T=10, img_channels=2, img_height=1024, img_width=32, mat_type=0, batch_offset=0, chunk_size=1000):
+    # iterate through batches, store:
+    # 1. running min and max of each timeslot
+    # 2. power for each timeslot
+    stats = stream_stats_full(n_batches, dataset_spec, mat_type=mat_type, batch_offset=batch_offset, img_channels=img_channels, img_height=img_height, img_width=img_width, T=T, chunk_size=chunk_size)
+    write_stats_t1_full(stats, outpath)
 
-def get_timeslot_power_full(n_batches, dataset_spec, outpath, timeslot, stride=1, T=10, img_channels=2, img_height=1024, img_width=32, mat_type=0, batch_offset=0, N_truncate=0, val_prop=0.0):
+def get_timeslot_power_full(n_batches, dataset_spec, outpath, timeslot, stride=1, T=10, img_channels=2, img_height=1024, img_width=32, mat_type=0, batch_offset=0, N_truncate=0, val_prop=0.0, chunk_size=1000):
     # iterate through batches, store:
     # 1. running min and max of single timeslot
     # 2. power for each timeslot
-    assert(len(dataset_spec) == 5)
-    dataset_str, dataset_tail, dataset_key, dataset_full_key, val_split = dataset_spec
-
-    H_down_min_pre = 0
-    H_down_max_pre = 0
-    H_down_min = 0
-    H_down_max = 0
-    H_down_f_min_pre = 0
-    H_down_f_max_pre = 0
-    H_down_f_min = 0
-    H_down_f_max = 0
-    H_down_ta_min_pre = 0
-    H_down_ta_max_pre = 0
-    H_down_ta_min = 0
-    H_down_ta_max = 0
-
-    for batch in range(n_batches):
-        true_batch = batch + batch_offset
-        batch_str = f"{dataset_str}{true_batch}{dataset_tail}"
-        print(f"--- Adding batch #{batch} from {batch_str} ---")
-        if mat_type == 0:
-            with h5py.File(batch_str, 'r') as f:
-                x_t = np.transpose(f[dataset_full_key][()], [3,2,1,0])
-                f.close()
-        elif mat_type == 1:
-            mat = sio.loadmat(batch_str)
-            x_t = mat[dataset_full_key]
-            x_t = np.reshape(x_t, (x_t.shape[0], img_channels, img_height, img_width))
-        else:
-            print("--- Unrecognized mat_type ---")
-            return None
-        if batch == 0:
-            samples, T, img_height, img_width = x_t.shape # complex data
-
-        # slice target timeslot
-        print(f"pre-slice shape: {x_t.shape}") # should yield (batch, T, n_del, n_spa)
-        x_t = x_t[:,timeslot,:,:]
-        print(f"post-slice shape: {x_t.shape}") # should yield (batch, n_del, n_spa)
-
-        # freq-spatial domain
-        x_f = np.fft.fft(x_t.view("complex"), axis=1)
-        x_f_re = np.expand_dims(np.real(x_f.view("complex")).astype('float32'),axis=1) # real portion
-        x_f_im = np.expand_dims(np.imag(x_f.view("complex")).astype('float32'),axis=1) # imag portion
-        x_f = np.concatenate((x_f_re,x_f_im),axis=1)
-        x_f = np.reshape(x_f, (samples, -1))
-        pow_down_f = np.sqrt(np.sum(x_f**2, axis=1))
-        if batch == 0:
-            pow_down_f_acc = pow_down_f
-        else:
-            pow_down_f_acc = np.concatenate([pow_down_f_acc, pow_down_f], axis=0)
-
-        # delay-angular domain
-        x_ta = np.fft.fft(x_t.view("complex"), axis=2)
-        if N_truncate > 0:    
-            x_ta = x_ta[:,:N_truncate,:]
-        x_ta_re = np.expand_dims(np.real(x_ta.view("complex")).astype('float32'),axis=1) # real portion
-        x_ta_im = np.expand_dims(np.imag(x_ta.view("complex")).astype('float32'),axis=1) # imag portion
-        x_ta = np.concatenate((x_ta_re,x_ta_im),axis=1)
-        x_ta = np.reshape(x_ta, (samples, -1))
-        pow_down_ta = np.sqrt(np.sum(x_ta**2, axis=1))
-        if batch == 0:
-            pow_down_ta_acc = pow_down_ta
-        else:
-            pow_down_ta_acc = np.concatenate([pow_down_ta_acc, pow_down_ta], axis=0)
-
-        # delay-spatial (native)
-        x_re = np.expand_dims(np.real(x_t.view("complex")).astype('float32'),axis=1) # real portion
-        x_im = np.expand_dims(np.imag(x_t.view("complex")).astype('float32'),axis=1) # imag portion
-        x_t = np.concatenate((x_re,x_im),axis=1)
-        if N_truncate > 0:    
-            x_t = x_t[:,:N_truncate,:]
-        x_t = np.reshape(x_t, (samples, -1))
-        pow_down = np.sqrt(np.sum(x_t**2, axis=1))
-        if batch == 0:
-            pow_down_acc = pow_down
-        else:
-            pow_down_acc = np.concatenate([pow_down_acc, pow_down], axis=0)
-        
-        # pow_up = np.sqrt(np.sum(H_t_up**2, axis=1))
-        # pow_t1_down = pow_down[:,0]
-        # print(f"pow_t1_down range: {np.min(pow_t1_down)} to {np.max(pow_t1_down)} -- pow_t1_down.shape: {pow_t1_down.shape}")
-        # pow_t1_down_f = pow_down_f[:,0]
-        # print(f"pow_t1_down_f range: {np.min(pow_t1_down_f)} to {np.max(pow_t1_down_f)} -- pow_t1_down.shape: {pow_t1_down_f.shape}")
-
-        # second, iterate over each timeslot, normalize by pow_t1, and calculate extrema per timeslot
-
-        # somehow, this might be the problem?
-        norm_down = x_t / pow_down[:,None]
-        norm_f_down = x_f / pow_down_f[:,None]
-        norm_ta_down = x_ta / pow_down_ta[:,None]
-
-        H_down_min = np.min([np.min(norm_down), H_down_min])
-        H_down_max = np.max([np.max(norm_down), H_down_max])
-        H_down_min_pre = np.min([np.min(x_t), H_down_min_pre])
-        H_down_max_pre = np.max([np.max(x_t), H_down_max_pre])
-
-        H_down_f_min = np.min([np.min(norm_f_down), H_down_f_min])
-        H_down_f_max = np.max([np.max(norm_f_down), H_down_f_max])
-        H_down_f_min_pre = np.min([np.min(x_f), H_down_f_min_pre])
-        H_down_f_max_pre = np.max([np.max(x_f), H_down_f_max_pre])
-
-        H_down_ta_min = np.min([np.min(norm_ta_down), H_down_ta_min])
-        H_down_ta_max = np.max([np.max(norm_ta_down), H_down_ta_max])
-        H_down_ta_min_pre = np.min([np.min(x_ta), H_down_ta_min_pre])
-        H_down_ta_max_pre = np.max([np.max(x_ta), H_down_ta_max_pre])
-        print(f"t{timeslot+1} - H_down range: {H_down_min} to {H_down_max} - H_down_pre range: {H_down_min_pre} to {H_down_max_pre} ")
-        print(f"t{timeslot+1} - H_down_f_pre range: {H_down_f_min_pre} to {H_down_f_max_pre} - H_down_f range: {H_down_f_min} to {H_down_f_max}")
-        print(f"t{timeslot+1} - H_down_ta_pre range: {H_down_ta_min_pre} to {H_down_ta_max_pre} - H_down_ta range: {H_down_ta_min} to {H_down_ta_max}")
-
-        del x_t, x_f
-        
-    print(f"t{timeslot+1}: sph_min={H_down_min} - sph_max={H_down_max} - pre_min={H_down_min_pre} - pre_max={H_down_max_pre}")
-
-    # save power for delay-spatial domain (all)
-    pickle_dict = {"pow_down": pow_down_acc}
-    fname = f"H_t{timeslot+1}_power" if N_truncate == 0 else f"H_t{timeslot+1}_power_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(pickle_dict, f)
-        f.close()
-
-    # save power for delay-spatial domain (validation)
-    if val_prop > 0:
-        n_val = int(pow_down_acc.shape[0]*val_prop)
-        pickle_dict = {"pow_down": pow_down_acc[n_val:]}
-        fname = f"H_t{timeslot+1}_power" if N_truncate == 0 else f"H_t{timeslot+1}_power_Nt_{N_truncate}"
-        with open(f"{outpath}/{fname}_val.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-    # save power for freq-spatial domain (all)
-    pickle_dict = {"pow_down": pow_down_f_acc}
-    with open(f"{outpath}/H_t{timeslot+1}_freq_power.pkl", "wb") as f:
-        pickle.dump(pickle_dict, f)
-        f.close()
-
-    # save power for delay-angular domain (all)
-    pickle_dict = {"pow_down": pow_down_ta_acc}
-    fname = f"H_t{timeslot+1}_delang_power" if N_truncate == 0 else f"H_t{timeslot+1}_delang_power_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(pickle_dict, f)
-        f.close()
-
-    # save power for delay-spatial domain (validation)
-    if val_prop > 0:
-        n_val = int(pow_down_acc.shape[0]*val_prop)
-        pickle_dict = {"pow_down": pow_down_acc[n_val:]}
-        fname = f"H_t{timeslot+1}_delang_power" if N_truncate == 0 else f"H_t{timeslot+1}_delang_power_Nt_{N_truncate}"
-        with open(f"{outpath}/{fname}_val.pkl", "wb") as f:
-            pickle.dump(pickle_dict, f)
-            f.close()
-
-    # delay-spatial - sph extrema
-    extrema_dict = {"H_down_ext": [[H_down_min], [H_down_max]]}
-    fname = "H_timeslot_extrema_sph" if N_truncate == 0 else f"H_timeslot_extrema_sph_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # delay-spatial - minmax extrema
-    extrema_dict_pre = {"H_down_ext": [[H_down_min_pre], [H_down_max_pre]]}
-    fname = "H_timeslot_extrema_pre" if N_truncate == 0 else f"H_timeslot_extrema_pre_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
-
-    # freq-spatial - sph extrema
-    extrema_dict = {"H_down_ext": [[H_down_f_min], [H_down_f_max]]}
-    with open(f"{outpath}/H_timeslot_extrema_sph_freq.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # freq-spatial - minmax extrema
-    extrema_dict_pre = {"H_down_ext": [[H_down_f_min_pre], [H_down_f_max_pre]]}
-    with open(f"{outpath}/H_timeslot_extrema_pre_freq.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
-
-    # delay-angular - sph extrema
-    extrema_dict = {"H_down_ext": [[H_down_ta_min], [H_down_ta_max]]}
-    fname = "H_timeslot_extrema_sph_delang" if N_truncate == 0 else f"H_timeslot_extrema_sph_delang_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(extrema_dict, f)
-        f.close()
-
-    # delay-angular - minmax extrema
-    extrema_dict_pre = {"H_down_ext": [[H_down_ta_min_pre], [H_down_ta_max_pre]]}
-    fname = "H_timeslot_extrema_pre_delang" if N_truncate == 0 else f"H_timeslot_extrema_pre_delang_Nt_{N_truncate}"
-    with open(f"{outpath}/{fname}.pkl", "wb") as f:
-        pickle.dump(extrema_dict_pre, f)
-        f.close()
\ No newline at end of file
+    stats = stream_stats_full(n_batches, dataset_spec, timeslots=[timeslot], mat_type=mat_type, batch_offset=batch_offset, N_truncate=N_truncate, img_channels=img_channels, img_height=img_height, img_width=img_width, T=T, chunk_size=chunk_size)
+    write_stats_timeslot_full(stats, outpath, timeslot, val_prop=val_prop)
@@ -1,25 +1,45 @@
 import torch
 
-def b_trace(b_mat, eye):	 
-    """
-    apply trace to each matrix/batch in tensor
+def b_trace(b_mat):
+	"""
+	apply trace to each matrix/batch in tensor
+
+	parameters:
+	-> b_mat = (B, N, N) B batches of N x N matrices which
+	        to take the trace of
+
+	output:
+	-> out = (B,) trace of all B matrices in tensor
+	"""
+	return torch.sum(torch.diagonal(b_mat, dim1=-2, dim2=-1), dim=-1)
+
+
+def b_fro2(V):
+	"""
+	squared Frobenius norm of each matrix in tensor, equal to $ \text{Tr}(\mathbf V\mathbf V^H)$
+	without forming $ \mathbf V\mathbf V^H$
 
 	parameters:
-    -> b_mat = (B, N, N) B batches of N x N matrices which
-            to take the trace of
-    -> eye = (B, N, N) batched identity matrix; allocated
-            before calling to avoid creating new tensors 
-            at runtime
+	-> V = (N x M) or (B x N x M)
+
+	output:
+	-> out = scalar or (B,)
+	"""
+	return torch.sum(torch.real(V)**2 + torch.imag(V)**2, dim=(-2,-1)) if torch.is_complex(V) else torch.sum(V**2, dim=(-2,-1))
 
-    output:
-    -> out = (B,) trace of all B matrices in tensor
-    """
-    b_diag = torch.mul(eye, b_mat)
-    b_trace = torch.sum(b_diag.view(b_diag.size(0),-1), axis=1)
-    return b_trace
+
+def hermitian_solve(A, X):
+	"""
+	solve A Y = X for Hermitian positive definite A (batched); Cholesky, with torch.linalg.solve as
+	fallback if any A is not numerically positive definite
+	"""
+	L, info = torch.linalg.cholesky_ex(A)
+	if torch.any(info != 0):
+		return torch.linalg.solve(A, X)
+	return torch.cholesky_solve(X, L)
 
 
-def zero_forcing(H, P, eye=None):
+def zero_forcing(H, P):
 	"""
 	return zero forcing (ZF) precoder and power constant based on channel 
 	response and power constraint. Precoder defs from Sohrabi, Foad, and 
@@ -27,20 +47,45 @@ def zero_forcing(H, P, eye=None):
 	Feedback and Multiuser Precoding in FDD Massive MIMO." 2020-07.
 	
 	torch implementation
+
+	ZF precoder def:
+	$ \mathbf V = \mathbf H^H(\mathbf H\mathbf H^H)^{-1}$, computed as $ (\mathbf H\mathbf H^H)^{-1}\mathbf H$ by solve
+
+	parameters:
+	-> H = (K x M) or (B x K x M) channel response
+	-> P = power constraint
 	"""
-	if len(H.size()) == 2:
-		H_inv = torch.linalg.inv(torch.matmul(H, torch.conj(H).T))
-		V = torch.matmul(np.conj(H.T), H_inv) # hermitian
-		gamma = 1 / torch.sqrt(P*torch.trace(torch.matmul(V, torch.conj(V.T)))) # get power constraint
-	if len(H.size()) == 3:
-		assert(not eye is None)
-		H_inv = torch.linalg.inv(torch.matmul(H, torch.conj(torch.transpose(H, 1, 2))))
-		V = torch.matmul(torch.conj(torch.transpose(H, 1, 2)), H_inv) # hermitian
-		gamma = 1 / torch.sqrt(P*b_trace(torch.matmul(V, torch.conj(torch.transpose(V, 1, 2))), eye)) # get power constraint
+	return regularized_zero_forcing(H, P, alpha=0)
+
+
+def regularized_zero_forcing(H, P, sigma=None, alpha=None):
+	"""
+	return regularized zero forcing (RZF/MMSE) precoder and power constant
+
+	torch implementation
+
+	RZF precoder def:
+	$ \mathbf V = \mathbf H^H(\mathbf H\mathbf H^H + \alpha\mathbf I)^{-1}$
+
+	parameters:
+	-> H = (K x M) or (B x K x M) channel response
+	-> P = power constraint
+	-> sigma = additive noise power; alpha defaults to K*sigma/P (MMSE)
+	-> alpha = regularization; alpha = 0 gives ZF
+	"""
+	H_h = torch.conj(torch.transpose(H, -2, -1))
+	A = torch.matmul(H, H_h)
+	if type(alpha) == type(None):
+		K = H.size(-2)
+		alpha = K * sigma / P
+	if alpha != 0:
+		A = A + alpha * torch.eye(A.size(-1), dtype=A.dtype, device=A.device)
+	V = torch.conj(torch.transpose(hermitian_solve(A, H), -2, -1)) # A hermitian -> V = (A^{-1} H)^H
+	gamma = 1 / torch.sqrt(P*b_fro2(V)) # get power constraint
 	return [gamma, V]
 
 
-def maximal_ratio_transmission(H, P, eye=None):
+def maximal_ratio_transmission(H, P):
 	"""
 	return maximal ratio transmission (MRT) precoder and power constant based on channel 
 	response and power constraint. Precoder defs from Sohrabi, Foad, and 
@@ -59,17 +104,28 @@ def maximal_ratio_transmission(H, P, eye=None):
 	-> H = (B x M x K) or (M x K) channel response
 	-> P = power constraint
 	"""
-	if len(H.size()) == 2:
-		V = torch.conj(H.T) # hermitian
-		gamma = 1 / torch.sqrt(P*torch.trace(torch.matmul(V, torch.conj(V.T)))) # get power constraint
-	if len(H.size()) == 3:
-		assert(not eye is None)
-		V = torch.conj(torch.transpose(H,1,2)) # hermitian
-		foo = torch.matmul(V, torch.conj(torch.transpose(V, 1, 2)))
-		gamma = 1 / torch.sqrt(P*b_trace(foo, eye)) # get power constraint
+	V = torch.conj(torch.transpose(H, -2, -1)) # hermitian
+	gamma = 1 / torch.sqrt(P*b_fro2(V)) # get power constraint
 	return [gamma, V]
 
 
+def gain_matrix(H, V):
+	"""
+	return gains between every user and every precoder in one matmul
+
+	$ G_{kj} = |\mathbf h_k^H \mathbf v_j|^2$, i.e. $ G = |\mathbf H^H \mathbf V^T|^2$
+
+	parameters:
+	-> H = (M x K) or (B x M x K) channel response
+	-> V = (K x M) or (B x K x M) precoding matrix
+
+	output:
+	-> G = (K x K) or (B x K x K); row k = user, column j = precoder
+	"""
+	H_h = torch.conj(torch.transpose(H, -2, -1))
+	return torch.abs(torch.matmul(H_h, torch.transpose(V, -2, -1)))**2
+
+
 def sum_rate(H, V, sigma):
 	"""
 	return user rate given channel, precoder, and noise level. Defs from Sohrabi, Foad, and 
@@ -79,54 +135,24 @@ def sum_rate(H, V, sigma):
 	torch implementation
 
 	rate def for user k:
-	$ R_k = \log_2(1 + \frac{|\mathbf h_k^H \mathbf v_k|^2}{\sum_{j\neq k}|\mathbf h_j^H \mathbf v_j|^2 + \sigma^2})
+	$ R_k = \log_2(1 + \frac{|\mathbf h_k^H \mathbf v_k|^2}{\sum_{j\neq k}|\mathbf h_k^H \mathbf v_j|^2 + \sigma^2})
 
 	sum rate def for all users:
 	$ R = \sum_k^K R_k$ 
 
+	signal is the diagonal of the gain matrix G (see gain_matrix), interference is the row sum of G minus its diagonal
+
 	parameters:
 	-> H = (M x K) or (B x M x K) channel response
-	-> V = (K x M) precoding matrix
+	-> V = (K x M) or (B x K x M) precoding matrix
 	-> sigma = additive noise power
 	"""
+	G = gain_matrix(H, V)
+	signal = torch.diagonal(G, dim1=-2, dim2=-1)
+	interf = torch.clamp(torch.sum(G, dim=-1) - signal, min=0) # clamp rounding error when interference is nulled (ZF)
+	rate = torch.sum(torch.log2(1 + (signal / (interf + sigma))), dim=-1)
 	if len(H.size()) == 2:
-		M, K = H.size()
-		rate = 0 
-		signal_list = []
-		interf_list = []
-	elif len(H.size()) == 3:
-		B, M, K = H.size() # batch size
-		rate = torch.zeros(B,1).squeeze()
-		signal_list = torch.zeros(B,K)
-		interf_list = torch.zeros(B,K)
-	for k in range(K):
-		if len(H.size()) == 2:
-			h_k = torch.conj(H[:,k].T)
-			r_user = torch.abs(torch.dot(V[k,:], h_k))**2
-			if k == 0:
-				V_temp = V[k+1:,:]
-			elif k == K-1:
-				V_temp = V[:k,:]
-			else:
-				V_temp = torch.cat([V[:k,:], V[k+1:,:]])
-			r_int = torch.sum(torch.abs(torch.matmul(V_temp, h_k))**2) # interference term
-			rate += torch.log2(1 + (r_user / (r_int + sigma)))
-			signal_list.append(r_user.numpy())
-			interf_list.append(r_int.numpy())
-		elif len(H.size()) == 3:
-			h_k = torch.conj(H[:,:,k])
-			r_user = torch.abs(torch.sum(torch.mul(V[:,k,:], h_k), axis=1))**2
-			if K > 1:
-				if k == 0:
-					V_temp = V[:,k+1:,:]
-				elif k == K-1:
-					V_temp = V[:,:k,:]
-				else:
-					V_temp = torch.cat([V[:,:k,:], V[:,k+1:,:]], axis=1)
-				r_int = torch.abs(torch.sum(torch.matmul(V_temp, h_k.unsqueeze(2)), axis=1))**2 # interference term
-			else:
-				r_int =  torch.zeros(r_user.size())
-			rate = rate + torch.log2(1 + (r_user / (r_int.squeeze() + sigma)))
-			signal_list[:,k] = r_user
-			interf_list[:,k] = r_int.squeeze()
-	return [signal_list, interf_list, rate]
\ No newline at end of file
+		signal_list = [r_user.numpy() for r_user in signal]
+		interf_list = [r_int.numpy() for r_int in interf]
+		return [signal_list, interf_list, rate]
+	return [signal, interf, rate]
@@ -1,28 +1,210 @@
+import os
+import csv
+import sys
+import json
 import time
+import threading
+import contextlib
 import numpy as np
 
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 # timer class for timing projecting time-to-finish
 class Timer(object):
-    def __init__(self,name=None, verbosity=1):
+    def __init__(self,name=None, verbosity=1, profiler=None):
+        """
+        wall clock timer for repeated segments (with timer: ...)
+        profiler -> if not None, each segment is also recorded as a span named self.name (see Profiler)
+        """
         self.name = name
         self.finished = 0
         self.times = []
         self.verbosity = verbosity
-    
+        self.profiler = profiler
+        self.span = None
+
     def __enter__(self):
-        self.tstart = time.time()
-    
+        if type(self.profiler) != type(None):
+            self.span = self.profiler.span(self.name)
+            self.span.__enter__()
+        self.tstart = time.perf_counter()
+
     def __exit__(self, type, value, traceback):
-        self.elapsed = time.time() - self.tstart
+        self.elapsed = time.perf_counter() - self.tstart
         self.times.append(self.elapsed)
+        if self.span is not None:
+            self.span.__exit__(type, value, traceback)
+            self.span = None
         if self.verbosity == 1:
            self.print_times()
-    
+
     def get_times(self):
         return self.times
 
     def print_times(self):
         print('--- {} -> Segment Time: {:5.2f}s - Total Time: {:5.2f}s ---'.format(self.name, self.elapsed, np.sum(self.times)))
-    
+
     def set_verbosity(self, verbosity):
-        self.verbosity = verbosity
\ No newline at end of file
+        self.verbosity = verbosity
+
+def rss_mb():
+    # current resident set size of this process (MB); None if unavailable
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+            f.close()
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def rss_peak_mb():
+    # process high-water mark (MB); ru_maxrss is in KB on linux, bytes on macOS
+    if resource is None:
+        return None
+    scale = 1.0 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+class Span(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        prof = self.profiler
+        if prof.sync is not None:
+            prof.sync()
+        prof.stack.append(self.name)
+        self.path = "/".join(prof.stack)
+        self.depth = len(prof.stack) - 1
+        self.rss_start = rss_mb() if prof.record_mem else None
+        self.cpu_start = time.process_time() if prof.record_cpu else None
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        prof = self.profiler
+        if prof.sync is not None:
+            prof.sync()
+        t_end = time.perf_counter()
+        record = {
+            "path": self.path,
+            "name": self.name,
+            "depth": self.depth,
+            "start_s": self.t_start - prof.t0,
+            "duration_s": t_end - self.t_start,
+            "cpu_s": time.process_time() - self.cpu_start if prof.record_cpu else None,
+            "rss_mb": None,
+            "rss_delta_mb": None,
+            "rss_peak_mb": None,
+        }
+        if prof.record_mem:
+            rss_end = rss_mb()
+            record["rss_mb"] = rss_end
+            record["rss_delta_mb"] = rss_end - self.rss_start if rss_end is not None and self.rss_start is not None else None
+            record["rss_peak_mb"] = rss_peak_mb()
+        prof.records.append(record)
+        prof.stack.pop()
+
+class Profiler(object):
+    def __init__(self, record_cpu=True, record_mem=False, sync=None, enabled=True):
+        """
+        hierarchical wall clock profiler; spans nest by call order, e.g.
+            with prof.span("epoch"):
+                with prof.span("step"):
+                    with prof.span("forward"): ...
+        is recorded under paths "epoch", "epoch/step", "epoch/step/forward"
+        record_cpu -> record process CPU time per span
+        record_mem -> record RSS at span exit, change in RSS over span and process peak RSS (MB)
+        sync -> callable run at span boundaries, e.g. torch.cuda.synchronize so spans include queued GPU work
+        enabled -> False makes span() a no-op
+        spans are recorded per profiler; use one profiler per thread
+        """
+        self.record_cpu = record_cpu
+        self.record_mem = record_mem
+        self.sync = sync
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.records = []
+        self.stack = []
+        self.t0 = time.perf_counter()
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else contextlib.nullcontext()
+
+    def summary(self):
+        """
+        aggregate records by path, in order of first start
+        returns dict path -> {count, total_s, mean_s, max_s, cpu_s, frac} with frac = share of parent's total time
+        """
+        summ = {}
+        for r in self.records:
+            s = summ.setdefault(r["path"], {"name": r["name"], "depth": r["depth"], "start_s": r["start_s"], "count": 0, "total_s": 0.0, "max_s": 0.0, "cpu_s": 0.0 if self.record_cpu else None})
+            s["start_s"] = min(s["start_s"], r["start_s"])
+            s["count"] += 1
+            s["total_s"] += r["duration_s"]
+            s["max_s"] = max(s["max_s"], r["duration_s"])
+            if self.record_cpu:
+                s["cpu_s"] += r["cpu_s"]
+        roots = sum(s["total_s"] for s in summ.values() if s["depth"] == 0)
+        for path, s in summ.items():
+            s["mean_s"] = s["total_s"] / s["count"]
+            parent = path.rsplit("/", 1)[0] if "/" in path else None
+            denom = summ[parent]["total_s"] if parent in summ else roots
+            s["frac"] = s["total_s"] / denom if denom > 0 else None
+        # children are recorded before their parents close; order so each path follows its parent
+        return dict(sorted(summ.items(), key=lambda kv: (kv[1]["start_s"], kv[1]["depth"])))
+
+    def print_summary(self):
+        print(f"--- {'span':<40} {'count':>8} {'total (s)':>10} {'mean (s)':>10} {'% parent':>9} ---")
+        for path, s in self.summary().items():
+            name = "  "*s["depth"] + s["name"]
+            frac = f"{100*s['frac']:8.1f}%" if s["frac"] is not None else f"{'-':>9}"
+            print(f"--- {name:<40} {s['count']:>8} {s['total_s']:>10.4f} {s['mean_s']:>10.4f} {frac} ---")
+
+    def to_chrome_trace(self, file_loc):
+        """
+        write spans as chrome trace event json (complete events), viewable in chrome://tracing or perfetto
+        """
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        for r in self.records:
+            args = {k: r[k] for k in ["path", "cpu_s", "rss_mb", "rss_delta_mb", "rss_peak_mb"] if r[k] is not None}
+            events.append({"name": r["name"], "cat": "span", "ph": "X", "ts": 1e6*r["start_s"], "dur": 1e6*r["duration_s"], "pid": pid, "tid": tid, "args": args})
+        with open(file_loc, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+            f.close()
+
+    def to_csv(self, file_loc, summary=False):
+        """
+        write one row per span (or, with summary=True, one row per path from summary())
+        """
+        if summary:
+            rows = [dict(path=path, **s) for path, s in self.summary().items()]
+            fields = ["path", "name", "depth", "count", "total_s", "mean_s", "max_s", "cpu_s", "frac"]
+        else:
+            rows = self.records
+            fields = ["path", "name", "depth", "start_s", "duration_s", "cpu_s", "rss_mb", "rss_delta_mb", "rss_peak_mb"]
+        with open(file_loc, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+            f.close()
+
+def get_span(timers):
+    """
+    span factory from an optional "profiler" entry in a timers dict; no-op spans if absent
+    """
+    profiler = timers.get("profiler", None) if type(timers) == dict else None
+    return profiler.span if type(profiler) != type(None) else (lambda name: contextlib.nullcontext())
@@ -1,5 +1,8 @@
+import os
 import sys
 import copy
+import concurrent.futures
+import contextlib
 import torch
 import pickle
 import numpy as np
@@ -7,9 +10,10 @@ from tqdm import tqdm
 from torch import nn, optim, autograd
 
 sys.path.append("/home/mdelrosa/git/brat")
-from utils.NMSE_performance import get_NMSE, denorm_H3, denorm_H4, denorm_sphH4, denorm_sph_magH3, denorm_magH3
-from utils.data_tools import dataset_pipeline, subsample_batches, split_complex, load_pow_diff
+from utils.NMSE_performance import get_NMSE, NormContext, NMSEAccumulator
+from utils.data_tools import dataset_pipeline, subsample_batches, split_complex, load_pow_diff, as_loader
 from utils.unpack_json import get_keys_from_json
+from utils.timing import get_span
 
 from prettytable import PrettyTable
 
@@ -28,12 +32,202 @@ def count_parameters(model):
     print(f"Total Trainable Params: {total_params}")
     return total_params
 
-def fit(model, train_ldr, valid_ldr, batch_num, schedule=None, criterion=nn.MSELoss(), epochs=10, timers=None, json_config=None, debug_flag=True, pickle_dir=".", input_type="split", patience=5000, network_name=None):
+def save_state(state, file_loc):
+    # write then rename, so a checkpoint interrupted mid-save never replaces the previous one
+    torch.save(state, f"{file_loc}.{os.getpid()}.tmp")
+    os.replace(f"{file_loc}.{os.getpid()}.tmp", file_loc)
+
+class CheckpointManager(object):
+    def __init__(self, every=1, save_path=None):
+        """
+        keep latest/best model weights in reusable CPU buffers instead of deep-copying the model
+        every -> snapshot latest weights every `every` epochs (and whenever forced, e.g. last epoch)
+        save_path -> if not None, best weights are saved here on a background thread; a failed save is re-raised by wait()
+        buffers are allocated on the first snapshot and overwritten in place afterwards
+        """
+        self.every = every
+        self.save_path = save_path
+        self.latest = None
+        self.best = None
+        self.latest_epoch = None
+        self.executor = None
+        self.pending = None
+
+    def snapshot(self, state, buf):
+        # copy tensors of state (params and buffers) into buf (allocated if None)
+        with torch.no_grad():
+            if buf is None:
+                buf = {k: torch.empty_like(v, device="cpu") for k, v in state.items()}
+            for k, v in state.items():
+                buf[k].copy_(v)
+        return buf
+
+    def update_latest(self, model, epoch, force=False):
+        if force or (epoch+1) % self.every == 0:
+            self.latest = self.snapshot(model.state_dict(), self.latest)
+            self.latest_epoch = epoch
+        return self.latest
+
+    def update_best(self, model, epoch):
+        self.wait() # previous save may still be reading the best buffer
+        # weights have not changed since the latest snapshot if it was taken this epoch; copy on host
+        src = self.latest if self.latest_epoch == epoch else model.state_dict()
+        self.best = self.snapshot(src, self.best)
+        if self.save_path is not None:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.pending = self.executor.submit(save_state, self.best, self.save_path)
+        return self.best
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result() # re-raises any exception from save_state
+
+def get_exec_mode(json_config, precision=None, compile_mode=None):
+    """
+    execution mode for fit()/score(); arguments override the json_config keys
+    -> "precision": "fp32" (default) or "bf16" (autocast forward and loss to bfloat16)
+    -> "compile_mode": None (default, eager), "default", "reduce-overhead" or "max-autotune" (see torch.compile)
+    """
+    json_precision, json_compile_mode = get_keys_from_json(json_config, keys=["precision", "compile_mode"], defaults={"precision": "fp32", "compile_mode": None})
+    precision = json_precision if precision == None else precision
+    compile_mode = json_compile_mode if compile_mode == None else compile_mode
+    assert(precision in ["fp32", "bf16"])
+    return [precision, compile_mode]
+
+def autocast_ctx(model, precision):
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=next(model.parameters()).device.type, dtype=torch.bfloat16)
+
+def compile_model(model, compile_mode):
+    """
+    forward callable for model; torch.compile'd unless compile_mode is None
+    the compiled module shares parameters with model -- save/load state through model itself (compiled state_dict keys are prefixed)
+    compile once and pass the result to fit()/score() as fwd to reuse it across calls
+    """
+    if compile_mode in [None, False, "none"]:
+        return model
+    return torch.compile(model, mode=None if compile_mode in [True, "default"] else compile_mode)
+
+def fp32_forward(model, model_in):
+    # fp32 eager reference forward pass for execution mode checks
+    with torch.no_grad():
+        return model(model_in)
+
+def check_exec_mode(y_hat, y_hat_fp32, y_test, tol_db=0.1):
+    """
+    compare NMSE (dB, normalized domain) of y_hat from the selected execution mode against fp32 eager predictions y_hat_fp32
+    returns [nmse_mode, nmse_fp32]; warns if they differ by more than tol_db
+    """
+    y_test = y_test.detach().to("cpu").float().numpy()
+    nmse_mode = get_NMSE(y_hat.detach().to("cpu").float().numpy(), y_test)
+    nmse_fp32 = get_NMSE(y_hat_fp32.numpy(), y_test)
+    return report_exec_check(nmse_mode, nmse_fp32, tol_db=tol_db)
+
+def report_exec_check(nmse_mode, nmse_fp32, tol_db=0.1):
+    print(f"-> execution mode check | NMSE = {nmse_mode:5.3f}dB | fp32 eager NMSE = {nmse_fp32:5.3f}dB | diff = {nmse_mode-nmse_fp32:5.3f}dB")
+    if abs(nmse_mode - nmse_fp32) > tol_db:
+        print(f"--- WARNING: execution mode NMSE differs from fp32 eager by more than {tol_db}dB ---")
+    return [nmse_mode, nmse_fp32]
+
+def predict_batches(model, ldr, precision="fp32", fwd=None):
+    """
+    one forward pass per batch of ldr, without grad; yields (idx_s, idx_e, y_hat, y_test, model_in) with y_hat/y_test on model's device
+    y_test is the target channel h_input[:,1,:,:].unsqueeze(1), as in fit(); model_in is the batch as passed to fwd
+    fwd -> forward callable (e.g. from compile_model); defaults to model
+    """
+    fwd = model if fwd is None else fwd
+    model.training = False
+    model.eval()
+    idx_s = 0
+    for data_tuple in ldr:
+        h_input = data_tuple if len(data_tuple) != 2 else data_tuple[1]
+        model_in = h_input if len(data_tuple) != 2 else [data_tuple[0], h_input]
+        idx_e = idx_s + h_input.shape[0]
+        with torch.no_grad(), autocast_ctx(model, precision): # not held across yield, so interleaved generators are safe
+            out = fwd(model_in)
+        yield idx_s, idx_e, out, h_input[:,1,:,:].unsqueeze(1), model_in
+        idx_s = idx_e
+
+def score_batches(model, valid_ldr, data_val, norm_ctx, norm_range, denorm_timeslot, precision="fp32", fwd=None, torch_type=torch.float, n_train=0, pow_diff_t=None, data_phase=None, tol_db=None):
+    """
+    denormalize and score valid_ldr batch by batch, as score() does on the full estimates, without holding y_hat/y_test
+    tol_db -> if not None, also run an fp32 eager forward pass on each batch and compare normalized-domain NMSE, as check_exec_mode does
+    returns [mse, nmse, mse_full, nmse_full, exec_nmse] (*_full are None if pow_diff_t is None; exec_nmse = [nmse_mode, nmse_fp32] or None)
+    """
+    acc = NMSEAccumulator()
+    acc_full = NMSEAccumulator() if type(pow_diff_t) != type(None) else None
+    acc_mode = NMSEAccumulator() if type(tol_db) != type(None) else None
+    acc_fp32 = NMSEAccumulator() if type(tol_db) != type(None) else None
+    for idx_s, idx_e, out, target, model_in in predict_batches(model, valid_ldr, precision=precision, fwd=fwd):
+        if type(tol_db) != type(None):
+            target_np = target.detach().to("cpu").float().numpy()
+            acc_mode.update(out.detach().to("cpu").float().numpy(), target_np)
+            acc_fp32.update(fp32_forward(model, model_in).to("cpu").float().numpy(), target_np)
+        if idx_e <= n_train:
+            continue
+        y_hat = torch.empty((idx_e-idx_s,)+tuple(data_val.shape[1:]), dtype=torch_type)
+        y_test = torch.empty(y_hat.shape, dtype=torch_type)
+        y_hat[:], y_test[:] = out.to("cpu"), target.to("cpu") # broadcast as into score()'s buffers
+        y_hat, y_test = y_hat.numpy(), y_test.numpy()
+        if norm_range in ["norm_sph_magH3", "norm_magH3"]:
+            y_test = np.concatenate((y_test[:,0:1], data_phase[0][idx_s:idx_e]), axis=1)
+            y_hat = np.concatenate((y_hat[:,0:1], data_phase[1][idx_s:idx_e]), axis=1)
+        y_hat = norm_ctx.denorm(y_hat, timeslot=denorm_timeslot, idx=slice(idx_s, idx_e))
+        y_test = norm_ctx.denorm(y_test, timeslot=denorm_timeslot, idx=slice(idx_s, idx_e))
+        i_s = max(n_train-idx_s, 0) # drop training samples
+        y_hat = y_hat[i_s:,0,:,:] + 1j*y_hat[i_s:,1,:,:]
+        y_test = y_test[i_s:,0,:,:] + 1j*y_test[i_s:,1,:,:]
+        acc.update(y_hat, y_test)
+        if type(acc_full) != type(None):
+            acc_full.update(y_hat, y_test, pow_diff=pow_diff_t[idx_s+i_s:idx_e])
+    mse, nmse = acc.result(return_mse=True)
+    mse_full, nmse_full = acc_full.result(return_mse=True) if type(acc_full) != type(None) else [None, None]
+    exec_nmse = report_exec_check(acc_mode.result(), acc_fp32.result(), tol_db=tol_db) if type(tol_db) != type(None) else None
+    return [mse, nmse, mse_full, nmse_full, exec_nmse]
+
+class LossAccumulator(object):
+    def __init__(self):
+        """
+        running sum of detached losses, kept on the loss's device
+        update() never syncs with the host; mean() does (one .item() call)
+        """
+        self.total = None
+        self.count = 0
+
+    def update(self, loss):
+        loss = loss.detach()
+        self.total = loss.clone() if self.total is None else self.total.add_(loss)
+        self.count += 1
+
+    def mean(self):
+        return self.total.item() / self.count if self.count > 0 else float("nan")
+
+def fit(model, train_ldr, valid_ldr, batch_num, schedule=None, criterion=nn.MSELoss(), epochs=10, timers=None, json_config=None, debug_flag=True, pickle_dir=".", input_type="split", patience=5000, network_name=None, checkpoint_every=None, log_every=None, precision=None, compile_mode=None, fwd=None):
+    """
+    train_ldr, valid_ldr -> loaders, or in-memory tensors/arrays, which are batched with CSIBatchLoader (see as_loader)
+    precision, compile_mode -> execution mode, see get_exec_mode
+    fwd -> forward callable from compile_model(model, compile_mode), to share one compiled module with score(); None compiles here
+    checkpoint_every -> epochs between snapshots of latest weights; if None, read "checkpoint_every" from json_config (default 1)
+    log_every -> steps between progress bar loss updates (each one syncs with the device); if None, read "log_every" from json_config (default 100)
+    """
     # pull out timers
     fit_timer = timers["fit_timer"] 
+    span = get_span(timers) # nested profiling spans if timers["profiler"] is given
 
     # load hyperparms
     network_name = get_keys_from_json(json_config, keys=["network_name"])[0] if network_name == None else network_name
+    checkpoint_every = get_keys_from_json(json_config, keys=["checkpoint_every"], defaults={"checkpoint_every": 1})[0] if checkpoint_every == None else checkpoint_every
+    log_every = get_keys_from_json(json_config, keys=["log_every"], defaults={"log_every": 100})[0] if log_every == None else log_every
+    precision, compile_mode = get_exec_mode(json_config, precision=precision, compile_mode=compile_mode)
+    fwd = compile_model(model, compile_mode) if fwd is None else fwd
+    batch_size = get_keys_from_json(json_config, keys=["batch_size"], defaults={"batch_size": 200})[0] # only used to batch in-memory data
+    device = next(model.parameters()).device
+    train_ldr = as_loader(train_ldr, batch_size, shuffle=True, device=device)
+    valid_ldr = as_loader(valid_ldr, batch_size, device=device)
+    ckpt = CheckpointManager(every=checkpoint_every, save_path=None if debug_flag else f"{pickle_dir}/{network_name}-best-model.pt")
 
     # criterion = nn.MSELoss()
     # TODO: if we use lr_schedule, then do we need to use SGD instead? 
@@ -68,129 +262,153 @@ def fit(model, train_ldr, valid_ldr, batch_num, schedule=None, criterion=nn.MSEL
 
     with fit_timer:
         for epoch in range(epochs):
-            train_loss = 0
-            model.training = True
-            # for i, data_batch in enumerate(tqdm(train_ldr, desc=f"Epoch #{epoch+1}"), 0):
-            for i, data_tuple in enumerate(tqdm(train_ldr, desc=f"Epoch #{epoch+1}"), 0):
-                # inputs = autograd.Variable(data_batch).float()
-                # print(f"len(data_tuple): {len(data_tuple)}")
-                if len(data_tuple) != 2:
-                    data_batch = data_tuple
-                # elif len(data_tuple) == 2:
-                else:
-                    aux_batch, data_batch = data_tuple
-                    aux_input = autograd.Variable(aux_batch)
-                h_input = autograd.Variable(data_batch)
-                optimizer.zero_grad()
-                model_in = h_input if len(data_tuple) != 2 else [aux_input, h_input]
-                dec = model(model_in)
-                mse = criterion(dec, h_input[:,1,:,:].unsqueeze(1)) #TODO: remove indices; is this compatible with other models? (CsiNetPro?)
-                train_loss += mse
-                mse.backward()
-                # torch.nn.utils.clip_grad_norm_(model.parameters(), clip_val) # clip
-                optimizer.step()
-                # l = loss.data[0]
-                # l = loss
-                # print(f"loss.data: {loss.data} -- type(loss): {type(loss)}")
-                if (i != 0):
-                    tqdm.write(f"\033[A                                                         \033[A")
-                tqdm_str = f"Epoch #{epoch+1}/{epochs}: Training loss: {mse.data:.5E}"
-                tqdm.write(tqdm_str)
-            # post training step, dump to checkpoint
-            checkpoint["model"] = copy.deepcopy(model).to("cpu").state_dict()
-            optimizer_state = copy.deepcopy(optimizer.state_dict())
-            checkpoint["latest_epoch"] = epoch
-            history["train_loss"][epoch] = train_loss.detach().to("cpu").numpy() / (i+1)
-
-            # validation step
-            # model.training = False # optionally check just the MSE performance during eval
-            with torch.no_grad():
-                test_loss = 0
-                # for i, data_batch in enumerate(valid_ldr):
-                for i, data_tuple in enumerate(valid_ldr):
-                    # inputs = autograd.Variable(data_batch).float()
-                    if len(data_tuple) != 2:
-                        data_batch = data_tuple
-                    # elif len(data_tuple) == 2:
+            with span("epoch"):
+                train_loss = LossAccumulator()
+                model.training = True
+                with span("train"):
+                    # for i, data_batch in enumerate(tqdm(train_ldr, desc=f"Epoch #{epoch+1}"), 0):
+                    pbar = tqdm(train_ldr, desc=f"Epoch #{epoch+1}/{epochs}", mininterval=1.0)
+                    for i, data_tuple in enumerate(pbar, 0):
+                        with span("step"):
+                            # inputs = autograd.Variable(data_batch).float()
+                            # print(f"len(data_tuple): {len(data_tuple)}")
+                            if len(data_tuple) != 2:
+                                data_batch = data_tuple
+                            # elif len(data_tuple) == 2:
+                            else:
+                                aux_batch, data_batch = data_tuple
+                                aux_input = autograd.Variable(aux_batch)
+                            h_input = autograd.Variable(data_batch)
+                            optimizer.zero_grad()
+                            model_in = h_input if len(data_tuple) != 2 else [aux_input, h_input]
+                            with span("forward"), autocast_ctx(model, precision):
+                                dec = fwd(model_in)
+                                mse = criterion(dec, h_input[:,1,:,:].unsqueeze(1)) #TODO: remove indices; is this compatible with other models? (CsiNetPro?)
+                            train_loss.update(mse)
+                            with span("backward"):
+                                mse.backward()
+                            # torch.nn.utils.clip_grad_norm_(model.parameters(), clip_val) # clip
+                            with span("optimizer"):
+                                optimizer.step()
+                            # l = loss.data[0]
+                            # l = loss
+                            # print(f"loss.data: {loss.data} -- type(loss): {type(loss)}")
+                            if (i+1) % log_every == 0:
+                                pbar.set_postfix_str(f"Training loss: {train_loss.mean():.5E}", refresh=False) # tqdm redraws at most every mininterval
+                # post training step, dump to checkpoint
+                with span("checkpoint"):
+                    checkpoint["model"] = ckpt.update_latest(model, epoch, force=(epoch == epochs-1))
+                checkpoint["latest_epoch"] = ckpt.latest_epoch # epoch of checkpoint["model"]; lags epoch if checkpoint_every > 1
+                history["train_loss"][epoch] = train_loss.mean()
+
+                # validation step
+                # model.training = False # optionally check just the MSE performance during eval
+                with torch.no_grad(), span("validate"):
+                    test_loss = LossAccumulator()
+                    # for i, data_batch in enumerate(valid_ldr):
+                    for i, data_tuple in enumerate(valid_ldr):
+                        # inputs = autograd.Variable(data_batch).float()
+                        if len(data_tuple) != 2:
+                            data_batch = data_tuple
+                        # elif len(data_tuple) == 2:
+                        else:
+                            aux_batch, data_batch = data_tuple
+                            aux_input = autograd.Variable(aux_batch)
+                        h_input = autograd.Variable(data_batch)
+                        optimizer.zero_grad()
+                        model_in = h_input if len(data_tuple) != 2 else [aux_input, h_input]
+                        with autocast_ctx(model, precision):
+                            dec = fwd(model_in)
+                            mse = criterion(dec, h_input[:,1,:,:].unsqueeze(1))
+                        test_loss.update(mse)
+                    history["test_loss"][epoch] = test_loss.mean()
+                    # if epoch >= grace_period:
+                    if type(best_test_loss) == type(None) or best_test_loss > history["test_loss"][epoch]:
+                        best_test_loss = history["test_loss"][epoch]
+                        checkpoint["best_epoch"] = epoch
+                        checkpoint["best_model"] = ckpt.update_best(model, epoch) # saved asynchronously if not debug_flag
+                        epochs_no_improvement = 0
+                        print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- New best epoch: {epoch+1}")
+                    elif epochs_no_improvement < patience:
+                        epochs_no_improvement += 1
+                        print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- Test loss did not improve. Best epoch: #{checkpoint['best_epoch']+1}")
                     else:
-                        aux_batch, data_batch = data_tuple
-                        aux_input = autograd.Variable(aux_batch)
-                    h_input = autograd.Variable(data_batch)
-                    optimizer.zero_grad()
-                    model_in = h_input if len(data_tuple) != 2 else [aux_input, h_input]
-                    dec = model(model_in)
-                    mse = criterion(dec, h_input[:,1,:,:].unsqueeze(1))
-                    test_loss += mse
-                history["test_loss"][epoch] = test_loss.detach().to("cpu").numpy() / (i+1)
-                # if epoch >= grace_period:
-                if type(best_test_loss) == type(None) or best_test_loss > history["test_loss"][epoch]:
-                    best_test_loss = history["test_loss"][epoch]
-                    checkpoint["best_epoch"] = epoch
-                    checkpoint["best_model"] = copy.deepcopy(model).to("cpu").state_dict()
-                    epochs_no_improvement = 0
-                    if not debug_flag:
-                        torch.save(checkpoint["best_model"], f"{pickle_dir}/{network_name}-best-model.pt")
-                    print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- New best epoch: {epoch+1}")
-                elif epochs_no_improvement < patience:
-                    epochs_no_improvement += 1
-                    print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- Test loss did not improve. Best epoch: #{checkpoint['best_epoch']+1}")
-                else:
-                    model.load_state_dict(checkpoint["best_model"])
-                    if not debug_flag:
-                        torch.save(checkpoint["best_model"], f"{pickle_dir}/{network_name}-best-model.pt")
-                    print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- Test loss did not improve for {patience} epochs. Loading best epoch #{checkpoint['best_epoch']+1}")
-                    break
-                # else:
-                #     # don't track best epoch until grace period has expired
-                #     print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E}. Grace period is {grace_period} epochs.")
-                checkpoint["latest_model"] = copy.deepcopy(model).to("cpu").state_dict()
-                tqdm.write(f"Epoch #{epoch+1}/{epochs}: Training loss: {history['train_loss'][epoch]:.5E} -- Test loss: {history['test_loss'][epoch]:.5E}")
-
-                if schedule != None:
-                    lr_scheduler.step()
-                    print(lr_scheduler.state_dict())
+                        # snapshot the final weights before restoring best, so latest_model is current and never None
+                        checkpoint["model"] = checkpoint["latest_model"] = ckpt.update_latest(model, epoch, force=True)
+                        checkpoint["latest_epoch"] = ckpt.latest_epoch
+                        model.load_state_dict(checkpoint["best_model"]) # already saved when it became best
+                        print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E} -- Test loss did not improve for {patience} epochs. Loading best epoch #{checkpoint['best_epoch']+1}")
+                        break
+                    # else:
+                    #     # don't track best epoch until grace period has expired
+                    #     print(f"Epoch #{epoch+1}/{epochs}: Test loss: {history['test_loss'][epoch]:.5E}. Grace period is {grace_period} epochs.")
+                    checkpoint["latest_model"] = checkpoint["model"] # weights unchanged by validation
+                    tqdm.write(f"Epoch #{epoch+1}/{epochs}: Training loss: {history['train_loss'][epoch]:.5E} -- Test loss: {history['test_loss'][epoch]:.5E}")
 
+                    if schedule != None:
+                        lr_scheduler.step()
+                        print(lr_scheduler.state_dict())
+
+    ckpt.wait() # finish pending best-model save
     return [model, checkpoint, history, optimizer, timers]
 
-def score(model, valid_ldr, data_val, batch_num, checkpoint, history, optimizer, timeslot=0, err_dict=None, timers=None, json_config=None, debug_flag=True, str_mod="", torch_type=torch.float, n_train=0, pow_diff_t=None, data_phase=None, thresh_idx_path=False):
+def score(model, valid_ldr, data_val, batch_num, checkpoint, history, optimizer, timeslot=0, err_dict=None, timers=None, json_config=None, debug_flag=True, str_mod="", torch_type=torch.float, n_train=0, pow_diff_t=None, data_phase=None, thresh_idx_path=False, precision=None, compile_mode=None, keep_outputs=True, fwd=None):
     """
     take model, predict on valid_ldr, score
     currently scores a spherically normalized dataset
+    valid_ldr -> loader, or in-memory tensor/array, which is batched with CSIBatchLoader (see as_loader)
+    precision, compile_mode -> execution mode, see get_exec_mode; non-default modes are checked against
+    fp32 eager NMSE with tolerance "exec_check_tol_db" from json_config (default 0.1dB)
+    fwd -> forward callable from compile_model(model, compile_mode), e.g. the one passed to fit(); None compiles here
+    keep_outputs -> False: score batch by batch (see score_batches) and return None for y_hat/y_test; requires err_dict=None
     """
 
     # pull out timers
     predict_timer = timers["predict_timer"]
     score_timer = timers["score_timer"]
+    span = get_span(timers)
 
     batch_size, minmax_file, norm_range = get_keys_from_json(json_config, keys=["batch_size", "minmax_file", "norm_range"])
+    precision, compile_mode = get_exec_mode(json_config, precision=precision, compile_mode=compile_mode)
+    fwd = compile_model(model, compile_mode) if fwd is None else fwd
+    valid_ldr = as_loader(valid_ldr, batch_size, device=next(model.parameters()).device)
+    t1_power_file = get_keys_from_json(json_config, keys=["t1_power_file"])[0] if norm_range in ["norm_sphH4", "norm_sph_magH3"] else None
+    norm_ctx = NormContext(norm_range, minmax_file, t1_power_file=t1_power_file, thresh_idx_path=thresh_idx_path if norm_range == "norm_sphH4" else False)
+    denorm_timeslot = 0 if norm_range in ["norm_H3", "norm_H4"] else timeslot # minmax norms are scored on global extrema
+
+    exec_check = precision != "fp32" or fwd is not model
+    tol_db = get_keys_from_json(json_config, keys=["exec_check_tol_db"], defaults={"exec_check_tol_db": 0.1})[0] if exec_check else None
+
+    if not keep_outputs:
+        assert(type(err_dict) == type(None))
+        if norm_range in ["norm_sph_magH3", "norm_magH3"]:
+            assert(type(data_phase) != type(None))
+        with score_timer: # prediction and scoring are interleaved
+            mse, nmse, mse_full, nmse_full, exec_nmse = score_batches(model, valid_ldr, data_val, norm_ctx, norm_range, denorm_timeslot, precision=precision, fwd=fwd, torch_type=torch_type, n_train=n_train, pow_diff_t=pow_diff_t, data_phase=data_phase, tol_db=tol_db)
+        if exec_check:
+            checkpoint["exec_nmse"], checkpoint["exec_nmse_fp32"] = exec_nmse
+        print(f"-> {str_mod} - truncate | NMSE = {nmse:5.3f} | MSE = {mse:.4E}")
+        checkpoint["best_nmse"] = nmse
+        checkpoint["best_mse"] = mse
+        if type(pow_diff_t) != type(None):
+            print(f"-> {str_mod} - all | NMSE = {nmse_full:5.3f} | MSE = {mse_full:.4E}")
+            checkpoint["best_nmse_full"] = nmse_full
+            checkpoint["best_mse_full"] = mse_full
+        return [checkpoint, None, None]
 
     with predict_timer:
-        # y_hat = torch.zeros(data_val.shape).to(device)
-        # y_test = torch.zeros(data_val.shape).to(device)
-        model.training = False
-        model.eval()
-        with torch.no_grad():
-            y_hat = torch.zeros(data_val.shape, dtype=torch_type).to("cpu")
-            y_test = torch.zeros(data_val.shape, dtype=torch_type).to("cpu")
-            for i, data_tuple in enumerate(valid_ldr):
-                # inputs = autograd.Variable(data_batch).float()
-                if len(data_tuple) != 2:
-                    data_batch = data_tuple
-                # elif len(data_tuple) == 2:
-                else:
-                    aux_batch, data_batch = data_tuple
-                    aux_input = autograd.Variable(aux_batch)
-                h_input = autograd.Variable(data_batch)
-                model_in = h_input if len(data_tuple) != 2 else [aux_input, h_input]
-            # for i, data_batch in enumerate(valid_ldr):
-            #     # inputs = autograd.Variable(data_batch).float()
-            #     inputs = autograd.Variable(data_batch)
-                optimizer.zero_grad()
-                idx_s = i*batch_size
-                idx_e = min((i+1)*batch_size, y_hat.shape[0])
-                temp = model(model_in)
-                y_hat[idx_s:idx_e,:,:,:] = model(model_in).to("cpu")
-                y_test[idx_s:idx_e,:,:,:] = h_input[:,1,:,:].unsqueeze(1).to("cpu")
+        # preallocated outputs, written by slice; one forward pass per batch
+        # zero-filled: rows valid_ldr does not cover (e.g. drop_last) must not be scored as uninitialized memory
+        y_hat = torch.zeros(data_val.shape, dtype=torch_type)
+        y_test = torch.zeros(data_val.shape, dtype=torch_type)
+        y_hat_fp32 = torch.zeros(data_val.shape, dtype=torch.float) if exec_check else None
+        for idx_s, idx_e, out, target, model_in in predict_batches(model, valid_ldr, precision=precision, fwd=fwd):
+            y_hat[idx_s:idx_e] = out.to("cpu")
+            y_test[idx_s:idx_e] = target.to("cpu")
+            if exec_check: # reference on the same batch, no second pass over valid_ldr
+                y_hat_fp32[idx_s:idx_e] = fp32_forward(model, model_in).to("cpu")
+        if exec_check:
+            checkpoint["exec_nmse"], checkpoint["exec_nmse_fp32"] = check_exec_mode(y_hat, y_hat_fp32, y_test, tol_db=tol_db)
 
     # for markovnet, we add "addend" to the error to get our actual estimates
     if type(err_dict) != type(None):            
@@ -225,29 +443,14 @@ def score(model, valid_ldr, data_val, batch_num, checkpoint, history, optimizer,
             y_test = y_test[:,0,:,:].unsqueeze(1)
         print('-> pre denorm: y_hat range is from {} to {}'.format(np.min(y_hat.detach().numpy()), np.max(y_hat.detach().numpy())))
         print('-> pre denorm: y_test range is from {} to {}'.format(np.min(y_test.detach().numpy()),np.max(y_test.detach().numpy())))
-        if norm_range == "norm_H3":
-            y_hat_denorm = denorm_H3(y_hat.detach().numpy(),minmax_file)
-            y_test_denorm = denorm_H3(y_test.detach().numpy(),minmax_file)
-        elif norm_range == "norm_H4":
-            y_hat_denorm = denorm_H4(y_hat.to("cpu").detach().numpy(),minmax_file)
-            y_test_denorm = denorm_H4(y_test.to("cpu").detach().numpy(),minmax_file)
-        elif norm_range == "norm_sphH4":
-            t1_power_file = get_keys_from_json(json_config, keys=["t1_power_file"])[0]
-            y_hat_denorm = denorm_sphH4(y_hat.detach().numpy(),minmax_file, t1_power_file, batch_num, timeslot=timeslot, thresh_idx_path=thresh_idx_path)
-            y_test_denorm = denorm_sphH4(y_test.detach().numpy(),minmax_file, t1_power_file, batch_num, timeslot=timeslot, thresh_idx_path=thresh_idx_path)
-        elif norm_range == "norm_sph_magH3":
+        if norm_range in ["norm_sph_magH3", "norm_magH3"]:
             assert(type(data_phase) != type(None))
-            t1_power_file = get_keys_from_json(json_config, keys=["t1_power_file"])[0]
             y_test = np.concatenate((y_test.detach().numpy(), data_phase[0]), axis=1)
-            y_test_denorm = denorm_sph_magH3(y_test,minmax_file, t1_power_file, batch_num, timeslot=timeslot)
             y_hat = np.concatenate((y_hat.detach().numpy(), data_phase[1]), axis=1)
-            y_hat_denorm = denorm_sph_magH3(y_hat,minmax_file, t1_power_file, batch_num, timeslot=timeslot)
             # y_hat = np.concatenate((np.expand_dims(y_hat[:,0,:,:], axis=1), data_phase[0]), axis=1) # return hat with non-quantized phase
-        elif norm_range == "norm_magH3":
-            y_test = np.concatenate((y_test.detach().numpy(), data_phase[0]), axis=1)
-            y_test_denorm = denorm_magH3(y_test, minmax_file, timeslot=timeslot)
-            y_hat = np.concatenate((y_hat.detach().numpy(), data_phase[1]), axis=1)
-            y_hat_denorm = denorm_magH3(y_hat, minmax_file, timeslot=timeslot)
+        with span("denorm"):
+            y_hat_denorm = norm_ctx.denorm(y_hat if type(y_hat) == np.ndarray else y_hat.to("cpu").detach().numpy(), timeslot=denorm_timeslot)
+            y_test_denorm = norm_ctx.denorm(y_test if type(y_test) == np.ndarray else y_test.to("cpu").detach().numpy(), timeslot=denorm_timeslot)
         # predicted on pooled data -- split out validation set
         print('-> post denorm: y_hat range is from {} to {}'.format(np.min(y_hat_denorm),np.max(y_hat_denorm)))
         print('-> post denorm: y_test range is from {} to {}'.format(np.min(y_test_denorm),np.max(y_test_denorm)))
@@ -257,7 +460,8 @@ def score(model, valid_ldr, data_val, batch_num, checkpoint, history, optimizer,
         y_hat_denorm = y_hat_denorm[:,0,:,:] + 1j*y_hat_denorm[:,1,:,:]
         y_test_denorm = y_test_denorm[:,0,:,:] + 1j*y_test_denorm[:,1,:,:]
         y_shape = y_test_denorm.shape
-        mse, nmse = get_NMSE(y_hat_denorm, y_test_denorm, return_mse=True, n_ang=y_shape[1], n_del=y_shape[2]) # one-step prediction -> estimate of single timeslot
+        with span("nmse"):
+            mse, nmse = get_NMSE(y_hat_denorm, y_test_denorm, return_mse=True, n_ang=y_shape[1], n_del=y_shape[2]) # one-step prediction -> estimate of single timeslot
         print(f"-> {str_mod} - truncate | NMSE = {nmse:5.3f} | MSE = {mse:.4E}")
         checkpoint["best_nmse"] = nmse
         checkpoint["best_mse"] = mse
@@ -277,6 +481,7 @@ def save_predictions(model, ldr, data, optimizer, timers, err_dict=None, json_co
     # pull out timers
     predict_timer = timers["predict_timer"]
     batch_size, network_name, base_pickle = get_keys_from_json(json_config, keys=["batch_size", "network_name", "base_pickle"])
+    ldr = as_loader(ldr, batch_size, device=next(model.parameters()).device)
 
     # make predictions, y_hat
     with predict_timer:
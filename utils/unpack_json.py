@@ -74,13 +74,14 @@ def get_norm_range(json_config):
         print("norm_range: {}".format(norm_range)) 
         return norm_range 
 
-def get_keys_from_json(json_config,keys=[],is_bool=False):
+def get_keys_from_json(json_config,keys=[],is_bool=False,defaults=None):
+    # defaults -> dict of values for optional keys missing from json_config
     assert len(keys) > 0, "No keys provided"
     out = []
     with open(json_config) as json_file:
         data = json.load(json_file)
         for key in keys:
-            temp = data[key]
+            temp = data[key] if type(defaults) == type(None) or key in data else defaults[key]
             if is_bool:
                 temp = True if temp==1 else False # handle conversion to bool
             out.append(temp)